@@ -0,0 +1,93 @@
+"""
+Armazenamento das fotos pelo conteúdo.
+
+Cada conteúdo recebido (SHA-256 dos bytes do upload) vira um único arquivo em
+UPLOAD_DIR/blobs/{2 primeiros dígitos do hash}/{hash}{extensão}, registrado em ArquivoFoto.
+Um motorista com conexão ruim que reenvia a mesma foto não grava outro arquivo nem passa
+pelo Pillow de novo: o upload só calcula o hash (enquanto grava o temporário) e a nova Foto
+aponta para o arquivo que já existe. Reenviada para a mesma coleta, a foto existente é
+devolvida e não conta de novo no limite de fotos.
+
+ArquivoFoto.referencias conta as Fotos que usam o arquivo; a limpeza das fotos antigas
+(cleanup_old_photos.py) e o arquivamento (app.arquivo) só apagam o arquivo (e as derivadas)
+quando a última Foto sai.
+Fotos gravadas antes deste armazenamento (caminho usuario_id/arquivo) não têm ArquivoFoto:
+continuam valendo e são apagadas como antes.
+"""
+import os
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import insert_com_upsert
+from app.derivadas import remover_derivadas
+from app.modelos import ArquivoFoto
+
+PASTA_ARQUIVOS = "blobs"
+
+
+def caminho_por_hash(hash_conteudo: str, extensao: str) -> str:
+    """Caminho (relativo a UPLOAD_DIR) do arquivo de um conteúdo"""
+    return f"{PASTA_ARQUIVOS}/{hash_conteudo[:2]}/{hash_conteudo}{extensao}"
+
+
+def caminho_existente(db: Session, hash_conteudo: str):
+    """Caminho do arquivo já guardado com esse conteúdo, ou None"""
+    return db.query(ArquivoFoto.caminho).filter(ArquivoFoto.hash == hash_conteudo).scalar()
+
+
+def adicionar_referencia(db: Session, hash_conteudo: str, extensao: str, tamanho: int):
+    """
+    Registra mais uma Foto usando o conteúdo `hash_conteudo`, criando o ArquivoFoto se ainda
+    não existe (INSERT ... ON CONFLICT DO NOTHING: dois uploads simultâneos do mesmo conteúdo
+    criam um só). Não faz commit. Retorna (caminho, novo): com novo=True quem chamou deve
+    colocar o arquivo no caminho; com novo=False o arquivo já existe ou está sendo processado
+    """
+    valores = {
+        "hash": hash_conteudo,
+        "caminho": caminho_por_hash(hash_conteudo, extensao),
+        "referencias": 1,
+        "tamanho": tamanho
+    }
+    insert = insert_com_upsert(db.get_bind())
+    if insert is None:
+        # Banco sem ON CONFLICT: a chave primária rejeita o INSERT repetido
+        try:
+            with db.begin_nested():
+                db.add(ArquivoFoto(**valores))
+            return valores["caminho"], True
+        except IntegrityError:
+            pass
+    elif db.execute(
+        insert(ArquivoFoto).values(**valores).on_conflict_do_nothing().returning(ArquivoFoto.hash)
+    ).scalar() is not None:
+        return valores["caminho"], True
+
+    db.query(ArquivoFoto).filter(ArquivoFoto.hash == hash_conteudo).update(
+        {"referencias": ArquivoFoto.referencias + 1}, synchronize_session=False
+    )
+    return caminho_existente(db, hash_conteudo), False
+
+
+def remover_referencias(db: Session, caminho: str, quantidade: int = 1) -> bool:
+    """
+    Desconta `quantidade` Fotos removidas do arquivo `caminho`. Não faz commit.
+    Retorna True se o arquivo não é mais usado (apagar o arquivo e as derivadas)
+    """
+    arquivo = db.query(ArquivoFoto).filter(ArquivoFoto.caminho == caminho).with_for_update().first()
+    if arquivo is None:
+        return True  # foto anterior ao armazenamento por conteúdo: arquivo só dela
+    arquivo.referencias -= quantidade
+    if arquivo.referencias > 0:
+        return False
+    db.delete(arquivo)
+    return True
+
+
+def apagar_arquivo(caminho: str) -> bool:
+    """Apaga o arquivo que ficou sem Fotos e as derivadas dele. Retorna False se o arquivo não existia"""
+    remover_derivadas(caminho)
+    try:
+        os.remove(os.path.join(settings.UPLOAD_DIR, caminho))
+    except FileNotFoundError:
+        return False
+    return True
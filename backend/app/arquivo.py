@@ -0,0 +1,245 @@
+"""
+Arquivo frio de coletas encerradas (Parquet, particionado por mês da devolução).
+
+Coletas devolvidas há mais de ARCHIVE_AFTER_DAYS saem das tabelas quentes
+(coletas, viagens, fotos) e vão para arquivos Parquet compactados em
+ARCHIVE_DIR/<tabela>/mes=YYYY-MM/lote_<identificador>.parquet. A tabela km_diario
+não é arquivada, então os relatórios de resumo continuam completos; os relatórios
+que listam coletas juntam as linhas do arquivo quando o período pedido o alcança.
+"""
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import Integer, Float, String, Text, DateTime, Date, Boolean, func
+from sqlalchemy.orm import Session
+from app.armazenamento_fotos import remover_referencias, apagar_arquivo
+from app.cache import incrementar_versao_dados
+from app.config import settings
+from app.modelos import Coleta, Viagem, Foto, LoteArquivo
+from app.utils import TZ_BRASIL
+
+logger = logging.getLogger(__name__)
+
+# As fotos antigas são apagadas do disco por cleanup_old_photos (90 dias) a partir
+# das linhas de fotos; coletas mais novas que isso nunca são arquivadas
+DIAS_MINIMOS_ARQUIVO = 90
+
+TABELAS_ARQUIVO = {
+    "coletas": Coleta.__table__,
+    "viagens": Viagem.__table__,
+    "fotos": Foto.__table__,
+}
+
+TIPOS_PARQUET = {
+    Integer: pa.int64(),
+    Float: pa.float64(),
+    String: pa.string(),
+    Text: pa.string(),
+    DateTime: pa.timestamp("us"),
+    Date: pa.date32(),
+    Boolean: pa.bool_(),
+}
+
+
+def _schema(tabela) -> pa.Schema:
+    """Schema Parquet derivado das colunas do modelo"""
+    campos = []
+    for coluna in tabela.columns:
+        tipo = next(t for classe, t in TIPOS_PARQUET.items() if isinstance(coluna.type, classe))
+        campos.append(pa.field(coluna.name, tipo))
+    return pa.schema(campos)
+
+
+def caminho_lote(nome_tabela: str, mes: str, identificador: str) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, nome_tabela, f"mes={mes}", f"lote_{identificador}.parquet")
+
+
+def _gravar_parquet(caminho: str, tabela, linhas):
+    """Grava as linhas (dicts) em Parquet zstd; o arquivo só aparece completo (.parcial + rename)"""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    parcial = caminho + ".parcial"
+    pq.write_table(pa.Table.from_pylist(linhas, schema=_schema(tabela)), parcial, compression="zstd")
+    os.replace(parcial, caminho)
+
+
+class ArquivamentoConcorrente(Exception):
+    """As coletas do lote foram arquivadas ou alteradas por outro processo durante o arquivamento"""
+
+
+def _em_blocos(ids, tamanho: int = 900):
+    for i in range(0, len(ids), tamanho):
+        yield ids[i:i + tamanho]
+
+
+def _linhas(db: Session, tabela, coluna, ids):
+    linhas = []
+    for bloco in _em_blocos(ids):
+        linhas.extend(dict(linha._mapping) for linha in db.execute(tabela.select().where(coluna.in_(bloco))))
+    return linhas
+
+
+def _apagar(db: Session, tabela, coluna, ids) -> int:
+    apagadas = 0
+    for bloco in _em_blocos(ids):
+        apagadas += db.execute(tabela.delete().where(coluna.in_(bloco))).rowcount
+    return apagadas
+
+
+# ===== ARQUIVAMENTO =====
+
+def _arquivar_mes(db: Session, mes: str, inicio: date, fim: date):
+    """Move as coletas encerradas com devolução em [inicio, fim] (um mês) para um novo lote"""
+    ids = [id_ for (id_,) in db.query(Coleta.id).filter(
+        Coleta.ativo == False,
+        Coleta.data_devolucao_local >= inicio,
+        Coleta.data_devolucao_local <= fim
+    ).order_by(Coleta.id)]
+    if not ids:
+        return None
+
+    coletas = _linhas(db, Coleta.__table__, Coleta.__table__.c.id, ids)
+    viagens = _linhas(db, Viagem.__table__, Viagem.__table__.c.coleta_id, ids)
+    fotos = _linhas(db, Foto.__table__, Foto.__table__.c.coleta_id, ids)
+
+    identificador = uuid.uuid4().hex
+    caminhos = []
+    try:
+        for nome, linhas in (("coletas", coletas), ("viagens", viagens), ("fotos", fotos)):
+            caminho = caminho_lote(nome, mes, identificador)
+            _gravar_parquet(caminho, TABELAS_ARQUIVO[nome], linhas)
+            caminhos.append(caminho)
+
+        # As fotos saem do banco: descontar as referências dos arquivos por conteúdo
+        # (app.armazenamento_fotos); o arquivo que ficou sem fotos é apagado depois do commit
+        sem_referencia = [
+            caminho for caminho, quantidade in Counter(f["caminho"] for f in fotos if f["caminho"]).items()
+            if remover_referencias(db, caminho, quantidade)
+        ]
+        _apagar(db, Foto.__table__, Foto.__table__.c.coleta_id, ids)
+        _apagar(db, Viagem.__table__, Viagem.__table__.c.coleta_id, ids)
+        if _apagar(db, Coleta.__table__, Coleta.__table__.c.id, ids) != len(ids):
+            # Outro processo arquivou (ou alterou) estas coletas ao mesmo tempo: descartar este lote
+            raise ArquivamentoConcorrente(f"coletas do mês {mes} alteradas durante o arquivamento")
+
+        datas = [c["data_devolucao_local"] for c in coletas]
+        lote = LoteArquivo(
+            identificador=identificador,
+            mes=mes,
+            data_inicio=min(datas),
+            data_fim=max(datas),
+            total_coletas=len(coletas),
+            total_viagens=len(viagens),
+            total_fotos=len(fotos)
+        )
+        db.add(lote)
+        incrementar_versao_dados(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for caminho in caminhos:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        raise
+
+    for caminho in sem_referencia:
+        apagar_arquivo(caminho)
+    return lote
+
+
+def arquivar_coletas(db: Session, dias: int = None):
+    """
+    Arquiva as coletas encerradas devolvidas há mais de `dias` (padrão ARCHIVE_AFTER_DAYS),
+    um lote por mês. Retorna a lista de lotes criados.
+    """
+    dias = max(dias if dias is not None else settings.ARCHIVE_AFTER_DAYS, DIAS_MINIMOS_ARQUIVO)
+    limite = datetime.now(TZ_BRASIL).date() - timedelta(days=dias)
+
+    primeira = db.query(func.min(Coleta.data_devolucao_local)).filter(
+        Coleta.ativo == False,
+        Coleta.data_devolucao_local < limite
+    ).scalar()
+    if not primeira:
+        return []
+
+    lotes = []
+    inicio_mes = primeira.replace(day=1)
+    while inicio_mes < limite:
+        proximo_mes = (inicio_mes + timedelta(days=32)).replace(day=1)
+        fim = min(proximo_mes, limite) - timedelta(days=1)
+        try:
+            lote = _arquivar_mes(db, inicio_mes.strftime("%Y-%m"), inicio_mes, fim)
+        except ArquivamentoConcorrente as e:
+            # Vários workers rodam o agendamento: outro já está arquivando
+            logger.warning(f"Arquivamento interrompido: {e}")
+            break
+        if lote:
+            logger.info(f"✓ Arquivo: {lote.mes} - {lote.total_coletas} coletas, {lote.total_viagens} viagens, {lote.total_fotos} fotos")
+            lotes.append(lote)
+        inicio_mes = proximo_mes
+    return lotes
+
+
+# ===== LEITURA =====
+
+def lotes_no_intervalo(db: Session, inicio: date = None, fim: date = None):
+    """Lotes com devoluções que podem cair em [inicio, fim] (None = sem limite)"""
+    consulta = db.query(LoteArquivo)
+    if inicio:
+        consulta = consulta.filter(LoteArquivo.data_fim >= inicio)
+    if fim:
+        consulta = consulta.filter(LoteArquivo.data_inicio <= fim)
+    return consulta.order_by(LoteArquivo.data_inicio, LoteArquivo.id).all()
+
+
+def ler_lotes(nome_tabela: str, lotes, filtro=None):
+    """Lê as linhas (dicts) de uma tabela arquivada nos lotes indicados, com filtro pyarrow opcional"""
+    if not lotes:
+        return []
+    caminhos = [caminho_lote(nome_tabela, lote.mes, lote.identificador) for lote in lotes]
+    dataset = ds.dataset(caminhos, format="parquet", schema=_schema(TABELAS_ARQUIVO[nome_tabela]))
+    return dataset.to_table(filter=filtro).to_pylist()
+
+
+def coletas_arquivadas(db: Session, inicio: date = None, fim: date = None, usuario_id: int = None, veiculo_id: int = None):
+    """
+    Coletas arquivadas com devolução (Brasil) em [inicio, fim], opcionalmente de um
+    motorista ou veículo. Os registros têm os mesmos atributos de Coleta.
+    """
+    lotes = lotes_no_intervalo(db, inicio, fim)
+    if not lotes:
+        return []
+
+    filtro = ds.field("id").is_valid()
+    if inicio:
+        filtro &= ds.field("data_devolucao_local") >= pa.scalar(inicio, pa.date32())
+    if fim:
+        filtro &= ds.field("data_devolucao_local") <= pa.scalar(fim, pa.date32())
+    if usuario_id is not None:
+        filtro &= ds.field("usuario_id") == usuario_id
+    if veiculo_id is not None:
+        filtro &= ds.field("veiculo_id") == veiculo_id
+    return [SimpleNamespace(**linha) for linha in ler_lotes("coletas", lotes, filtro)]
+
+
+def viagens_arquivadas(db: Session, coleta_ids, inicio: date = None, fim: date = None):
+    """Viagens arquivadas das coletas indicadas (mesmos atributos de Viagem)"""
+    lotes = lotes_no_intervalo(db, inicio, fim)
+    if not lotes or not coleta_ids:
+        return []
+    filtro = ds.field("coleta_id").isin(list(coleta_ids))
+    return [SimpleNamespace(**linha) for linha in ler_lotes("viagens", lotes, filtro)]
+
+
+def iterar_arquivo(db: Session, inicio: date = None, fim: date = None):
+    """
+    Percorre o arquivo lote a lote (em ordem de devolução): gera (coletas, viagens) de cada
+    lote que pode ter devoluções em [inicio, fim], como dicts. A memória fica limitada a um lote.
+    """
+    for lote in lotes_no_intervalo(db, inicio, fim):
+        yield ler_lotes("coletas", [lote]), ler_lotes("viagens", [lote])
@@ -0,0 +1,201 @@
+"""
+Cache de resultados dos relatórios administrativos.
+
+A chave de cada resultado inclui a versão global dos dados (tabela versao_dados),
+incrementada logo depois do commit das rotas de escrita. Depois de qualquer escrita
+a versão muda, então nenhum relatório antigo é servido; as entradas antigas
+apenas deixam de ser usadas e saem pelo LRU.
+
+Os relatórios ficam no cache já serializados em JSON (bytes): um acerto devolve os
+bytes direto, sem montar nem serializar o dicionário de novo.
+
+A mesma versão gera o ETag das rotas de leitura mais consultadas: se o cliente envia
+If-None-Match com o ETag atual, a rota responde 304 sem executar a consulta.
+
+Se o incremento depois do commit falhar, o worker limpa o seu cache e tenta de novo a
+cada leitura da versão; até conseguir, calcula os relatórios e não responde 304.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from fastapi import Request, Response
+from sqlalchemy import event, insert as insert_padrao, update
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import insert_com_upsert
+from app.modelos import VersaoDados
+from app.serializacao import json_bytes, resposta_json
+
+logger = logging.getLogger(__name__)
+
+# db.info: a transação alterou dados (incrementar a versão depois do commit)
+CHAVE_VERSAO_ALTERADA = "versao_dados_alterada"
+
+
+# Incremento que falhou depois do commit de uma escrita: refeito na próxima leitura da
+# versão. Enquanto pendente, a versão no banco é antiga e este worker não usa o cache
+# nem responde 304 (relatorio_em_cache, resposta_condicional)
+_incremento_pendente = threading.Event()
+
+
+def versao_dados(db: Session) -> int:
+    """Versão atual dos dados (0 se ainda não houve escrita)"""
+    if _incremento_pendente.is_set():
+        _incrementar_versao(db)
+    versao = db.query(VersaoDados.versao).filter(VersaoDados.id == 1).scalar()
+    return versao or 0
+
+
+def incrementar_versao_dados(db: Session):
+    """
+    Marca a transação da escrita como alteradora dos dados: a versão é incrementada depois
+    do commit (_incrementar_apos_commit), não dentro da transação
+    """
+    db.info[CHAVE_VERSAO_ALTERADA] = True
+
+
+def _incrementar(conexao):
+    agora = datetime.utcnow()
+    insert = insert_com_upsert(conexao)
+    if insert is not None:
+        stmt = insert(VersaoDados).values(id=1, versao=1, atualizado_em=agora)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={"versao": VersaoDados.versao + 1, "atualizado_em": agora}
+        )
+        conexao.execute(stmt)
+        return
+
+    resultado = conexao.execute(
+        update(VersaoDados).where(VersaoDados.id == 1).values(versao=VersaoDados.versao + 1, atualizado_em=agora)
+    )
+    if resultado.rowcount == 0:
+        conexao.execute(insert_padrao(VersaoDados).values(id=1, versao=1, atualizado_em=agora))
+
+
+@event.listens_for(Session, "after_commit")
+def _incrementar_apos_commit(db: Session):
+    """
+    Incrementa a versão numa transação própria e curta, logo depois do commit da escrita.
+    Dentro da transação da escrita, a linha única de versao_dados ficava bloqueada até o
+    commit e serializava todas as escritas dos motoristas (PostgreSQL). Entre o commit e o
+    incremento um leitor pode guardar dados novos sob a versão antiga: o incremento em
+    seguida descarta essa entrada, então nada desatualizado fica no cache
+    """
+    if db.info.pop(CHAVE_VERSAO_ALTERADA, False):
+        _incrementar_versao(db)
+
+
+def _incrementar_versao(db: Session):
+    """
+    Incrementa a versão numa conexão própria. Se falhar, a escrita já está gravada mas a
+    versão não mudou: o cache local é limpo e o incremento fica pendente até dar certo
+    """
+    bind = db.get_bind()
+    engine = getattr(bind, "engine", bind)
+    try:
+        with engine.begin() as conexao:
+            _incrementar(conexao)
+    except Exception as e:
+        logger.error(f"❌ Erro ao incrementar a versão dos dados: {e}")
+        cache_relatorios.limpar()
+        _incremento_pendente.set()
+        return
+    _incremento_pendente.clear()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _descartar_marcacao(db: Session, transacao):
+    # Fim da transação principal sem commit (rollback, close): nada foi gravado
+    if transacao.parent is None:
+        db.info.pop(CHAVE_VERSAO_ALTERADA, None)
+
+
+class CacheRelatorios:
+    """Cache LRU em memória (por worker), limitado em número de itens, com contadores de acerto"""
+
+    def __init__(self, max_itens: int):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.removidos = 0
+
+    def obter_ou_calcular(self, chave, calcular):
+        """Retorna o valor em cache para a chave ou calcula, guarda e retorna"""
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return self._itens[chave]
+            self.misses += 1
+
+        # Calcular fora do lock: relatórios diferentes não bloqueiam uns aos outros
+        valor = calcular()
+
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.removidos += 1
+        return valor
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "removidos": self.removidos,
+                "taxa_acerto": round(self.hits / total, 4) if total else 0
+            }
+
+
+cache_relatorios = CacheRelatorios(settings.REPORT_CACHE_SIZE)
+
+
+def relatorio_em_cache(db: Session, nome: str, parametros: dict, hoje, calcular, response: Response = None):
+    """
+    Retorna a resposta JSON do relatório `nome`, do cache ou calculada na hora.
+    A chave inclui os parâmetros, a data de hoje (períodos relativos) e a versão dos dados.
+    `response` é o parâmetro Response da rota (cabeçalhos como o ETag são mantidos).
+    """
+    chave = (nome, tuple(sorted(parametros.items())), hoje, versao_dados(db))
+    if _incremento_pendente.is_set():
+        return resposta_json(json_bytes(calcular()), response)
+    corpo = cache_relatorios.obter_ou_calcular(chave, lambda: json_bytes(calcular()))
+    return resposta_json(corpo, response)
+
+
+# ===== ETAG (REQUISIÇÕES CONDICIONAIS) =====
+def etag_dados(versao: int, *partes) -> str:
+    """ETag de uma resposta que só muda com a versão dos dados (e com as partes: rota, usuário, dia...)"""
+    chave = hashlib.sha1(":".join(str(parte) for parte in partes).encode()).hexdigest()[:12]
+    return f'W/"{versao}-{chave}"'
+
+
+def resposta_condicional(request: Request, response: Response, etag: str):
+    """
+    Retorna uma resposta 304 se o If-None-Match do cliente contém o ETag atual.
+    Senão coloca o ETag na resposta da rota e retorna None (a rota segue normalmente).
+    Com um incremento da versão pendente o ETag não é confiável: nem 304 nem ETag.
+    """
+    if _incremento_pendente.is_set():
+        response.headers["Cache-Control"] = "no-store"
+        return None
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    recebidos = request.headers.get("if-none-match")
+    if recebidos and (recebidos.strip() == "*" or etag in [valor.strip() for valor in recebidos.split(",")]):
+        return Response(status_code=304, headers=cabecalhos)
+    response.headers.update(cabecalhos)
+    return None
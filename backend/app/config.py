@@ -14,11 +14,56 @@ class Settings(BaseSettings):
     # Upload
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB (aumentado de 10MB)
+    UPLOAD_TMP_DIR: str = "data/uploads_tmp"  # corpo das fotos durante o recebimento (fora de /uploads)
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # bytes acumulados em memória antes de gravar no arquivo temporário
+    
+    # Processamento das fotos (Pillow) em processos separados, por worker
+    PHOTO_PROCESS_WORKERS: int = 1  # por worker do uvicorn (4 workers → 4 processos)
+    PHOTO_QUEUE_MAX: int = 8  # fotos na fila em memória do worker; as excedentes ficam no banco até a recuperação
+    PHOTO_TASKS_PER_PROCESS: int = 200  # processo reiniciado depois de tantas fotos (memória do Pillow)
+    UPLOAD_PENDING_DIR: str = "data/uploads_recebidos"  # fotos aceitas aguardando processamento
+    PHOTO_PROCESSING_LEASE_SECONDS: int = 300  # foto "processando" reservada há mais que isso é retomada
+    PHOTO_RECOVERY_INTERVAL_SECONDS: float = 30
+    PHOTO_MAX_ATTEMPTS: int = 3  # depois disso a foto fica com o arquivo original, sem processar
+    PHOTO_PENDING_MAX: int = 200  # fotos recebidas sem processar (todos os workers); acima disso o upload responde 503
+    PHOTO_DERIVATIVES_DIR: str = "data/derivadas"  # miniaturas e tamanho médio (cache: pode ser apagado)
+    PHOTO_DERIVATIVES_MAX_MB: int = 2048  # acima disso as derivadas menos usadas são apagadas
+    PHOTO_DERIVATIVES_CONCURRENCY: int = 2  # derivadas geradas ao mesmo tempo no acesso, por worker (as demais esperam)
+    PHOTO_DERIVATIVES_WAIT_SECONDS: float = 10  # sem vaga nesse tempo, a rota serve a foto original
     
     # Rate Limiting
     RATE_LIMIT_ENABLED: bool = True
     RATE_LIMIT_PER_MINUTE: int = 60
     
+    # Cache de relatórios (itens por worker, LRU)
+    REPORT_CACHE_SIZE: int = 256
+    
+    # Jobs de relatório em segundo plano (por worker)
+    REPORT_JOBS_DIR: str = "data/relatorios"
+    REPORT_JOB_WORKERS: int = 2
+    REPORT_JOB_MAX_PENDENTES: int = 10  # jobs pendentes/executando em todo o sistema
+    REPORT_JOB_RETENTION_HOURS: int = 24
+    REPORT_JOB_TIMEOUT_MINUTES: int = 60  # depois disso um job parado é marcado como erro
+    
+    # Arquivo frio (Parquet) de coletas encerradas
+    ARCHIVE_DIR: str = "data/arquivo"
+    ARCHIVE_AFTER_DAYS: int = 365  # coletas devolvidas há mais tempo que isso vão para o arquivo
+    
+    # Veículos disponíveis (snapshot por worker; os outros workers convergem neste prazo)
+    VEHICLE_AVAILABILITY_TTL_SECONDS: float = 5
+    
+    # Eventos da frota em tempo real (SSE)
+    EVENTS_POLL_INTERVAL_SECONDS: float = 0.5  # cada worker busca os eventos novos neste intervalo
+    EVENTS_BUFFER_SIZE: int = 500  # eventos recentes em memória (por worker) para retomar conexões
+    EVENTS_RETENTION_HOURS: int = 24
+    EVENTS_KEEPALIVE_SECONDS: float = 15
+    
+    # Sincronização offline: máximo de operações num lote de /api/coleta/sync
+    SYNC_MAX_OPERATIONS: int = 500
+    
+    # Idempotency-Key das rotas de escrita do motorista (repetições dentro deste prazo não reexecutam)
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    
     # Logging
     LOG_LEVEL: str = "INFO"
     
@@ -38,3 +38,13 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def insert_com_upsert(bind):
+    """Retorna a função insert com suporte a ON CONFLICT do banco em uso (PostgreSQL/SQLite) ou None"""
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
@@ -0,0 +1,127 @@
+"""
+Derivadas das fotos (miniatura e tamanho médio) para a galeria do admin.
+
+A galeria mostrava as fotos em 1920px numa grade de miniaturas. As derivadas ficam em
+PHOTO_DERIVATIVES_DIR/{tamanho}/{caminho da foto}.webp (ou .jpg se o Pillow não tiver
+WebP). São geradas junto com a foto final (app.pipeline_fotos) ou, se faltarem (fotos
+antigas, derivada apagada), no primeiro acesso a /api/fotos/derivadas/{tamanho}/{caminho}.
+
+A pasta é um cache: qualquer arquivo pode ser apagado e volta a ser gerado quando pedido.
+limpar_derivadas (scheduler) mantém o total abaixo de PHOTO_DERIVATIVES_MAX_MB apagando as
+menos usadas; a data de modificação do arquivo marca o último uso (atualizada no máximo
+uma vez por USO_RESOLUCAO para não gravar no disco a cada acesso).
+"""
+import logging
+import os
+import time
+from PIL import features
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Lado máximo de cada derivada
+TAMANHOS_DERIVADAS = {
+    "miniatura": 320,
+    "media": 960
+}
+
+FORMATO_DERIVADAS = "webp" if features.check("webp") else "jpeg"
+EXTENSAO_DERIVADAS = ".webp" if FORMATO_DERIVADAS == "webp" else ".jpg"
+MEDIA_TYPE_DERIVADAS = f"image/{FORMATO_DERIVADAS}"
+
+# Intervalo mínimo entre duas marcações de uso do mesmo arquivo
+USO_RESOLUCAO = 3600
+
+# Ao passar do limite, apagar até ficar nesta fração dele (evita limpar a cada execução)
+FRACAO_APOS_LIMPEZA = 0.9
+
+
+def _relativo_seguro(caminho: str) -> str:
+    """Caminho relativo da foto (usuario_id/arquivo), recusando caminhos que saiam da pasta"""
+    normalizado = os.path.normpath(caminho)
+    if os.path.isabs(normalizado) or normalizado == "." or normalizado.startswith(".."):
+        raise ValueError(f"Caminho de foto inválido: {caminho}")
+    return normalizado
+
+
+def caminho_original(caminho: str) -> str:
+    """Arquivo da foto (1920px) no disco"""
+    return os.path.join(settings.UPLOAD_DIR, _relativo_seguro(caminho))
+
+
+def caminho_derivada(tamanho: str, caminho: str) -> str:
+    """Arquivo da derivada `tamanho` da foto no disco"""
+    base, _ = os.path.splitext(_relativo_seguro(caminho))
+    return os.path.join(settings.PHOTO_DERIVATIVES_DIR, tamanho, base + EXTENSAO_DERIVADAS)
+
+
+def derivadas_da_foto(caminho: str):
+    """(lado, arquivo, formato) de cada derivada da foto, no formato de app.fotos.processar_foto"""
+    return [
+        (lado, caminho_derivada(tamanho, caminho), FORMATO_DERIVADAS)
+        for tamanho, lado in TAMANHOS_DERIVADAS.items()
+    ]
+
+
+def urls_foto(caminho: str) -> dict:
+    """URLs da foto e das derivadas, para as respostas da API"""
+    return {
+        "url": f"/uploads/{caminho}",
+        **{f"{tamanho}_url": f"/api/fotos/derivadas/{tamanho}/{caminho}" for tamanho in TAMANHOS_DERIVADAS}
+    }
+
+
+def marcar_uso(arquivo: str):
+    """Atualiza a data de modificação (último uso para a limpeza), se já passou USO_RESOLUCAO"""
+    try:
+        agora = time.time()
+        if agora - os.stat(arquivo).st_mtime > USO_RESOLUCAO:
+            os.utime(arquivo, (agora, agora))
+    except OSError:
+        pass
+
+
+def remover_derivadas(caminho: str):
+    """Apaga as derivadas de uma foto removida"""
+    for _, arquivo, _ in derivadas_da_foto(caminho):
+        try:
+            os.remove(arquivo)
+        except FileNotFoundError:
+            pass
+
+
+def limpar_derivadas(limite_bytes: int = None):
+    """
+    Apaga as derivadas menos usadas até o total ficar abaixo de FRACAO_APOS_LIMPEZA do
+    limite (PHOTO_DERIVATIVES_MAX_MB). Retorna (arquivos apagados, bytes liberados)
+    """
+    limite_bytes = limite_bytes if limite_bytes is not None else settings.PHOTO_DERIVATIVES_MAX_MB * 1024 * 1024
+    arquivos = []
+    total = 0
+    for pasta, _, nomes in os.walk(settings.PHOTO_DERIVATIVES_DIR):
+        for nome in nomes:
+            arquivo = os.path.join(pasta, nome)
+            try:
+                info = os.stat(arquivo)
+            except FileNotFoundError:
+                continue
+            arquivos.append((info.st_mtime, info.st_size, arquivo))
+            total += info.st_size
+
+    if total <= limite_bytes:
+        return 0, 0
+
+    alvo = limite_bytes * FRACAO_APOS_LIMPEZA
+    apagados = liberados = 0
+    for _, tamanho, arquivo in sorted(arquivos):
+        if total <= alvo:
+            break
+        try:
+            os.remove(arquivo)
+        except FileNotFoundError:
+            pass
+        total -= tamanho
+        apagados += 1
+        liberados += tamanho
+    logger.info(f"🗑️ {apagados} derivadas de fotos removidas ({liberados / (1024 * 1024):.1f} MB)")
+    return apagados, liberados
@@ -0,0 +1,76 @@
+"""
+Veículos disponíveis para retirada (ativos e sem coleta ativa).
+
+A lista vem de uma única query (anti-join com as coletas ativas, índice parcial
+uq_coletas_veiculo_ativa) e fica num snapshot em memória por worker. As rotas que
+mudam a disponibilidade (retirada, devolução, cadastro/remoção/KM de veículo)
+invalidam o snapshot do próprio worker depois do commit; os outros workers
+convergem pelo TTL curto (VEHICLE_AVAILABILITY_TTL_SECONDS) ou assim que a rota
+informar uma versão dos dados diferente da versão do snapshot.
+"""
+import threading
+import time
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.modelos import Veiculo, Coleta
+
+
+def consultar_veiculos_disponiveis(db: Session):
+    """Veículos ativos sem coleta ativa de nenhum usuário, no formato da rota /api/coleta/veiculos"""
+    coleta_ativa = exists().where(and_(Coleta.veiculo_id == Veiculo.id, Coleta.ativo == True))
+    veiculos = db.query(Veiculo).filter(Veiculo.ativo == True, ~coleta_ativa).order_by(Veiculo.id)
+    return [
+        {
+            "id": veiculo.id,
+            "placa": veiculo.placa,
+            "modelo": veiculo.modelo,
+            "marca": veiculo.marca,
+            "ano": veiculo.ano,
+            "km_atual": veiculo.km_atual or 0
+        }
+        for veiculo in veiculos
+    ]
+
+
+class DisponibilidadeVeiculos:
+    """Snapshot (por worker) da lista de veículos disponíveis, com TTL e invalidação local"""
+
+    def __init__(self, ttl_segundos: float):
+        self.ttl_segundos = ttl_segundos
+        self._lista = None
+        self._expira_em = 0.0
+        self._versao = None
+        self._geracao = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def listar(self, db: Session, versao: int = None):
+        """Lista do snapshot; `versao` (versão dos dados já lida pela rota) descarta snapshot de outra versão"""
+        with self._lock:
+            mesma_versao = versao is None or versao == self._versao
+            if self._lista is not None and mesma_versao and time.monotonic() < self._expira_em:
+                self.hits += 1
+                return self._lista
+            self.misses += 1
+            geracao = self._geracao
+
+        lista = consultar_veiculos_disponiveis(db)
+
+        with self._lock:
+            # Uma invalidação durante a consulta torna o resultado suspeito: não guardar
+            if geracao == self._geracao:
+                self._lista = lista
+                self._versao = versao
+                self._expira_em = time.monotonic() + self.ttl_segundos
+        return lista
+
+    def invalidar(self):
+        """Descarta o snapshot deste worker. Chamar depois do commit da escrita"""
+        with self._lock:
+            self._geracao += 1
+            self._lista = None
+
+
+disponibilidade_veiculos = DisponibilidadeVeiculos(settings.VEHICLE_AVAILABILITY_TTL_SECONDS)
@@ -0,0 +1,181 @@
+"""
+Eventos da frota em tempo real (Server-Sent Events).
+
+As rotas de escrita gravam um EventoFrota na mesma transação da mudança (registrar_evento).
+Cada worker tem uma única thread que, enquanto houver conexões SSE abertas nele, busca os
+eventos novos no banco a cada EVENTS_POLL_INTERVAL_SECONDS, guarda os mais recentes num
+buffer circular e os repassa às conexões. Um evento gravado por qualquer worker chega aos
+painéis de todos os workers em menos de um segundo; um painel parado não faz requisições
+e o custo no banco é uma consulta por worker por intervalo, não por aba aberta.
+
+Ao reconectar, o EventSource envia o Last-Event-ID: os eventos perdidos vêm do buffer (ou
+do banco, se forem mais antigos que o buffer). Se não der para garantir a sequência, o
+cliente recebe um evento "recarregar" e busca a lista completa uma vez.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.modelos import EventoFrota
+
+logger = logging.getLogger(__name__)
+
+# Eventos gravados há menos que isso são relidos a cada busca: uma transação que termina
+# depois de outra pode tornar visível um id menor que o último já enviado
+JANELA_RELEITURA = timedelta(seconds=5)
+
+
+def registrar_evento(db: Session, tipo: str, **dados):
+    """Grava um evento da frota. Não faz commit: roda na transação da escrita"""
+    db.add(EventoFrota(tipo=tipo, dados=json.dumps(dados)))
+
+
+def _como_dict(evento: EventoFrota):
+    return {"id": evento.id, "tipo": evento.tipo, **json.loads(evento.dados or "{}")}
+
+
+def formatar_sse(evento: dict) -> str:
+    """Evento no formato text/event-stream (o id vira o Last-Event-ID do navegador)"""
+    linhas = f"data: {json.dumps(evento, separators=(',', ':'))}\n\n"
+    if evento.get("id") is not None:
+        linhas = f"id: {evento['id']}\n" + linhas
+    return linhas
+
+
+def eventos_desde(desde_id: int, limite: int = None):
+    """
+    Eventos com id maior que desde_id, lidos do banco (reconexão além do buffer).
+    Retorna None se não der para garantir a sequência (muitos eventos ou já removidos).
+    """
+    limite = limite or settings.EVENTS_BUFFER_SIZE
+    db = SessionLocal()
+    try:
+        menor_id = db.query(func.min(EventoFrota.id)).scalar()
+        if menor_id is not None and desde_id < menor_id - 1:
+            return None  # eventos entre desde_id e menor_id já foram limpos
+        eventos = db.query(EventoFrota).filter(EventoFrota.id > desde_id).order_by(
+            EventoFrota.id
+        ).limit(limite + 1).all()
+        if len(eventos) > limite:
+            return None
+        return [_como_dict(evento) for evento in eventos]
+    finally:
+        db.close()
+
+
+class CanalEventos:
+    """Busca os eventos novos no banco e os distribui às conexões SSE deste worker"""
+
+    def __init__(self, intervalo_segundos: float, tamanho_buffer: int):
+        self.intervalo_segundos = intervalo_segundos
+        self._buffer = deque(maxlen=tamanho_buffer)
+        self._ids_buffer = set()
+        self._ultimo_id = None
+        self._cobre_desde = None  # o buffer tem todos os eventos com id maior que este
+        self._assinantes = {}  # fila (asyncio.Queue) -> event loop da conexão
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def assinar(self, loop, fila, desde_id: int = None):
+        """
+        Registra a conexão. Retorna os eventos depois de desde_id que estão no buffer,
+        ou None se o buffer não cobre desde_id (buscar com eventos_desde)
+        """
+        with self._lock:
+            self._assinantes[fila] = loop
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name="eventos-frota", daemon=True)
+                self._thread.start()
+            if desde_id is None:
+                return []
+            if self._cobre_desde is None or desde_id < self._cobre_desde:
+                return None
+            return [evento for evento in self._buffer if evento["id"] > desde_id]
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.pop(fila, None)
+
+    def parar(self):
+        self._parar.set()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            with self._lock:
+                ocioso = not self._assinantes
+                if ocioso:
+                    # Sem conexões não há o que buscar; ao voltar, recomeça do evento mais recente
+                    self._buffer.clear()
+                    self._ids_buffer.clear()
+                    self._ultimo_id = self._cobre_desde = None
+            if not ocioso:
+                try:
+                    self.buscar_novos()
+                except Exception as e:
+                    logger.error(f"❌ Erro ao buscar eventos da frota: {e}")
+            self._parar.wait(self.intervalo_segundos)
+
+    def buscar_novos(self):
+        db = SessionLocal()
+        try:
+            limite_releitura = datetime.utcnow() - JANELA_RELEITURA
+            if self._ultimo_id is None:
+                # Início: os eventos da janela de releitura já existiam, não são novos
+                ultimo = db.query(func.max(EventoFrota.id)).scalar() or 0
+                recentes = db.query(EventoFrota.id).filter(EventoFrota.criado_em >= limite_releitura).all()
+                with self._lock:
+                    self._ultimo_id = self._cobre_desde = ultimo
+                    self._ids_buffer.update(id_ for id_, in recentes)
+                return
+
+            eventos = db.query(EventoFrota).filter(
+                or_(EventoFrota.id > self._ultimo_id, EventoFrota.criado_em >= limite_releitura)
+            ).order_by(EventoFrota.id).limit(self._buffer.maxlen).all()
+        finally:
+            db.close()
+
+        novos = [_como_dict(evento) for evento in eventos if evento.id not in self._ids_buffer]
+        if not novos:
+            return
+        with self._lock:
+            for evento in novos:
+                if len(self._buffer) == self._buffer.maxlen:
+                    removido = self._buffer.popleft()
+                    self._ids_buffer.discard(removido["id"])
+                    self._cobre_desde = max(self._cobre_desde, removido["id"])
+                self._buffer.append(evento)
+                self._ids_buffer.add(evento["id"])
+            self._ultimo_id = max(self._ultimo_id, novos[-1]["id"])
+            assinantes = list(self._assinantes.items())
+
+        for fila, loop in assinantes:
+            for evento in novos:
+                try:
+                    loop.call_soon_threadsafe(fila.put_nowait, evento)
+                except RuntimeError:
+                    self.cancelar(fila)  # event loop encerrado
+                    break
+
+
+canal_eventos = CanalEventos(settings.EVENTS_POLL_INTERVAL_SECONDS, settings.EVENTS_BUFFER_SIZE)
+
+
+def limpar_eventos():
+    """Remove eventos mais antigos que EVENTS_RETENTION_HOURS"""
+    limite = datetime.utcnow() - timedelta(hours=settings.EVENTS_RETENTION_HOURS)
+    db = SessionLocal()
+    try:
+        removidos = db.query(EventoFrota).filter(EventoFrota.criado_em < limite).delete(synchronize_session=False)
+        db.commit()
+        if removidos:
+            logger.info(f"🗑️ {removidos} eventos da frota removidos")
+        return removidos
+    finally:
+        db.close()
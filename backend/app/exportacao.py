@@ -0,0 +1,128 @@
+"""
+Geração de arquivos de exportação (CSV, NDJSON e XLSX) a partir de linhas de relatório.
+
+As linhas são consumidas de um iterador e convertidas em blocos de texto
+(ou gravadas direto no arquivo), sem montar a lista completa em memória.
+"""
+import csv
+import io
+import json
+from datetime import datetime, date
+from openpyxl import Workbook
+from app.database import SessionLocal
+from app.serializacao import utc_para_br, iso_br
+
+FORMATOS_EXPORTACAO = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _valor_exportacao(valor):
+    """Datas UTC do banco viram ISO no horário do Brasil; demais valores ficam como estão"""
+    if isinstance(valor, datetime):
+        return iso_br(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def _valor_planilha(valor):
+    """Datas UTC do banco viram datetime (sem fuso) no horário do Brasil, como o Excel espera"""
+    if isinstance(valor, datetime):
+        return utc_para_br(valor).replace(tzinfo=None)
+    return valor
+
+
+def blocos_csv(colunas, linhas, tamanho_bloco: int = 500):
+    """Gera o CSV (com cabeçalho) em blocos de texto de até `tamanho_bloco` linhas"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    pendentes = 0
+
+    for linha in linhas:
+        escritor.writerow([_valor_exportacao(v) for v in linha])
+        pendentes += 1
+        if pendentes >= tamanho_bloco:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pendentes = 0
+
+    yield buffer.getvalue()
+
+
+def blocos_ndjson(colunas, linhas, tamanho_bloco: int = 500):
+    """Gera NDJSON (um objeto JSON por linha) em blocos de texto de até `tamanho_bloco` linhas"""
+    bloco = []
+    for linha in linhas:
+        registro = {coluna: _valor_exportacao(v) for coluna, v in zip(colunas, linha)}
+        bloco.append(json.dumps(registro, ensure_ascii=False))
+        if len(bloco) >= tamanho_bloco:
+            yield "\n".join(bloco) + "\n"
+            bloco = []
+
+    if bloco:
+        yield "\n".join(bloco) + "\n"
+
+
+def blocos_exportacao(formato: str, colunas, linhas):
+    """Escolhe o gerador de blocos pelo formato (csv ou ndjson)"""
+    if formato == "ndjson":
+        return blocos_ndjson(colunas, linhas)
+    return blocos_csv(colunas, linhas)
+
+
+def stream_exportacao(formato: str, colunas, gerar_linhas):
+    """
+    Gerador para StreamingResponse: abre uma sessão própria (que vive enquanto a
+    resposta é enviada), lê as linhas com `gerar_linhas(db)` e emite os blocos.
+    """
+    db = SessionLocal()
+    try:
+        yield from blocos_exportacao(formato, colunas, gerar_linhas(db))
+    finally:
+        db.close()
+
+
+# ===== ARQUIVOS EM DISCO (JOBS DE RELATÓRIO) =====
+def escrever_csv(caminho: str, colunas, linhas) -> int:
+    """Grava o CSV em `caminho` bloco a bloco. Retorna o número de linhas de dados"""
+    total = 0
+
+    def contar(linhas):
+        nonlocal total
+        for linha in linhas:
+            total += 1
+            yield linha
+
+    with open(caminho, "w", newline="", encoding="utf-8") as arquivo:
+        for bloco in blocos_csv(colunas, contar(linhas)):
+            arquivo.write(bloco)
+    return total
+
+
+def escrever_xlsx(caminho: str, colunas, linhas, titulo: str = "Relatorio") -> int:
+    """
+    Grava a planilha em modo write-only do openpyxl: as linhas vão para o arquivo
+    conforme são lidas, sem manter a planilha inteira em memória.
+    Retorna o número de linhas de dados.
+    """
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet(title=titulo[:31])
+    aba.append(list(colunas))
+
+    total = 0
+    for linha in linhas:
+        aba.append([_valor_planilha(v) for v in linha])
+        total += 1
+
+    planilha.save(caminho)
+    return total
+
+
+ESCRITORES_ARQUIVO = {
+    "xlsx": escrever_xlsx,
+    "csv": escrever_csv,
+}
@@ -0,0 +1,136 @@
+"""
+Processamento das fotos das coletas (Pillow).
+
+As fotos são lidas do arquivo recebido (app.upload), nunca de bytes em memória. Em JPEG o
+draft() faz o decodificador reduzir a imagem na própria decodificação (escala DCT), então
+uma foto de 12MP ocupa em memória aproximadamente o tamanho final, não o original.
+
+processar_foto roda num processo do pool (app.processamento_fotos), chamada pelo
+processamento em segundo plano (app.pipeline_fotos) depois que o upload já foi respondido.
+"""
+import logging
+import math
+import os
+import shutil
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Lado máximo da foto gravada
+TAMANHO_MAXIMO = 1920
+QUALIDADE_JPEG = 85
+# Miniaturas e tamanho médio (app.derivadas)
+QUALIDADE_DERIVADA = 78
+
+# Tag EXIF da orientação (0x0112)
+ORIENTACAO_EXIF = 0x0112
+
+
+def tipo_pelos_magic_bytes(inicio: bytes):
+    """Formato da imagem pelos primeiros bytes (None se não reconhecido)"""
+    if inicio[:3] == b'\xff\xd8\xff':
+        return "jpeg"
+    if inicio[:8] == b'\x89PNG\r\n\x1a\n':
+        return "png"
+    if inicio[:6] in (b'GIF87a', b'GIF89a'):
+        return "gif"
+    if inicio[:4] == b'RIFF' and inicio[8:12] == b'WEBP':
+        return "webp"
+    if inicio[4:8] == b'ftyp' and inicio[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return "heic"
+    return None
+
+
+def _preparar(original, lado_maximo: int):
+    """Imagem RGB, na orientação da câmera, com lado máximo `lado_maximo` (fundo branco no lugar de transparência)"""
+    # JPEG: decodificar já reduzido, na menor escala que ainda cobre o tamanho final
+    fator = lado_maximo / max(original.size)
+    if fator < 1:
+        original.draft("RGB", (math.ceil(original.width * fator), math.ceil(original.height * fator)))
+    img = original
+
+    # Girar conforme a orientação EXIF da câmera (o EXIF não é copiado para o arquivo gravado)
+    if original.getexif().get(ORIENTACAO_EXIF, 1) != 1:
+        img = ImageOps.exif_transpose(original)
+
+    # Converter RGBA para RGB se necessário
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = background
+
+    # Redimensionar se muito grande
+    if img.width > lado_maximo or img.height > lado_maximo:
+        img.thumbnail((lado_maximo, lado_maximo), Image.Resampling.LANCZOS)
+    return img
+
+
+def comprimir_foto(origem: str, destino: str):
+    """
+    Grava em `destino` a foto de `origem` como JPEG (fundo branco no lugar de transparência,
+    lado máximo TAMANHO_MAXIMO). Retorna o tamanho (largura, altura) gravado.
+    Lança a exceção do Pillow se a imagem não puder ser lida
+    """
+    with Image.open(origem) as original:
+        img = _preparar(original, TAMANHO_MAXIMO)
+        img.save(destino, 'JPEG', quality=QUALIDADE_JPEG, optimize=True)
+        return img.size
+
+
+def gerar_derivada(origem: str, destino: str, lado_maximo: int, formato: str):
+    """
+    Grava em `destino` a foto de `origem` reduzida a `lado_maximo` ("webp" ou "jpeg"),
+    trocando o arquivo com os.replace. Lança a exceção do Pillow se a imagem não puder ser lida
+    """
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    parcial = f"{destino}.{os.getpid()}.parcial"
+    try:
+        with Image.open(origem) as original:
+            img = _preparar(original, lado_maximo)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')  # ex.: CMYK, que o WebP não grava
+            if formato == "webp":
+                img.save(parcial, 'WEBP', quality=QUALIDADE_DERIVADA)
+            else:
+                img.save(parcial, 'JPEG', quality=QUALIDADE_DERIVADA, optimize=True)
+        os.replace(parcial, destino)
+    finally:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+
+
+def processar_foto(origem: str, destino: str, derivadas=()):
+    """
+    Gera a foto final em `destino` a partir do arquivo recebido em `origem` e apaga o recebido.
+    O JPEG é gravado ao lado e trocado com os.replace: `destino` nunca fica pela metade.
+    Se o Pillow não ler a imagem, o arquivo recebido vira a foto final, sem compressão.
+    `derivadas`: (lado, caminho, formato) das miniaturas a gerar a partir da foto final
+    (a que falhar é gerada depois, no primeiro acesso). Retorna (largura, altura) gravados,
+    ou None se ficou o original
+    """
+    if not os.path.exists(origem):
+        if os.path.exists(destino):
+            return None  # já processada (queda entre a troca do arquivo e a atualização do banco)
+        raise FileNotFoundError(origem)
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    parcial = destino + ".parcial"
+    try:
+        tamanho = comprimir_foto(origem, parcial)
+    except Exception as e:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        logger.warning(f"Falha na compressão de {origem}, mantendo original: {e}")
+        shutil.move(origem, destino)
+        return None
+    os.replace(parcial, destino)
+    os.remove(origem)
+
+    for lado, caminho, formato in derivadas:
+        try:
+            gerar_derivada(destino, caminho, lado, formato)
+        except Exception as e:
+            logger.warning(f"Falha ao gerar derivada {caminho}: {e}")
+    return tamanho
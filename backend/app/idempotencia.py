@@ -0,0 +1,104 @@
+"""
+Idempotency-Key das rotas de escrita do motorista.
+
+Em 4G instável uma requisição pode ser aplicada e a resposta se perder; o aplicativo repete
+com a mesma chave. A chave é reservada (INSERT ... ON CONFLICT DO NOTHING) na transação
+da própria operação e recebe a resposta antes do commit: ou a operação e a chave são
+gravadas juntas, ou nenhuma das duas. Uma repetição encontra a chave e recebe a resposta
+guardada sem executar de novo. Duas requisições simultâneas com a mesma chave: a segunda
+espera o commit da primeira no INSERT (índice da chave primária) e então devolve a resposta dela.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal, insert_com_upsert
+from app.modelos import ChaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_MAXIMO_CHAVE = 255
+
+
+def _inserir_chave(db: Session, valores: dict) -> bool:
+    """Reserva a chave; False se ela já existe"""
+    insert = insert_com_upsert(db.get_bind())
+    if insert is None:
+        try:
+            with db.begin_nested():
+                db.add(ChaveIdempotencia(**valores))
+            return True
+        except IntegrityError:
+            return False
+    reservada = db.execute(
+        insert(ChaveIdempotencia).values(**valores).on_conflict_do_nothing().returning(ChaveIdempotencia.chave)
+    ).scalar()
+    return reservada is not None
+
+
+def reservar_chave(db: Session, usuario_id: int, chave: Optional[str], operacao: str):
+    """
+    Reserva a Idempotency-Key na transação da requisição (sem commit).
+    Retorna a resposta guardada (dict) se a chave já foi usada nesta operação, ou None
+    para executar a operação normalmente. Sem chave, não faz nada.
+    """
+    if not chave:
+        return None
+    if len(chave) > TAMANHO_MAXIMO_CHAVE:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key deve ter no máximo {TAMANHO_MAXIMO_CHAVE} caracteres")
+
+    filtro = (ChaveIdempotencia.usuario_id == usuario_id, ChaveIdempotencia.chave == chave)
+    existente = db.query(ChaveIdempotencia).filter(*filtro).first()
+    if existente and existente.criado_em < datetime.utcnow() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS):
+        db.delete(existente)  # expirada e ainda não removida pela limpeza
+        db.flush()
+        existente = None
+
+    if existente is None:
+        if _inserir_chave(db, {"usuario_id": usuario_id, "chave": chave, "operacao": operacao,
+                               "criado_em": datetime.utcnow()}):
+            return None
+        # Outra requisição com a mesma chave terminou enquanto esta esperava
+        existente = db.query(ChaveIdempotencia).filter(*filtro).first()
+
+    if existente.operacao != operacao:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já usada em outra operação")
+    return json.loads(existente.resposta)
+
+
+def guardar_resposta(db: Session, usuario_id: int, chave: Optional[str], resposta: dict):
+    """Guarda a resposta da operação na chave reservada (mesma transação, antes do commit)"""
+    if not chave:
+        return
+    db.execute(
+        update(ChaveIdempotencia).where(
+            ChaveIdempotencia.usuario_id == usuario_id, ChaveIdempotencia.chave == chave
+        ).values(resposta=json.dumps(resposta, default=str))
+    )
+
+
+def resposta_repetida(resposta: dict):
+    """Resposta guardada, marcada como repetição"""
+    return JSONResponse(content=resposta, headers={"Idempotent-Replayed": "true"})
+
+
+def limpar_chaves_idempotencia():
+    """Remove as chaves mais antigas que IDEMPOTENCY_KEY_TTL_HOURS"""
+    limite = datetime.utcnow() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    db = SessionLocal()
+    try:
+        removidas = db.query(ChaveIdempotencia).filter(
+            ChaveIdempotencia.criado_em < limite
+        ).delete(synchronize_session=False)
+        db.commit()
+        if removidas:
+            logger.info(f"🗑️ {removidas} chaves de idempotência expiradas removidas")
+        return removidas
+    finally:
+        db.close()
@@ -0,0 +1,186 @@
+"""
+Jobs de relatório em segundo plano.
+
+Relatórios longos (ano inteiro, consolidado de vários anos, detalhado de todos os
+motoristas) rodam num pool limitado de threads, fora das requisições, e gravam um
+XLSX ou CSV em REPORT_JOBS_DIR. O estado de cada job fica na tabela jobs_relatorio,
+então qualquer worker responde à consulta de status e ao download.
+"""
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.exportacao import ESCRITORES_ARQUIVO
+from app.modelos import JobRelatorio
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_JOB = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+
+STATUS_ATIVOS = ("pendente", "executando")
+
+executor_jobs = ThreadPoolExecutor(
+    max_workers=settings.REPORT_JOB_WORKERS,
+    thread_name_prefix="job-relatorio"
+)
+
+
+def caminho_arquivo_job(job: JobRelatorio) -> str:
+    return os.path.join(settings.REPORT_JOBS_DIR, job.arquivo)
+
+
+def total_jobs_ativos(db: Session) -> int:
+    """Jobs pendentes ou em execução (em todos os workers)"""
+    return db.query(JobRelatorio).filter(JobRelatorio.status.in_(STATUS_ATIVOS)).count()
+
+
+def criar_job(db: Session, tipo: str, formato: str, parametros: dict, criado_por: int, colunas, gerar_linhas) -> JobRelatorio:
+    """
+    Registra o job e o envia ao pool. `gerar_linhas(db)` recebe a sessão do próprio
+    job e deve devolver um iterador de linhas na ordem de `colunas`.
+    """
+    job = JobRelatorio(
+        id=str(uuid.uuid4()),
+        tipo=tipo,
+        formato=formato,
+        parametros=json.dumps(parametros),
+        status="pendente",
+        criado_por=criado_por
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    executor_jobs.submit(_executar_job, job.id, colunas, gerar_linhas)
+    logger.info(f"Job de relatório {job.id} criado ({tipo}, {formato})")
+    return job
+
+
+def _executar_job(job_id: str, colunas, gerar_linhas):
+    """Executa o job com uma sessão própria e grava o arquivo (via .parcial + rename)"""
+    db = SessionLocal()
+    caminho_parcial = None
+    try:
+        job = db.query(JobRelatorio).filter(JobRelatorio.id == job_id).first()
+        if not job or job.status != "pendente":
+            return
+        job.status = "executando"
+        job.iniciado_em = datetime.utcnow()
+        db.commit()
+
+        os.makedirs(settings.REPORT_JOBS_DIR, exist_ok=True)
+        nome_arquivo = f"{job.tipo}_{job.id}.{job.formato}"
+        caminho = os.path.join(settings.REPORT_JOBS_DIR, nome_arquivo)
+        caminho_parcial = caminho + ".parcial"
+
+        escritor = ESCRITORES_ARQUIVO[job.formato]
+        total_linhas = escritor(caminho_parcial, colunas, gerar_linhas(db))
+        os.replace(caminho_parcial, caminho)
+        caminho_parcial = None
+
+        # Só conclui se continua executando: a limpeza pode tê-lo marcado como erro (tempo limite)
+        concluido = db.query(JobRelatorio).filter(
+            JobRelatorio.id == job_id, JobRelatorio.status == "executando"
+        ).update({
+            "status": "concluido",
+            "arquivo": nome_arquivo,
+            "total_linhas": total_linhas,
+            "tamanho_bytes": os.path.getsize(caminho),
+            "concluido_em": datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        if not concluido:
+            os.remove(caminho)
+            logger.warning(f"Job de relatório {job_id} terminou depois do tempo limite; arquivo descartado")
+            return
+        logger.info(f"✓ Job de relatório {job_id} concluído: {total_linhas} linhas")
+    except Exception as e:
+        logger.error(f"❌ Erro no job de relatório {job_id}: {e}", exc_info=True)
+        db.rollback()
+        job = db.query(JobRelatorio).filter(JobRelatorio.id == job_id).first()
+        if job:
+            job.status = "erro"
+            job.erro = str(getattr(e, "detail", e))
+            job.concluido_em = datetime.utcnow()
+            db.commit()
+    finally:
+        if caminho_parcial and os.path.exists(caminho_parcial):
+            os.remove(caminho_parcial)
+        db.close()
+
+
+def job_para_dict(job: JobRelatorio) -> dict:
+    dados = {
+        "id": job.id,
+        "tipo": job.tipo,
+        "formato": job.formato,
+        "parametros": json.loads(job.parametros) if job.parametros else {},
+        "status": job.status,
+        "erro": job.erro,
+        "total_linhas": job.total_linhas,
+        "tamanho_bytes": job.tamanho_bytes,
+        "criado_em": job.criado_em.isoformat() if job.criado_em else None,
+        "iniciado_em": job.iniciado_em.isoformat() if job.iniciado_em else None,
+        "concluido_em": job.concluido_em.isoformat() if job.concluido_em else None,
+    }
+    if job.status == "concluido":
+        dados["download_url"] = f"/api/admin/relatorios/jobs/{job.id}/download"
+    return dados
+
+
+def limpar_jobs_relatorio():
+    """
+    Remove jobs concluídos (e seus arquivos) mais antigos que REPORT_JOB_RETENTION_HOURS
+    e marca como erro os jobs executando há mais de REPORT_JOB_TIMEOUT_MINUTES (ex.: o
+    worker que os executava foi reiniciado). Um job pendente está só esperando a vez no pool
+    e não expira por esse tempo; só o que continua pendente depois de
+    REPORT_JOB_RETENTION_HOURS (perdido num reinício do worker) vira erro.
+    """
+    db = SessionLocal()
+    try:
+        agora = datetime.utcnow()
+
+        limite_parados = agora - timedelta(minutes=settings.REPORT_JOB_TIMEOUT_MINUTES)
+        limite_retencao = agora - timedelta(hours=settings.REPORT_JOB_RETENTION_HOURS)
+        parados = db.query(JobRelatorio).filter(
+            JobRelatorio.status == "executando",
+            JobRelatorio.iniciado_em < limite_parados
+        ).all()
+        for job in parados:
+            job.status = "erro"
+            job.erro = "Job interrompido (tempo limite excedido)"
+            job.concluido_em = agora
+
+        perdidos = db.query(JobRelatorio).filter(
+            JobRelatorio.status == "pendente",
+            JobRelatorio.criado_em < limite_retencao
+        ).all()
+        for job in perdidos:
+            job.status = "erro"
+            job.erro = "Job não foi iniciado (worker reiniciado)"
+            job.concluido_em = agora
+
+        antigos = db.query(JobRelatorio).filter(
+            JobRelatorio.status.in_(("concluido", "erro")),
+            JobRelatorio.concluido_em < limite_retencao
+        ).all()
+        for job in antigos:
+            if job.arquivo:
+                caminho = caminho_arquivo_job(job)
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+            db.delete(job)
+
+        db.commit()
+        if parados or perdidos or antigos:
+            logger.info(f"Jobs de relatório: {len(parados) + len(perdidos)} marcados como erro, {len(antigos)} removidos")
+    finally:
+        db.close()
@@ -1,5 +1,12 @@
 from .usuario import Usuario
 from .veiculo import Veiculo
 from .coleta import Coleta, Foto, Viagem
+from .km_diario import KmDiario
+from .versao_dados import VersaoDados
+from .job_relatorio import JobRelatorio
+from .lote_arquivo import LoteArquivo
+from .evento_frota import EventoFrota
+from .chave_idempotencia import ChaveIdempotencia
+from .arquivo_foto import ArquivoFoto
 
-__all__ = ["Usuario", "Veiculo", "Coleta", "Foto", "Viagem"]
+__all__ = ["Usuario", "Veiculo", "Coleta", "Foto", "Viagem", "KmDiario", "VersaoDados", "JobRelatorio", "LoteArquivo", "EventoFrota", "ChaveIdempotencia", "ArquivoFoto"]
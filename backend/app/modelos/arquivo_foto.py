@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from datetime import datetime
+from app.database import Base
+
+class ArquivoFoto(Base):
+    """
+    Arquivo de foto guardado pelo conteúdo (SHA-256 dos bytes recebidos), compartilhado
+    pelas Fotos com o mesmo conteúdo (Foto.caminho == caminho). `referencias` conta essas
+    Fotos: o arquivo só é apagado quando a última é removida (app/armazenamento_fotos.py).
+    """
+    __tablename__ = "arquivos_fotos"
+
+    hash = Column(String(64), primary_key=True)
+    caminho = Column(String, unique=True, nullable=False)  # relativo a UPLOAD_DIR
+    referencias = Column(Integer, nullable=False, default=0)
+    tamanho = Column(Integer)  # bytes recebidos
+    criado_em = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from datetime import datetime
+from app.database import Base
+
+class ChaveIdempotencia(Base):
+    """
+    Idempotency-Key já usada por um motorista e a resposta da operação.
+    A chave é reservada na mesma transação da operação; uma repetição da requisição
+    devolve a resposta guardada sem executar de novo. Expira em IDEMPOTENCY_KEY_TTL_HOURS.
+    """
+    __tablename__ = "chaves_idempotencia"
+
+    usuario_id = Column(Integer, primary_key=True)
+    chave = Column(String(255), primary_key=True)
+    operacao = Column(String, nullable=False)  # ex.: "sair:123" - a chave não vale para outra operação
+    resposta = Column(Text)  # JSON da resposta (200)
+    criado_em = Column(DateTime, default=datetime.utcnow, index=True)
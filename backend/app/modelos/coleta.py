@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Text, Boolean, Index
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 from app.database import Base
+from app.serializacao import data_br
 
 class Coleta(Base):
     """
@@ -15,15 +16,21 @@ class Coleta(Base):
     veiculo_id = Column(Integer, ForeignKey("veiculos.id"))
     
     # Dados da retirada
-    data_retirada = Column(DateTime, default=datetime.utcnow)
+    data_retirada = Column(DateTime, default=datetime.utcnow, index=True)
     km_retirada = Column(Float)  # KM do veículo na retirada
     observacoes_retirada = Column(Text)  # Observações na retirada
     
     # Dados da devolução
     data_devolucao = Column(DateTime)  # NULL enquanto ativo
+    data_devolucao_local = Column(Date)  # Data da devolução no horário do Brasil (filtros de período)
     km_devolucao = Column(Float)  # KM do veículo na devolução
     observacoes_devolucao = Column(Text)  # Observações na devolução
     
+    # Totais das viagens (mantidos por sair/retornar; conferir com verificar_totais_viagens.py)
+    total_viagens = Column(Integer, default=0)
+    total_km_viagens = Column(Float, default=0)  # soma de km_rodado das viagens finalizadas
+    viagem_aberta_id = Column(Integer)  # viagem com saída e sem retorno (NULL se nenhuma)
+    
     # Status
     ativo = Column(Boolean, default=True)  # FALSE quando devolvido
     criado_em = Column(DateTime, default=datetime.utcnow)
@@ -34,6 +41,26 @@ class Coleta(Base):
     viagens = relationship("Viagem", back_populates="coleta", cascade="all, delete-orphan")
     fotos = relationship("Foto", back_populates="coleta", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_coletas_data_devolucao_local", "data_devolucao_local"),
+        Index("ix_coletas_usuario_devolucao_local", "usuario_id", "data_devolucao_local"),
+        Index("ix_coletas_veiculo_devolucao_local", "veiculo_id", "data_devolucao_local"),
+        # No máximo uma coleta ativa por motorista e por veículo (garantido pelo banco na retirada);
+        # também servem as consultas da coleta ativa feitas em toda requisição do motorista
+        Index("uq_coletas_usuario_ativa", "usuario_id", unique=True, postgresql_where=ativo == True, sqlite_where=ativo == True),
+        Index("uq_coletas_veiculo_ativa", "veiculo_id", unique=True, postgresql_where=ativo == True, sqlite_where=ativo == True),
+        # Paginação por cursor: histórico do motorista (retirada) e relatórios por motorista/veículo (devolução)
+        Index("ix_coletas_usuario_retirada", "usuario_id", "data_retirada"),
+        Index("ix_coletas_usuario_devolucao", "usuario_id", "data_devolucao"),
+        Index("ix_coletas_veiculo_devolucao", "veiculo_id", "data_devolucao"),
+    )
+
+    @validates("data_devolucao")
+    def _atualizar_data_devolucao_local(self, key, valor):
+        """Mantém data_devolucao_local sincronizada com data_devolucao (UTC)"""
+        self.data_devolucao_local = data_br(valor)
+        return valor
+
 
 class Viagem(Base):
     """
@@ -43,10 +70,10 @@ class Viagem(Base):
     __tablename__ = "viagens"
 
     id = Column(Integer, primary_key=True, index=True)
-    coleta_id = Column(Integer, ForeignKey("coletas.id"))
+    coleta_id = Column(Integer, ForeignKey("coletas.id"), index=True)
     
     # Saída
-    saida_horario = Column(DateTime)
+    saida_horario = Column(DateTime, index=True)
     saida_km = Column(Float)
     saida_observacoes = Column(Text)
     
@@ -64,13 +91,31 @@ class Viagem(Base):
 
     coleta = relationship("Coleta", back_populates="viagens")
 
+    __table_args__ = (
+        # Viagem aberta (saída sem retorno) da coleta
+        Index("ix_viagens_coleta_aberta", "coleta_id",
+              postgresql_where=retorno_horario == None, sqlite_where=retorno_horario == None),
+    )
+
 class Foto(Base):
     __tablename__ = "fotos"
 
     id = Column(Integer, primary_key=True, index=True)
-    coleta_id = Column(Integer, ForeignKey("coletas.id"))
+    coleta_id = Column(Integer, ForeignKey("coletas.id"), index=True)
     etapa = Column(String)  # Ex: "saida_1", "retorno_1", "saida_2", etc
     caminho = Column(String)
-    criado_em = Column(DateTime, default=datetime.utcnow)
+    criado_em = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # Processamento depois do upload (app/pipeline_fotos.py): "processando" até o arquivo final existir
+    # ("falhou" se o arquivo compartilhado de mesmo conteúdo nunca apareceu)
+    status = Column(String(20), default="pronta")
+    arquivo_recebido = Column(String)  # original em UPLOAD_PENDING_DIR enquanto processando
+    reservada_em = Column(DateTime)  # quando um worker assumiu o processamento (expira em PHOTO_PROCESSING_LEASE_SECONDS)
+    tentativas = Column(Integer, default=0)
 
     coleta = relationship("Coleta", back_populates="fotos")
+
+    __table_args__ = (
+        # Fotos pendentes, buscadas pela recuperação do processamento
+        Index("ix_fotos_processando", "reservada_em", postgresql_where=status == "processando", sqlite_where=status == "processando"),
+    )
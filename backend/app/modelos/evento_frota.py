@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from datetime import datetime
+from app.database import Base
+
+class EventoFrota(Base):
+    """
+    Evento de mudança na frota (retirada, devolução, saída/retorno de viagem, cadastro de veículo).
+    Gravado na mesma transação da escrita; cada worker lê os novos eventos e os envia aos
+    painéis conectados por SSE. O id é o Last-Event-ID usado para retomar a conexão.
+    """
+    __tablename__ = "eventos_frota"
+    # SQLite: ids nunca reutilizados (mesmo depois da limpeza), para o Last-Event-ID continuar válido
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(String, nullable=False)  # retirada, devolucao, saida, retorno, veiculo
+    dados = Column(Text)  # JSON com os ids envolvidos (veiculo_id, coleta_id...)
+    criado_em = Column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from datetime import datetime
+from app.database import Base
+
+class JobRelatorio(Base):
+    """
+    Relatório gerado em segundo plano (XLSX ou CSV em disco).
+    O estado fica no banco para que qualquer worker responda à consulta e ao download;
+    a execução acontece no pool de jobs do worker que recebeu o pedido.
+    """
+    __tablename__ = "jobs_relatorio"
+
+    id = Column(String(36), primary_key=True)  # uuid4
+    tipo = Column(String, nullable=False)  # detalhado, periodo, consolidado
+    formato = Column(String, nullable=False)  # xlsx, csv
+    parametros = Column(Text)  # JSON com os filtros do pedido
+    status = Column(String, default="pendente", index=True)  # pendente, executando, concluido, erro
+    erro = Column(Text)
+    arquivo = Column(String)  # nome do arquivo em REPORT_JOBS_DIR
+    total_linhas = Column(Integer)
+    tamanho_bytes = Column(Integer)
+    criado_por = Column(Integer, nullable=False)  # usuarios.id do admin
+    criado_em = Column(DateTime, default=datetime.utcnow, index=True)
+    iniciado_em = Column(DateTime)
+    concluido_em = Column(DateTime)
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, Float, Date, UniqueConstraint
+from app.database import Base
+
+class KmDiario(Base):
+    """
+    Consolidação diária de KM por veículo e motorista.
+    O dia é a data no horário do Brasil (São Paulo). Mantida pelas rotas de
+    devolução, retorno e edição de KM; pode ser refeita com reconstruir_km_diario.py
+    """
+    __tablename__ = "km_diario"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dia = Column(Date, nullable=False)
+    veiculo_id = Column(Integer, nullable=False, index=True)
+    usuario_id = Column(Integer, nullable=False, index=True)
+    
+    # Coletas devolvidas no dia (km_devolucao - km_retirada)
+    km_coletas = Column(Float, default=0)
+    total_usos = Column(Integer, default=0)
+    
+    # Viagens (sair/retornar) com saída no dia
+    km_viagens = Column(Float, default=0)
+    total_viagens = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("dia", "veiculo_id", "usuario_id", name="uq_km_diario_dia_veiculo_usuario"),
+    )
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime
+from datetime import datetime
+from app.database import Base
+
+class LoteArquivo(Base):
+    """
+    Lote de coletas encerradas movidas para o arquivo frio (Parquet).
+    Cada lote tem um arquivo por tabela (coletas, viagens, fotos) em
+    ARCHIVE_DIR/<tabela>/mes=YYYY-MM/lote_<identificador>.parquet.
+    Só arquivos com lote registrado aqui são lidos pelos relatórios; o registro
+    é gravado na mesma transação que remove as linhas das tabelas quentes.
+    """
+    __tablename__ = "lotes_arquivo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    identificador = Column(String(32), unique=True, nullable=False)
+    mes = Column(String(7), nullable=False, index=True)  # YYYY-MM da devolução
+    data_inicio = Column(Date, nullable=False)  # menor data_devolucao_local do lote
+    data_fim = Column(Date, nullable=False)  # maior data_devolucao_local do lote
+    total_coletas = Column(Integer, default=0)
+    total_viagens = Column(Integer, default=0)
+    total_fotos = Column(Integer, default=0)
+    criado_em = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+from datetime import datetime
+from app.database import Base
+
+class VersaoDados(Base):
+    """
+    Contador global de versão dos dados (linha única, id=1).
+    Incrementado logo depois do commit de toda escrita que afeta relatórios e listagens;
+    usado como parte da chave de cache, compartilhada entre os workers.
+    """
+    __tablename__ = "versao_dados"
+
+    id = Column(Integer, primary_key=True)
+    versao = Column(BigInteger, default=0, nullable=False)
+    atualizado_em = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
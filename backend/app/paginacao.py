@@ -0,0 +1,63 @@
+"""
+Paginação por cursor (keyset) das listas de coletas.
+
+As páginas são ordenadas por (data, id) decrescente e o cursor guarda a chave da última
+coleta entregue: a próxima página começa por "(data, id) < cursor", que o índice
+(usuario_id/veiculo_id, data) resolve sem percorrer as páginas anteriores. O custo de
+uma página não depende do tamanho do histórico e o cursor continua válido quando
+novas coletas são criadas.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import or_, and_
+
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 200
+
+
+def codificar_cursor(data: datetime, id_: int) -> str:
+    bruto = json.dumps([data.isoformat(), id_], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    """Retorna (data, id) do cursor; HTTP 400 se o cursor for inválido"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data, id_ = json.loads(bruto)
+        return datetime.fromisoformat(data), int(id_)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def depois_do_cursor(coluna_data, coluna_id, cursor):
+    """Condição SQL das coletas que vêm depois do cursor na ordem (data, id) decrescente"""
+    data, id_ = cursor
+    return or_(coluna_data < data, and_(coluna_data == data, coluna_id < id_))
+
+
+def pagina_keyset(consulta, coluna_data, coluna_id, cursor: str = None, limite: int = LIMITE_PADRAO):
+    """
+    Executa uma página de `consulta` em ordem (data, id) decrescente.
+    Retorna (itens, proximo_cursor); proximo_cursor é None na última página.
+    """
+    if cursor:
+        consulta = consulta.filter(depois_do_cursor(coluna_data, coluna_id, decodificar_cursor(cursor)))
+    itens = consulta.order_by(coluna_data.desc(), coluna_id.desc()).limit(limite + 1).all()
+    return fechar_pagina(itens, limite, coluna_data.key)
+
+
+def fechar_pagina(itens, limite: int, atributo_data: str):
+    """Corta a lista (já ordenada, com até limite + 1 itens) e gera o cursor da próxima página"""
+    if len(itens) <= limite:
+        return itens, None
+    itens = itens[:limite]
+    ultimo = itens[-1]
+    return itens, codificar_cursor(getattr(ultimo, atributo_data), ultimo.id)
+
+
+def paginacao_resposta(limite: int, proximo_cursor: str):
+    return {"limite": limite, "proximo_cursor": proximo_cursor}
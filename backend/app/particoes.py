@@ -0,0 +1,148 @@
+"""
+Particionamento mensal (PostgreSQL) das tabelas viagens e fotos.
+
+As tabelas são convertidas por `python migrate_db.py --particionar` em tabelas
+particionadas por faixa mensal (viagens por saida_horario, fotos por criado_em),
+com uma partição padrão para valores fora das faixas. O scheduler do main.py cria
+as partições dos próximos meses; a retenção de fotos vira DROP de partições inteiras.
+Em SQLite (ou com as tabelas ainda não convertidas) as funções não fazem nada.
+"""
+import logging
+import re
+from datetime import date, datetime
+from sqlalchemy import text
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+# Tabela -> coluna usada como chave de partição
+TABELAS_PARTICIONADAS = {
+    "viagens": "saida_horario",
+    "fotos": "criado_em",
+}
+
+# Chave do pg_advisory_xact_lock que serializa a criação de partições entre os workers
+LOCK_PARTICOES = 7_301_001
+
+
+def inicio_do_mes(dia) -> date:
+    return date(dia.year, dia.month, 1)
+
+
+def proximo_mes(mes: date) -> date:
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def nome_particao(tabela: str, mes: date) -> str:
+    return f"{tabela}_p{mes.year:04d}_{mes.month:02d}"
+
+
+def esta_particionada(conn, tabela: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :tabela AND n.nspname = current_schema()"
+    ), {"tabela": tabela}).scalar()
+    return relkind == "p"
+
+
+def nome_particao_padrao(tabela: str) -> str:
+    return f"{tabela}_padrao"
+
+
+def criar_particao(conn, tabela: str, mes: date) -> bool:
+    """
+    Cria a partição do mês se ainda não existir. Retorna True se criou.
+
+    Se a partição padrão já tem linhas do mês (gravadas antes de a partição existir), o
+    PostgreSQL recusa o CREATE TABLE ... PARTITION OF: a partição é criada fora da tabela,
+    recebe essas linhas (tiradas da padrão) e só então é anexada, na mesma transação.
+    """
+    nome = nome_particao(tabela, mes)
+    existe = conn.execute(text("SELECT to_regclass(:nome)"), {"nome": nome}).scalar()
+    if existe:
+        return False
+
+    coluna = TABELAS_PARTICIONADAS[tabela]
+    padrao = nome_particao_padrao(tabela)
+    faixa = {"inicio": mes, "fim": proximo_mes(mes)}
+    limites = f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{proximo_mes(mes).isoformat()}')"
+    tem_padrao = conn.execute(text("SELECT to_regclass(:nome)"), {"nome": padrao}).scalar()
+    if tem_padrao:
+        # Bloqueia inserções na padrão até o ATTACH (que a bloquearia de qualquer forma)
+        conn.execute(text(f"LOCK TABLE {padrao} IN SHARE ROW EXCLUSIVE MODE"))
+    if tem_padrao and conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {padrao} WHERE {coluna} >= :inicio AND {coluna} < :fim)"
+    ), faixa).scalar():
+        conn.execute(text(f"CREATE TABLE {nome} (LIKE {tabela} INCLUDING DEFAULTS)"))
+        movidas = conn.execute(text(
+            f"WITH movidas AS (DELETE FROM {padrao} WHERE {coluna} >= :inicio AND {coluna} < :fim RETURNING *) "
+            f"INSERT INTO {nome} SELECT * FROM movidas"
+        ), faixa).rowcount
+        conn.execute(text(f"ALTER TABLE {tabela} ATTACH PARTITION {nome} {limites}"))
+        logger.info(f"✓ {movidas} linhas de {padrao} movidas para {nome}")
+        return True
+
+    conn.execute(text(f"CREATE TABLE {nome} PARTITION OF {tabela} {limites}"))
+    return True
+
+
+def criar_particoes_mensais(conn, tabela: str, de: date, ate: date) -> int:
+    """Cria as partições mensais de `de` até `ate` (inclusive). Retorna quantas criou"""
+    criadas = 0
+    mes = inicio_do_mes(de)
+    while mes <= ate:
+        if criar_particao(conn, tabela, mes):
+            criadas += 1
+        mes = proximo_mes(mes)
+    return criadas
+
+
+def garantir_particoes(meses_futuros: int = 3) -> int:
+    """
+    Garante as partições do mês atual e dos próximos `meses_futuros` meses em todas as
+    tabelas particionadas. Seguro para rodar em vários workers ao mesmo tempo.
+    """
+    if engine.dialect.name != "postgresql":
+        return 0
+
+    criadas = 0
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": LOCK_PARTICOES})
+        hoje = datetime.utcnow().date()
+        ate = inicio_do_mes(hoje)
+        for _ in range(meses_futuros):
+            ate = proximo_mes(ate)
+        for tabela in TABELAS_PARTICIONADAS:
+            if esta_particionada(conn, tabela):
+                criadas += criar_particoes_mensais(conn, tabela, hoje, ate)
+    if criadas:
+        logger.info(f"✓ {criadas} partições mensais criadas")
+    return criadas
+
+
+def particoes_anteriores(conn, tabela: str, limite: date):
+    """Partições mensais da tabela que terminam antes de `limite` (todas as linhas < limite)"""
+    if not esta_particionada(conn, tabela):
+        return []
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:tabela AS regclass) ORDER BY c.relname"
+    ), {"tabela": tabela}).scalars()
+
+    padrao = re.compile(rf"^{tabela}_p(\d{{4}})_(\d{{2}})$")
+    anteriores = []
+    for nome in nomes:
+        encontrado = padrao.match(nome)
+        if encontrado:
+            mes = date(int(encontrado.group(1)), int(encontrado.group(2)), 1)
+            if proximo_mes(mes) <= limite:
+                anteriores.append(nome)
+    return anteriores
+
+
+def remover_particao(conn, tabela: str, nome: str):
+    """Desanexa e apaga uma partição inteira (retenção sem DELETE linha a linha nem VACUUM)"""
+    conn.execute(text(f"ALTER TABLE {tabela} DETACH PARTITION {nome}"))
+    conn.execute(text(f"DROP TABLE {nome}"))
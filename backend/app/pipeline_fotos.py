@@ -0,0 +1,288 @@
+"""
+Processamento das fotos em segundo plano, depois do upload.
+
+O upload (POST /api/coleta/{id}/upload-foto) só move o arquivo recebido para UPLOAD_PENDING_DIR,
+grava a Foto com status "processando" e responde. Em cada worker, PHOTO_PROCESS_WORKERS
+tarefas tiram as fotos de uma fila em memória e as processam no pool de processos
+(app.fotos.processar_foto: orientação EXIF, redução, JPEG e as derivadas de app.derivadas).
+No fim a Foto passa a "pronta", com o arquivo final no caminho gravado desde o upload.
+
+A fila de verdade é o banco; a fila em memória só poupa uma consulta por foto. Antes de
+processar, a tarefa reserva a foto com um UPDATE condicional (sem reserva ou com reserva
+vencida há PHOTO_PROCESSING_LEASE_SECONDS), então cada foto é processada por um worker só.
+Uma foto que não coube na fila, ou cujo worker caiu no meio do processamento, continua
+"processando" no banco: a recuperação (na inicialização e a cada
+PHOTO_RECOVERY_INTERVAL_SECONDS) a coloca de novo na fila. Depois de PHOTO_MAX_ATTEMPTS
+reservas a foto fica com o arquivo recebido, sem processar.
+Com PHOTO_PENDING_MAX fotos recebidas ainda sem processar, o upload responde 503 com
+Retry-After antes de receber o corpo, em vez de acumular arquivos em UPLOAD_PENDING_DIR.
+
+Uma foto de conteúdo já recebido (app.armazenamento_fotos) não tem arquivo_recebido: se o
+arquivo compartilhado ainda está em processamento, ela fica "processando" e passa a
+"pronta" junto com a foto que o gerou. Se o arquivo não existe e nenhuma foto pendente vai
+gerá-lo, depois de PHOTO_MAX_ATTEMPTS verificações ela passa a "falhou" e sai da fila.
+"""
+import asyncio
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.database import SessionLocal
+from app.derivadas import derivadas_da_foto
+from app.fotos import processar_foto
+from app.modelos import Foto
+from app.processamento_fotos import processamento_fotos, PoolSaturado
+
+logger = logging.getLogger(__name__)
+
+PROCESSANDO = "processando"
+PRONTA = "pronta"
+FALHOU = "falhou"  # arquivo compartilhado que nunca apareceu: não é mais processada
+
+
+def caminho_recebido(arquivo_recebido: str) -> str:
+    """Caminho do arquivo recebido (ainda não processado) no disco"""
+    return os.path.join(settings.UPLOAD_PENDING_DIR, arquivo_recebido)
+
+
+def _disponivel(agora: datetime):
+    """Filtro das fotos pendentes que nenhum worker está processando"""
+    vencida = agora - timedelta(seconds=settings.PHOTO_PROCESSING_LEASE_SECONDS)
+    return [Foto.status == PROCESSANDO, or_(Foto.reservada_em == None, Foto.reservada_em < vencida)]
+
+
+def fotos_pendentes(limite: int, ignorar=()):
+    """Ids das fotos pendentes sem reserva válida (até `limite`, exceto as de `ignorar`)"""
+    db = SessionLocal()
+    try:
+        ids = db.query(Foto.id).filter(*_disponivel(datetime.utcnow())).order_by(Foto.id).limit(
+            limite + len(ignorar)
+        ).all()
+        return [id_ for id_, in ids if id_ not in ignorar][:limite]
+    finally:
+        db.close()
+
+
+def fila_cheia() -> bool:
+    """
+    Se os arquivos recebidos ainda sem processar (de todos os workers: a pasta é a mesma)
+    chegaram a PHOTO_PENDING_MAX. Conta a pasta, sem consulta ao banco, parando no limite
+    """
+    try:
+        with os.scandir(settings.UPLOAD_PENDING_DIR) as entradas:
+            for pendentes, _ in enumerate(entradas, 1):
+                if pendentes >= settings.PHOTO_PENDING_MAX:
+                    return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def reservar_foto(foto_id: int):
+    """
+    Reserva a foto para este worker (UPDATE condicional: só um worker consegue).
+    Retorna (caminho, arquivo_recebido, tentativas) ou None se já está pronta ou reservada
+    """
+    db = SessionLocal()
+    try:
+        agora = datetime.utcnow()
+        reservadas = db.query(Foto).filter(Foto.id == foto_id, *_disponivel(agora)).update(
+            {"reservada_em": agora, "tentativas": func.coalesce(Foto.tentativas, 0) + 1},
+            synchronize_session=False
+        )
+        db.commit()
+        if reservadas != 1:
+            return None
+        return db.query(Foto.caminho, Foto.arquivo_recebido, Foto.tentativas).filter(Foto.id == foto_id).one()
+    finally:
+        db.close()
+
+
+def _atualizar_pendente(foto_id: int, valores: dict):
+    db = SessionLocal()
+    try:
+        db.query(Foto).filter(Foto.id == foto_id, Foto.status == PROCESSANDO).update(
+            valores, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def concluir_foto(foto_id: int, caminho: str):
+    """
+    Marca a foto como pronta (o arquivo final já está no lugar), junto com as fotos de mesmo
+    conteúdo que aguardavam este arquivo (app.armazenamento_fotos), mesmo as que já desistiram
+    """
+    db = SessionLocal()
+    try:
+        db.query(Foto).filter(
+            or_(Foto.id == foto_id, and_(Foto.caminho == caminho, Foto.arquivo_recebido == None)),
+            Foto.status.in_((PROCESSANDO, FALHOU))
+        ).update({"status": PRONTA, "arquivo_recebido": None, "reservada_em": None}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def origem_pendente(caminho: str) -> bool:
+    """Se alguma foto pendente ainda vai gerar o arquivo `caminho` (tem o arquivo recebido)"""
+    db = SessionLocal()
+    try:
+        return db.query(Foto.id).filter(
+            Foto.caminho == caminho, Foto.status == PROCESSANDO, Foto.arquivo_recebido != None
+        ).first() is not None
+    finally:
+        db.close()
+
+
+def falhar_foto(foto_id: int):
+    """Tira da fila a foto cujo arquivo compartilhado não existe nem vai ser gerado"""
+    _atualizar_pendente(foto_id, {"status": FALHOU, "reservada_em": None})
+
+
+def liberar_foto(foto_id: int):
+    """Desfaz a reserva depois de uma falha: a recuperação tenta de novo"""
+    _atualizar_pendente(foto_id, {"reservada_em": None})
+
+
+def devolver_foto(foto_id: int):
+    """Desfaz a reserva sem contar a tentativa (pool cheio: a foto não chegou a ser processada)"""
+    _atualizar_pendente(foto_id, {"reservada_em": None, "tentativas": Foto.tentativas - 1})
+
+
+def manter_recebido(origem: str, destino: str):
+    """Usa o arquivo recebido como foto final, sem processar"""
+    if os.path.exists(origem):
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.move(origem, destino)
+    elif not os.path.exists(destino):
+        logger.error(f"❌ Arquivo da foto perdido: {origem}")
+
+
+class PipelineFotos:
+    """Fila (por worker) das fotos recebidas, consumida em segundo plano, com recuperação pelo banco"""
+
+    def __init__(self, consumidores: int, tamanho_fila: int, intervalo_recuperacao: float):
+        self.consumidores = consumidores
+        self.tamanho_fila = tamanho_fila
+        self.intervalo_recuperacao = intervalo_recuperacao
+        self._fila = None
+        self._na_fila = set()
+        self._tarefas = []
+        self.processadas = 0
+        self.recuperadas = 0
+        self.falhas = 0
+
+    def iniciar(self):
+        """Cria a fila e as tarefas no event loop do worker (evento de startup)"""
+        if self._tarefas:
+            return
+        self._fila = asyncio.Queue(maxsize=self.tamanho_fila)
+        self._tarefas = [asyncio.create_task(self._consumir()) for _ in range(self.consumidores)]
+        self._tarefas.append(asyncio.create_task(self._recuperar()))
+
+    async def parar(self):
+        tarefas, self._tarefas = self._tarefas, []
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        self._fila = None
+        self._na_fila.clear()
+
+    def enfileirar(self, foto_id: int) -> bool:
+        """
+        Coloca a foto na fila deste worker. False se a fila está cheia (ou o pipeline não
+        foi iniciado): a foto continua pendente no banco e entra pela recuperação
+        """
+        if self._fila is None or foto_id in self._na_fila:
+            return False
+        try:
+            self._fila.put_nowait(foto_id)
+        except asyncio.QueueFull:
+            return False
+        self._na_fila.add(foto_id)
+        return True
+
+    async def _consumir(self):
+        while True:
+            foto_id = await self._fila.get()
+            self._na_fila.discard(foto_id)
+            try:
+                await self.processar(foto_id)
+            except Exception as e:
+                self.falhas += 1
+                logger.error(f"❌ Erro no processamento da foto {foto_id}: {e}")
+
+    async def processar(self, foto_id: int):
+        foto = await run_in_threadpool(reservar_foto, foto_id)
+        if foto is None:
+            return  # pronta ou com outro worker
+        caminho, arquivo_recebido, tentativas = foto
+        destino = os.path.join(settings.UPLOAD_DIR, caminho)
+
+        if not arquivo_recebido:
+            # Foto que reaproveita o arquivo de outra de mesmo conteúdo: pronta quando ele existir.
+            # Sem ele, a reserva fica até vencer e a foto é verificada de novo (origem consultada
+            # antes do arquivo: a outra foto pode terminar entre as duas verificações)
+            pendente = await run_in_threadpool(origem_pendente, caminho)
+            if await run_in_threadpool(os.path.exists, destino):
+                await run_in_threadpool(concluir_foto, foto_id, caminho)
+            elif not pendente and tentativas > settings.PHOTO_MAX_ATTEMPTS:
+                self.falhas += 1
+                logger.error(f"❌ Foto {foto_id}: arquivo {caminho} não existe e nenhuma foto vai gerá-lo")
+                await run_in_threadpool(falhar_foto, foto_id)
+            return
+        origem = caminho_recebido(arquivo_recebido)
+
+        if tentativas > settings.PHOTO_MAX_ATTEMPTS:
+            logger.error(f"❌ Foto {foto_id} falhou {tentativas - 1} vezes; mantendo o arquivo recebido")
+            await run_in_threadpool(manter_recebido, origem, destino)
+        else:
+            try:
+                tamanho = await processamento_fotos.executar(
+                    processar_foto, origem, destino, derivadas_da_foto(caminho)
+                )
+            except PoolSaturado:
+                logger.warning(f"⏳ Pool de fotos cheio - foto {foto_id} volta para a fila sem contar tentativa")
+                await run_in_threadpool(devolver_foto, foto_id)
+                return
+            except Exception as e:
+                self.falhas += 1
+                logger.error(f"❌ Falha ao processar a foto {foto_id} (tentativa {tentativas}): {e}")
+                await run_in_threadpool(liberar_foto, foto_id)
+                return
+            if tamanho:
+                logger.info(f"📷 Foto {foto_id} processada ({tamanho[0]}x{tamanho[1]})")
+
+        await run_in_threadpool(concluir_foto, foto_id, caminho)
+        self.processadas += 1
+
+    async def _recuperar(self):
+        while True:
+            try:
+                livres = self.tamanho_fila - self._fila.qsize()
+                if livres > 0:
+                    ids = await run_in_threadpool(fotos_pendentes, livres, set(self._na_fila))
+                    for foto_id in ids:
+                        if self.enfileirar(foto_id):
+                            self.recuperadas += 1
+            except Exception as e:
+                logger.error(f"❌ Erro na recuperação das fotos pendentes: {e}")
+            await asyncio.sleep(self.intervalo_recuperacao)
+
+    def estatisticas(self):
+        return {
+            "na_fila": self._fila.qsize() if self._fila is not None else 0,
+            "processadas": self.processadas,
+            "recuperadas": self.recuperadas,
+            "falhas": self.falhas
+        }
+
+
+pipeline_fotos = PipelineFotos(
+    settings.PHOTO_PROCESS_WORKERS, settings.PHOTO_QUEUE_MAX, settings.PHOTO_RECOVERY_INTERVAL_SECONDS
+)
@@ -0,0 +1,165 @@
+"""
+Pool de processos para o processamento das fotos (decodificar, reduzir, gravar JPEG).
+
+O Pillow segura a CPU por centenas de milissegundos numa foto de 12MP; rodando na rota
+async isso parava todas as requisições do worker. Cada worker tem um pool de
+PHOTO_PROCESS_WORKERS processos (criado no primeiro uso, processos iniciados com spawn:
+nada de conexões ou threads herdadas do worker). Só caminhos de arquivo passam entre os
+processos, nunca a imagem.
+
+Quem usa o pool é o processamento em segundo plano (app.pipeline_fotos), com uma tarefa por
+processo. Mesmo assim o pool limita as fotos em andamento (PHOTO_PROCESS_WORKERS +
+PHOTO_QUEUE_MAX) e recusa as excedentes com 503 + Retry-After em vez de formar uma fila sem
+limite. As derivadas geradas no acesso (app.rotas.fotos) não ocupam essas vagas: a rota
+tem o próprio limite e espera por uma vaga. Os tempos de espera e de processamento ficam em
+/api/admin/processamento-fotos.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Segundos sugeridos ao cliente (Retry-After) quando o pool está cheio
+ESPERA_SUGERIDA = 5
+
+
+class PoolSaturado(HTTPException):
+    """Pool cheio neste worker (503 + Retry-After): não é falha da foto, tentar de novo depois"""
+
+
+def _cronometrar(funcao, *args):
+    """Roda no processo filho: resultado da função e segundos gastos nela"""
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+def _percentil(valores, fracao: float):
+    if not valores:
+        return 0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * fracao))]
+
+
+class ProcessamentoFotos:
+    """Pool de processos (por worker) com limite de fotos em andamento e métricas de tempo"""
+
+    def __init__(self, processos: int, max_fila: int, tarefas_por_processo: int):
+        self.processos = processos
+        self.limite = processos + max_fila
+        self.tarefas_por_processo = tarefas_por_processo
+        self._executor = None
+        self._lock = threading.Lock()
+        self._em_andamento = 0
+        self._esperas = deque(maxlen=500)
+        self._duracoes = deque(maxlen=500)
+        self.total = 0
+        self.recusadas = 0
+        self.erros = 0
+
+    def _obter_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processos,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.tarefas_por_processo
+                )
+            return self._executor
+
+    def saturado(self) -> bool:
+        with self._lock:
+            return self._em_andamento >= self.limite
+
+    def erro_saturado(self) -> HTTPException:
+        return PoolSaturado(
+            status_code=503,
+            detail="Servidor ocupado processando fotos. Tente novamente em alguns segundos",
+            headers={"Retry-After": str(ESPERA_SUGERIDA)}
+        )
+
+    async def executar(self, funcao, *args, limitar: bool = True):
+        """
+        Executa funcao(*args) num processo do pool e retorna o resultado.
+        503 se já houver `limite` fotos em andamento neste worker; com limitar=False a tarefa
+        não ocupa essas vagas (quem chama limita a concorrência)
+        """
+        with self._lock:
+            if limitar and self._em_andamento >= self.limite:
+                self.recusadas += 1
+                raise self.erro_saturado()
+            if limitar:
+                self._em_andamento += 1
+
+        inicio = time.perf_counter()
+        try:
+            executor = self._obter_executor()
+            resultado, duracao = await asyncio.get_running_loop().run_in_executor(
+                executor, _cronometrar, funcao, *args
+            )
+        except BrokenProcessPool:
+            # Um processo morreu (ex.: falta de memória): o pool não aceita mais tarefas, recriar
+            with self._lock:
+                self.erros += 1
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.error("❌ Pool de processamento de fotos quebrado; será recriado")
+            raise
+        except Exception:
+            with self._lock:
+                self.erros += 1
+            raise
+        finally:
+            if limitar:
+                with self._lock:
+                    self._em_andamento -= 1
+
+        total = time.perf_counter() - inicio
+        with self._lock:
+            self.total += 1
+            self._duracoes.append(duracao)
+            self._esperas.append(max(total - duracao, 0))
+        return resultado
+
+    def encerrar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def estatisticas(self):
+        with self._lock:
+            duracoes, esperas = list(self._duracoes), list(self._esperas)
+            return {
+                "processos": self.processos,
+                "limite_em_andamento": self.limite,
+                "em_andamento": self._em_andamento,
+                "total": self.total,
+                "recusadas": self.recusadas,
+                "erros": self.erros,
+                # Últimas fotos processadas, em milissegundos
+                "processamento_ms": {
+                    "p50": round(_percentil(duracoes, 0.5) * 1000, 1),
+                    "p95": round(_percentil(duracoes, 0.95) * 1000, 1),
+                    "max": round(max(duracoes, default=0) * 1000, 1)
+                },
+                "espera_ms": {
+                    "p50": round(_percentil(esperas, 0.5) * 1000, 1),
+                    "p95": round(_percentil(esperas, 0.95) * 1000, 1),
+                    "max": round(max(esperas, default=0) * 1000, 1)
+                }
+            }
+
+
+processamento_fotos = ProcessamentoFotos(
+    settings.PHOTO_PROCESS_WORKERS, settings.PHOTO_QUEUE_MAX, settings.PHOTO_TASKS_PER_PROCESS
+)
@@ -0,0 +1,560 @@
+"""
+Cálculos agregados usados pelos relatórios administrativos.
+
+Os relatórios leem a tabela km_diario (KM por dia/veículo/motorista), que é
+atualizada na mesma transação das rotas que alteram KM. Assim o custo de um
+relatório depende de dias x veículos, não do histórico de coletas e viagens.
+"""
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
+import numpy as np
+import pytz
+from sqlalchemy import func, case, and_, update
+from sqlalchemy.orm import Session
+from app.database import insert_com_upsert
+from app.cache import incrementar_versao_dados
+from app.arquivo import iterar_arquivo
+from app.modelos import Coleta, Viagem, Veiculo, Usuario, KmDiario
+from app.utils import TZ_BRASIL
+from app.serializacao import data_br
+
+
+def inicio_do_dia_utc(dia):
+    """Retorna o instante UTC (sem tzinfo, como gravado no banco) em que o dia começa no Brasil"""
+    inicio_br = TZ_BRASIL.localize(datetime.combine(dia, time.min))
+    return inicio_br.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+# ===== MANUTENÇÃO DA TABELA km_diario =====
+
+def registrar_km_diario(db: Session, dia, veiculo_id, usuario_id, km_coletas=0, total_usos=0, km_viagens=0, total_viagens=0):
+    """
+    Soma valores à linha (dia, veiculo_id, usuario_id) de km_diario, criando-a se necessário.
+    Não faz commit: roda na transação de quem chamou.
+    """
+    insert = insert_com_upsert(db.get_bind())
+    if insert is None:
+        # Banco sem upsert: buscar e atualizar
+        linha = db.query(KmDiario).filter(
+            KmDiario.dia == dia,
+            KmDiario.veiculo_id == veiculo_id,
+            KmDiario.usuario_id == usuario_id
+        ).with_for_update().first()
+        if not linha:
+            linha = KmDiario(dia=dia, veiculo_id=veiculo_id, usuario_id=usuario_id,
+                             km_coletas=0, total_usos=0, km_viagens=0, total_viagens=0)
+            db.add(linha)
+        linha.km_coletas = (linha.km_coletas or 0) + km_coletas
+        linha.total_usos = (linha.total_usos or 0) + total_usos
+        linha.km_viagens = (linha.km_viagens or 0) + km_viagens
+        linha.total_viagens = (linha.total_viagens or 0) + total_viagens
+        db.flush()
+        return
+
+    stmt = insert(KmDiario).values(
+        dia=dia,
+        veiculo_id=veiculo_id,
+        usuario_id=usuario_id,
+        km_coletas=km_coletas,
+        total_usos=total_usos,
+        km_viagens=km_viagens,
+        total_viagens=total_viagens
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["dia", "veiculo_id", "usuario_id"],
+        set_={
+            "km_coletas": KmDiario.km_coletas + stmt.excluded.km_coletas,
+            "total_usos": KmDiario.total_usos + stmt.excluded.total_usos,
+            "km_viagens": KmDiario.km_viagens + stmt.excluded.km_viagens,
+            "total_viagens": KmDiario.total_viagens + stmt.excluded.total_viagens,
+        }
+    )
+    db.execute(stmt)
+
+
+def km_da_coleta(coleta):
+    """
+    KM de uma coleta para os relatórios (km_devolucao - km_retirada).
+    Mesmo critério dos relatórios: só conta se os dois KMs estiverem preenchidos (e não zero).
+    """
+    if coleta.km_devolucao and coleta.km_retirada and coleta.data_devolucao:
+        return coleta.km_devolucao - coleta.km_retirada
+    return None
+
+
+def registrar_km_coleta(db: Session, coleta, sinal: int = 1):
+    """Soma (sinal=1) ou retira (sinal=-1) a contribuição de uma coleta devolvida em km_diario"""
+    km = km_da_coleta(coleta)
+    if km is None:
+        return
+    registrar_km_diario(
+        db,
+        coleta.data_devolucao_local or data_br(coleta.data_devolucao),
+        coleta.veiculo_id,
+        coleta.usuario_id,
+        km_coletas=sinal * km,
+        total_usos=sinal
+    )
+
+
+def registrar_km_viagem(db: Session, coleta, viagem):
+    """Soma uma viagem finalizada (retorno registrado) em km_diario, no dia da saída"""
+    if not viagem.saida_horario:
+        return
+    registrar_km_diario(
+        db,
+        data_br(viagem.saida_horario),
+        coleta.veiculo_id,
+        coleta.usuario_id,
+        km_viagens=viagem.km_rodado or 0,
+        total_viagens=1
+    )
+
+
+def reconstruir_km_diario(db: Session, lote: int = 1000):
+    """
+    Apaga e recalcula km_diario a partir de coletas e viagens (incluindo as arquivadas).
+    Usado para popular a tabela (backfill) ou corrigir divergências. Faz commit.
+    """
+    totais = {}
+
+    def somar(chave, campo, valor):
+        item = totais.setdefault(chave, {"km_coletas": 0, "total_usos": 0, "km_viagens": 0, "total_viagens": 0})
+        item[campo] += valor
+
+    coletas = db.query(
+        Coleta.veiculo_id, Coleta.usuario_id, Coleta.data_devolucao, Coleta.data_devolucao_local,
+        Coleta.km_retirada, Coleta.km_devolucao
+    ).filter(
+        Coleta.data_devolucao != None
+    ).execution_options(yield_per=lote)
+    for coleta in coletas:
+        km = km_da_coleta(coleta)
+        if km is None:
+            continue
+        chave = (coleta.data_devolucao_local or data_br(coleta.data_devolucao), coleta.veiculo_id, coleta.usuario_id)
+        somar(chave, "km_coletas", km)
+        somar(chave, "total_usos", 1)
+
+    viagens = db.query(
+        Coleta.veiculo_id, Coleta.usuario_id, Viagem.saida_horario, Viagem.km_rodado
+    ).join(
+        Coleta, Coleta.id == Viagem.coleta_id
+    ).filter(
+        Viagem.retorno_horario != None,
+        Viagem.saida_horario != None
+    ).execution_options(yield_per=lote)
+    for viagem in viagens:
+        chave = (data_br(viagem.saida_horario), viagem.veiculo_id, viagem.usuario_id)
+        somar(chave, "km_viagens", viagem.km_rodado or 0)
+        somar(chave, "total_viagens", 1)
+
+    # Coletas e viagens já movidas para o arquivo frio (Parquet)
+    for coletas_lote, viagens_lote in iterar_arquivo(db):
+        donos = {}
+        for linha in coletas_lote:
+            coleta = SimpleNamespace(**linha)
+            donos[coleta.id] = (coleta.veiculo_id, coleta.usuario_id)
+            km = km_da_coleta(coleta)
+            if km is not None:
+                chave = (coleta.data_devolucao_local or data_br(coleta.data_devolucao), coleta.veiculo_id, coleta.usuario_id)
+                somar(chave, "km_coletas", km)
+                somar(chave, "total_usos", 1)
+        for viagem in viagens_lote:
+            if viagem["retorno_horario"] is None or viagem["saida_horario"] is None or viagem["coleta_id"] not in donos:
+                continue
+            chave = (data_br(viagem["saida_horario"]), *donos[viagem["coleta_id"]])
+            somar(chave, "km_viagens", viagem["km_rodado"] or 0)
+            somar(chave, "total_viagens", 1)
+
+    db.query(KmDiario).delete(synchronize_session=False)
+    linhas = [
+        {"dia": dia, "veiculo_id": veiculo_id, "usuario_id": usuario_id, **valores}
+        for (dia, veiculo_id, usuario_id), valores in totais.items()
+    ]
+    for i in range(0, len(linhas), lote):
+        db.execute(KmDiario.__table__.insert(), linhas[i:i + lote])
+    incrementar_versao_dados(db)
+    db.commit()
+    return len(linhas)
+
+
+# ===== TOTAIS DE VIAGENS DA COLETA (colunas desnormalizadas) =====
+
+# Diferença de KM tolerada (soma de floats em ordem diferente)
+TOLERANCIA_KM = 0.001
+
+
+def totais_viagens_calculados(db: Session, ids):
+    """{coleta_id: (total_viagens, total_km_viagens, viagem_aberta_id)} calculados a partir das viagens"""
+    return {
+        coleta_id: (total or 0, km or 0, aberta)
+        for coleta_id, total, km, aberta in db.query(
+            Viagem.coleta_id,
+            func.count(Viagem.id),
+            func.sum(case((Viagem.retorno_horario != None, Viagem.km_rodado), else_=0)),
+            func.max(case((Viagem.retorno_horario == None, Viagem.id), else_=None))
+        ).filter(Viagem.coleta_id.in_(ids)).group_by(Viagem.coleta_id)
+    }
+
+
+def verificar_totais_viagens(db: Session, corrigir: bool = False, lote: int = 1000):
+    """
+    Compara total_viagens, total_km_viagens e viagem_aberta_id de cada coleta com os valores
+    calculados a partir das viagens. Retorna as divergências [(coleta_id, gravado, calculado)];
+    com corrigir=True grava os valores calculados (commit a cada lote).
+    """
+    divergencias = []
+    ultimo_id = 0
+    while True:
+        coletas = db.query(
+            Coleta.id, Coleta.total_viagens, Coleta.total_km_viagens, Coleta.viagem_aberta_id
+        ).filter(Coleta.id > ultimo_id).order_by(Coleta.id).limit(lote).all()
+        if not coletas:
+            break
+        ultimo_id = coletas[-1].id
+
+        calculados = totais_viagens_calculados(db, [coleta.id for coleta in coletas])
+        correcoes = []
+        for coleta in coletas:
+            gravado = (coleta.total_viagens or 0, coleta.total_km_viagens or 0, coleta.viagem_aberta_id)
+            calculado = calculados.get(coleta.id, (0, 0, None))
+            if (gravado[0] != calculado[0] or gravado[2] != calculado[2]
+                    or abs(gravado[1] - calculado[1]) > TOLERANCIA_KM):
+                divergencias.append((coleta.id, gravado, calculado))
+                correcoes.append({"id": coleta.id, "total_viagens": calculado[0],
+                                  "total_km_viagens": calculado[1], "viagem_aberta_id": calculado[2]})
+
+        if corrigir and correcoes:
+            db.execute(update(Coleta), correcoes)
+            db.commit()
+    if corrigir and divergencias:
+        incrementar_versao_dados(db)
+        db.commit()
+    return divergencias
+
+
+# ===== CONSULTAS DOS RELATÓRIOS =====
+
+def km_por_veiculo(db: Session, hoje, incluir_coletas: bool = True):
+    """
+    Calcula km_hoje, km_semana, km_mes e km_total de todos os veículos ativos.
+
+    - Coletas: km_devolucao - km_retirada, na data (Brasil) da devolução
+    - Viagens: km_rodado, na data (Brasil) da saída
+
+    Retorna dict {veiculo_id: {"km_hoje", "km_semana", "km_mes", "km_total"}}.
+    Veículos sem KM registrado não aparecem no dict.
+    """
+    km = KmDiario.km_viagens
+    if incluir_coletas:
+        km = KmDiario.km_coletas + KmDiario.km_viagens
+
+    uma_semana_atras = hoje - timedelta(days=7)
+    um_mes_atras = hoje - timedelta(days=30)
+
+    linhas = db.query(
+        KmDiario.veiculo_id,
+        func.sum(case((KmDiario.dia == hoje, km), else_=0)),
+        func.sum(case((KmDiario.dia >= uma_semana_atras, km), else_=0)),
+        func.sum(case((KmDiario.dia >= um_mes_atras, km), else_=0)),
+        func.sum(km)
+    ).join(
+        Veiculo, Veiculo.id == KmDiario.veiculo_id
+    ).filter(
+        Veiculo.ativo == True
+    ).group_by(KmDiario.veiculo_id).all()
+
+    return {
+        veiculo_id: {
+            "km_hoje": km_hoje or 0,
+            "km_semana": km_semana or 0,
+            "km_mes": km_mes or 0,
+            "km_total": km_total or 0
+        }
+        for veiculo_id, km_hoje, km_semana, km_mes, km_total in linhas
+    }
+
+
+def usos_no_periodo(db: Session, coluna, inicio, fim):
+    """
+    Soma KM e quantidade de usos (coletas devolvidas) entre inicio e fim (datas Brasil, inclusive),
+    agrupando por KmDiario.veiculo_id ou KmDiario.usuario_id.
+
+    Retorna dict {id: (km, total_usos)}.
+    """
+    linhas = db.query(
+        coluna,
+        func.sum(KmDiario.km_coletas),
+        func.sum(KmDiario.total_usos)
+    ).filter(
+        KmDiario.dia >= inicio,
+        KmDiario.dia <= fim
+    ).group_by(coluna).all()
+
+    return {chave: (km or 0, total or 0) for chave, km, total in linhas}
+
+
+def usos_por_dia(db: Session, inicio, fim):
+    """
+    Linhas (dia, veiculo_id, usuario_id, km, total_usos) de km_diario com usos no período.
+    Base do relatório consolidado.
+    """
+    return db.query(
+        KmDiario.dia,
+        KmDiario.veiculo_id,
+        KmDiario.usuario_id,
+        KmDiario.km_coletas,
+        KmDiario.total_usos
+    ).filter(
+        KmDiario.dia >= inicio,
+        KmDiario.dia <= fim,
+        KmDiario.total_usos > 0
+    ).all()
+
+
+def _chaves_periodo(dias, agrupar_por: str):
+    """
+    Chave numérica do período de cada dia (array datetime64[D]), calculada em bloco.
+    A ordem numérica das chaves é a mesma ordem dos rótulos "YYYY-MM-DD", "YYYY-Www" e "YYYY-MM".
+    """
+    if agrupar_por == "dia":
+        return dias.astype(np.int64)
+    if agrupar_por == "semana":
+        # Semana ISO: ano e semana são os da quinta-feira da semana (1970-01-01 foi uma quinta)
+        numero_dia = dias.astype(np.int64)
+        quinta = numero_dia - (numero_dia + 3) % 7 + 3
+        ano_quinta = quinta.astype("datetime64[D]").astype("datetime64[Y]")
+        semana = (quinta - ano_quinta.astype("datetime64[D]").astype(np.int64)) // 7 + 1
+        return (ano_quinta.astype(np.int64) + 1970) * 100 + semana
+    return dias.astype("datetime64[M]").astype(np.int64)
+
+
+def _rotulo_periodo(chave: int, agrupar_por: str) -> str:
+    if agrupar_por == "dia":
+        return str(np.datetime64(chave, "D"))
+    if agrupar_por == "semana":
+        return f"{chave // 100}-W{chave % 100:02d}"
+    return str(np.datetime64(chave, "M"))
+
+
+def consolidar_usos(linhas, agrupar_por: str):
+    """
+    Agrupa as linhas de usos_por_dia por dia, semana ISO ou mês com operações vetorizadas:
+    as colunas viram arrays NumPy e as somas/contagens distintas são feitas por grupo.
+    Retorna a lista de períodos em ordem, no formato do relatório consolidado.
+    """
+    if not linhas:
+        return []
+
+    dias, veiculos, usuarios, kms, usos = zip(*linhas)
+    dias = np.array(dias, dtype="datetime64[D]")
+    veiculos = np.array(veiculos, dtype=np.int64)
+    usuarios = np.array(usuarios, dtype=np.int64)
+    kms = np.array(kms, dtype=np.float64)
+    usos = np.array(usos, dtype=np.int64)
+
+    chaves, grupo = np.unique(_chaves_periodo(dias, agrupar_por), return_inverse=True)
+    total_grupos = len(chaves)
+
+    km_total = np.bincount(grupo, weights=kms, minlength=total_grupos)
+    total_usos = np.bincount(grupo, weights=usos, minlength=total_grupos).astype(np.int64)
+    # Distintos: pares (grupo, id) únicos, contados por grupo
+    veiculos_ativos = np.bincount(np.unique(np.stack([grupo, veiculos]), axis=1)[0], minlength=total_grupos)
+    motoristas_ativos = np.bincount(np.unique(np.stack([grupo, usuarios]), axis=1)[0], minlength=total_grupos)
+
+    resultado = []
+    for i, chave in enumerate(chaves.tolist()):
+        km = float(km_total[i])
+        n_usos = int(total_usos[i])
+        resultado.append({
+            "periodo": _rotulo_periodo(chave, agrupar_por),
+            "km_total": round(km, 2),
+            "total_usos": n_usos,
+            "veiculos_ativos": int(veiculos_ativos[i]),
+            "motoristas_ativos": int(motoristas_ativos[i]),
+            "media_km_por_uso": round(km / n_usos, 2) if n_usos > 0 else 0
+        })
+    return resultado
+
+
+# ===== EXPORTAÇÃO (linhas planas, lidas em lotes) =====
+
+# Dias de cada período pré-definido (relativo a hoje, no horário do Brasil)
+DIAS_POR_PERIODO = {
+    "hoje": 0,
+    "semana": 7,
+    "mes": 30,
+    "trimestre": 90,
+    "semestre": 180,
+    "ano": 365,
+}
+
+
+def calcular_periodo(hoje, periodo, data_inicio=None, data_fim=None):
+    """
+    Converte os parâmetros de período dos relatórios em (inicio, fim).
+    Levanta ValueError se as datas personalizadas forem inválidas.
+    """
+    if periodo == "personalizado" and data_inicio and data_fim:
+        inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
+        fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
+        return inicio, fim
+    # Padrão: último mês
+    return hoje - timedelta(days=DIAS_POR_PERIODO.get(periodo, 30)), hoje
+
+
+COLUNAS_EXPORTACAO_DETALHADO = [
+    "usuario_id", "usuario_nome", "coleta_id", "veiculo_placa", "veiculo_marca", "veiculo_modelo",
+    "data_retirada", "data_devolucao", "km_retirada", "km_devolucao",
+    "viagem_numero", "saida_horario", "saida_km", "retorno_horario", "retorno_km", "km_rodado",
+]
+
+
+def linhas_exportacao_detalhado(db: Session, inicio=None, fim=None, lote: int = 1000):
+    """
+    Uma linha por viagem (ou por coleta sem viagens) dos motoristas, com dados do veículo.
+    Filtra opcionalmente pela data de retirada (Brasil). Lê o banco em lotes (cursor no servidor).
+    """
+    consulta = db.query(
+        Usuario.usuario_id, Usuario.nome, Coleta.id, Veiculo.placa, Veiculo.marca, Veiculo.modelo,
+        Coleta.data_retirada, Coleta.data_devolucao, Coleta.km_retirada, Coleta.km_devolucao,
+        Viagem.numero_viagem, Viagem.saida_horario, Viagem.saida_km,
+        Viagem.retorno_horario, Viagem.retorno_km, Viagem.km_rodado
+    ).join(
+        Usuario, Usuario.id == Coleta.usuario_id
+    ).outerjoin(
+        Veiculo, Veiculo.id == Coleta.veiculo_id
+    ).outerjoin(
+        Viagem, and_(
+            Viagem.coleta_id == Coleta.id,
+            # Toda viagem sai depois da retirada: limite redundante que permite podar partições de viagens
+            Viagem.saida_horario >= inicio_do_dia_utc(inicio)
+        ) if inicio else Viagem.coleta_id == Coleta.id
+    ).filter(
+        Usuario.is_admin == False
+    )
+    if inicio:
+        consulta = consulta.filter(Coleta.data_retirada >= inicio_do_dia_utc(inicio))
+    if fim:
+        consulta = consulta.filter(Coleta.data_retirada < inicio_do_dia_utc(fim + timedelta(days=1)))
+
+    # Coletas arquivadas primeiro (são as mais antigas); retirada <= devolução, então só o início poda lotes
+    yield from _linhas_arquivadas_detalhado(db, inicio, fim)
+
+    consulta = consulta.order_by(Coleta.id, Viagem.numero_viagem).execution_options(yield_per=lote)
+    for linha in consulta:
+        yield tuple(linha)
+
+
+def _linhas_arquivadas_detalhado(db: Session, inicio=None, fim=None):
+    """Linhas do arquivo frio no formato de linhas_exportacao_detalhado, lote a lote"""
+    motoristas = None
+    veiculos = None
+    for coletas_lote, viagens_lote in iterar_arquivo(db, inicio):
+        if motoristas is None:
+            motoristas = dict(
+                (id_, (usuario_id, nome))
+                for id_, usuario_id, nome in db.query(Usuario.id, Usuario.usuario_id, Usuario.nome).filter(Usuario.is_admin == False)
+            )
+            veiculos = dict(
+                (id_, (placa, marca, modelo))
+                for id_, placa, marca, modelo in db.query(Veiculo.id, Veiculo.placa, Veiculo.marca, Veiculo.modelo)
+            )
+
+        viagens_por_coleta = {}
+        for viagem in viagens_lote:
+            viagens_por_coleta.setdefault(viagem["coleta_id"], []).append(viagem)
+
+        for coleta in sorted(coletas_lote, key=lambda c: c["id"]):
+            retirada = coleta["data_retirada"]
+            if inicio and (retirada is None or retirada < inicio_do_dia_utc(inicio)):
+                continue
+            if fim and (retirada is None or retirada >= inicio_do_dia_utc(fim + timedelta(days=1))):
+                continue
+            if coleta["usuario_id"] not in motoristas:
+                continue
+
+            base = (
+                *motoristas[coleta["usuario_id"]], coleta["id"], *veiculos.get(coleta["veiculo_id"], (None, None, None)),
+                coleta["data_retirada"], coleta["data_devolucao"], coleta["km_retirada"], coleta["km_devolucao"]
+            )
+            viagens = sorted(viagens_por_coleta.get(coleta["id"], []), key=lambda v: v["numero_viagem"] or 0)
+            if not viagens:
+                yield base + (None,) * 6
+            for viagem in viagens:
+                yield base + (
+                    viagem["numero_viagem"], viagem["saida_horario"], viagem["saida_km"],
+                    viagem["retorno_horario"], viagem["retorno_km"], viagem["km_rodado"]
+                )
+
+
+COLUNAS_EXPORTACAO_PERIODO = [
+    "coleta_id", "data_devolucao_local", "veiculo_id", "veiculo_placa", "usuario_id", "motorista",
+    "data_retirada", "data_devolucao", "km_retirada", "km_devolucao", "km_rodado",
+    "observacoes_retirada", "observacoes_devolucao",
+]
+
+
+def linhas_exportacao_periodo(db: Session, inicio, fim, lote: int = 1000):
+    """
+    Uma linha por coleta devolvida no período (data da devolução no Brasil, coluna indexada).
+    Lê o banco em lotes (cursor no servidor).
+    """
+    consulta = db.query(
+        Coleta.id.label("coleta_id"),
+        Coleta.data_devolucao_local,
+        Veiculo.id.label("veiculo_id"),
+        Veiculo.placa.label("veiculo_placa"),
+        Usuario.usuario_id.label("usuario_id"),
+        Usuario.nome.label("motorista"),
+        Coleta.data_retirada,
+        Coleta.data_devolucao,
+        Coleta.km_retirada,
+        Coleta.km_devolucao,
+        Coleta.observacoes_retirada,
+        Coleta.observacoes_devolucao
+    ).outerjoin(
+        Veiculo, Veiculo.id == Coleta.veiculo_id
+    ).outerjoin(
+        Usuario, Usuario.id == Coleta.usuario_id
+    ).filter(
+        Coleta.data_devolucao_local >= inicio,
+        Coleta.data_devolucao_local <= fim
+    ).order_by(
+        Coleta.data_devolucao_local, Coleta.id
+    ).execution_options(yield_per=lote)
+
+    # Coletas arquivadas primeiro: todas foram devolvidas antes das que estão no banco
+    for valores in _linhas_arquivadas_periodo(db, inicio, fim):
+        yield tuple(valores[coluna] for coluna in COLUNAS_EXPORTACAO_PERIODO)
+
+    for linha in consulta:
+        km = km_da_coleta(linha)
+        valores = linha._asdict()
+        valores["km_rodado"] = round(km, 2) if km is not None else None
+        yield tuple(valores[coluna] for coluna in COLUNAS_EXPORTACAO_PERIODO)
+
+
+def _linhas_arquivadas_periodo(db: Session, inicio, fim):
+    """Coletas do arquivo frio devolvidas no período, como dicts com as colunas de COLUNAS_EXPORTACAO_PERIODO"""
+    motoristas = None
+    veiculos = None
+    for coletas_lote, _ in iterar_arquivo(db, inicio, fim):
+        if motoristas is None:
+            motoristas = dict((id_, (usuario_id, nome)) for id_, usuario_id, nome in db.query(Usuario.id, Usuario.usuario_id, Usuario.nome))
+            veiculos = dict(db.query(Veiculo.id, Veiculo.placa))
+
+        coletas = [c for c in coletas_lote if inicio <= c["data_devolucao_local"] <= fim]
+        for coleta in sorted(coletas, key=lambda c: (c["data_devolucao_local"], c["id"])):
+            km = km_da_coleta(SimpleNamespace(**coleta))
+            usuario_id, motorista = motoristas.get(coleta["usuario_id"], (None, None))
+            yield {
+                **coleta,
+                "coleta_id": coleta["id"],
+                "veiculo_id": coleta["veiculo_id"] if coleta["veiculo_id"] in veiculos else None,
+                "veiculo_placa": veiculos.get(coleta["veiculo_id"]),
+                "usuario_id": usuario_id,
+                "motorista": motorista,
+                "km_rodado": round(km, 2) if km is not None else None,
+            }
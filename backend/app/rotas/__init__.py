@@ -1,5 +1,7 @@
 from .auth import router as auth_router
 from .admin import router as admin_router
 from .coleta import router as coleta_router
+from .eventos import router as eventos_router
+from .fotos import router as fotos_router
 
-__all__ = ["auth_router", "admin_router", "coleta_router"]
+__all__ = ["auth_router", "admin_router", "coleta_router", "eventos_router", "fotos_router"]
@@ -1,46 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, cast, Date
+from sqlalchemy import func, and_, or_, cast, Date
 from app.database import get_db
-from app.modelos import Usuario, Veiculo, Coleta, Viagem, Foto
+from app.modelos import Usuario, Veiculo, Coleta, Viagem, Foto, KmDiario, JobRelatorio
 from app.esquemas.usuario import UsuarioCreate, UsuarioResponse
 from app.esquemas.veiculo import VeiculoCreate, VeiculoResponse
-from app.utils import hash_password, verify_token
+from app.utils import hash_password, verify_token, TZ_BRASIL
+from app.relatorios import (
+    km_por_veiculo, usos_no_periodo, usos_por_dia, consolidar_usos, registrar_km_coleta, calcular_periodo,
+    linhas_exportacao_detalhado, linhas_exportacao_periodo, inicio_do_dia_utc,
+    COLUNAS_EXPORTACAO_DETALHADO, COLUNAS_EXPORTACAO_PERIODO
+)
+from app.exportacao import stream_exportacao, FORMATOS_EXPORTACAO
+from app.arquivo import coletas_arquivadas, viagens_arquivadas
+from app.paginacao import (
+    LIMITE_PADRAO, LIMITE_MAXIMO, decodificar_cursor, depois_do_cursor, fechar_pagina, paginacao_resposta
+)
+from app.cache import (
+    relatorio_em_cache, cache_relatorios, incrementar_versao_dados, versao_dados, etag_dados, resposta_condicional
+)
+from app.disponibilidade import disponibilidade_veiculos
+from app.serializacao import utc_para_br, data_br
+from app.processamento_fotos import processamento_fotos
+from app.pipeline_fotos import pipeline_fotos, PROCESSANDO, PRONTA
+from app.derivadas import urls_foto
+from app.eventos import registrar_evento
+from app.jobs_relatorio import (
+    criar_job, job_para_dict, total_jobs_ativos, caminho_arquivo_job, FORMATOS_JOB
+)
+from app.config import settings
+import os
 from typing import List, Optional
 from datetime import datetime, timedelta, date
-import pytz
-from pytz import timezone as pytz_timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 security = HTTPBearer()
-# Timezone do Brasil (São Paulo)
-TZ_BRASIL = pytz_timezone('America/Sao_Paulo')
 
 def get_hoje_br():
     """Retorna a data de hoje no fuso horário do Brasil"""
     return datetime.now(TZ_BRASIL).date()
 
+def _periodo_relatorio(periodo: Optional[str], data_inicio: Optional[str], data_fim: Optional[str]):
+    """(inicio, fim) dos parâmetros de período dos relatórios (app.relatorios.calcular_periodo); 400 se as datas forem inválidas"""
+    try:
+        return calcular_periodo(get_hoje_br(), periodo, data_inicio, data_fim)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de data inválido. Use YYYY-MM-DD")
 
-def converter_utc_para_br(dt_utc):
-    """Converte datetime UTC para datetime Brasil (São Paulo)"""
-    if dt_utc is None:
-        return None
-    if dt_utc.tzinfo is None:
-        # Se não tem timezone info, assume UTC
-        dt_utc = dt_utc.replace(tzinfo=pytz.utc)
-    return dt_utc.astimezone(TZ_BRASIL)
-
-
-def get_data_br(dt_utc):
-    """Extrai apenas a data em timezone Brasil de um datetime UTC"""
-    dt_br = converter_utc_para_br(dt_utc)
-    if dt_br is None:
-        return None
-    return dt_br.date()
 
 
 def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
@@ -74,12 +85,16 @@ def criar_usuario(usuario: UsuarioCreate, current_admin: Usuario = Depends(get_c
         is_admin=usuario.is_admin
     )
     db.add(novo_usuario)
+    incrementar_versao_dados(db)
     db.commit()
     db.refresh(novo_usuario)
     return novo_usuario
 
 @router.get("/usuarios", response_model=List[UsuarioResponse])
-def listar_usuarios(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+def listar_usuarios(request: Request, response: Response, current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    nao_modificada = resposta_condicional(request, response, etag_dados(versao_dados(db), "usuarios"))
+    if nao_modificada:
+        return nao_modificada
     return db.query(Usuario).all()
 
 @router.delete("/usuarios/{usuario_id}")
@@ -89,6 +104,7 @@ def deletar_usuario(usuario_id: str, current_admin: Usuario = Depends(get_curren
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     db.delete(usuario)
+    incrementar_versao_dados(db)
     db.commit()
     return {"mensagem": "Usuário deletado com sucesso"}
 
@@ -99,6 +115,7 @@ def atualizar_senha(usuario_id: str, nova_senha: dict, current_admin: Usuario =
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     usuario.senha_hash = hash_password(nova_senha["nova_senha"])
+    incrementar_versao_dados(db)
     db.commit()
     return {"mensagem": "Senha atualizada com sucesso"}
 
@@ -109,6 +126,7 @@ def atualizar_privilegio_admin(usuario_id: str, dados: dict, current_admin: Usua
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     usuario.is_admin = dados.get("is_admin", False)
+    incrementar_versao_dados(db)
     db.commit()
     return {"mensagem": "Privilégio atualizado com sucesso"}
 
@@ -127,12 +145,19 @@ def criar_veiculo(veiculo: VeiculoCreate, current_admin: Usuario = Depends(get_c
         km_atual=veiculo.km_inicial  # Admin define o KM inicial
     )
     db.add(novo_veiculo)
+    db.flush()
+    registrar_evento(db, "veiculo", veiculo_id=novo_veiculo.id)
+    incrementar_versao_dados(db)
     db.commit()
+    disponibilidade_veiculos.invalidar()
     db.refresh(novo_veiculo)
     return novo_veiculo
 
 @router.get("/veiculos", response_model=List[VeiculoResponse])
-def listar_veiculos(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+def listar_veiculos(request: Request, response: Response, current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    nao_modificada = resposta_condicional(request, response, etag_dados(versao_dados(db), "veiculos"))
+    if nao_modificada:
+        return nao_modificada
     return db.query(Veiculo).filter(Veiculo.ativo == True).all()
 
 @router.delete("/veiculos/{veiculo_id}")
@@ -143,7 +168,10 @@ def deletar_veiculo(veiculo_id: int, current_admin: Usuario = Depends(get_curren
     
     # Marcar como inativo ao invés de deletar
     veiculo.ativo = False
+    registrar_evento(db, "veiculo", veiculo_id=veiculo_id)
+    incrementar_versao_dados(db)
     db.commit()
+    disponibilidade_veiculos.invalidar()
     return {"mensagem": "Veículo deletado com sucesso"}
 
 @router.put("/veiculos/{veiculo_id}/km")
@@ -167,7 +195,10 @@ def ajustar_km_veiculo(veiculo_id: int, dados: dict, current_admin: Usuario = De
     
     km_anterior = veiculo.km_atual
     veiculo.km_atual = km_novo
+    registrar_evento(db, "veiculo", veiculo_id=veiculo_id)
+    incrementar_versao_dados(db)
     db.commit()
+    disponibilidade_veiculos.invalidar()
     db.refresh(veiculo)
     
     return {
@@ -182,70 +213,33 @@ def ajustar_km_veiculo(veiculo_id: int, dados: dict, current_admin: Usuario = De
 
 # ===== RELATÓRIOS =====
 @router.get("/relatorios")
-def gerar_relatorio(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+def gerar_relatorio(request: Request, response: Response, current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
     """Relatório geral: KM por veículo (sem mencionar usuários)"""
-    from datetime import datetime, timedelta
-    from app.modelos import Viagem
-    
-    relatorio_veiculos = []
+    # KM de hoje/semana/mês dependem do dia: o ETag muda também na virada do dia
+    hoje = get_hoje_br()
+    nao_modificada = resposta_condicional(request, response, etag_dados(versao_dados(db), "relatorios", hoje))
+    if nao_modificada:
+        return nao_modificada
+    return relatorio_em_cache(db, "relatorios", {}, hoje, lambda: _calcular_relatorio(db), response)
+
+def _calcular_relatorio(db: Session):
     veiculos = db.query(Veiculo).filter(Veiculo.ativo == True).all()
     
-    hoje = get_hoje_br()
-    uma_semana_atras = hoje - timedelta(days=7)
-    um_mes_atras = hoje - timedelta(days=30)
+    # KM de coletas (devolução) + viagens intermédias (sair/retornar), agregado no banco
+    km_veiculos = km_por_veiculo(db, get_hoje_br())
     
+    relatorio_veiculos = []
     for veiculo in veiculos:
-        # Buscar todas as coletas deste veículo
-        coletas = db.query(Coleta).filter(Coleta.veiculo_id == veiculo.id).all()
-        
-        km_total = 0
-        km_hoje = 0
-        km_semana = 0
-        km_mes = 0
-        
-        for coleta in coletas:
-            # Calcular KM da devolução (km_devolucao - km_retirada)
-            if coleta.km_devolucao and coleta.km_retirada:
-                km_coleta = coleta.km_devolucao - coleta.km_retirada
-                km_total += km_coleta
-                
-                if coleta.data_devolucao:
-                    # CORRIGIDO: Converter data de devolução de UTC para Brasil
-                    data_coleta = get_data_br(coleta.data_devolucao)
-                    
-                    if data_coleta == hoje:
-                        km_hoje += km_coleta
-                    if data_coleta >= uma_semana_atras:
-                        km_semana += km_coleta
-                    if data_coleta >= um_mes_atras:
-                        km_mes += km_coleta
-            
-            # TAMBÉM contar viagens intermédias (sair/retornar)
-            viagens = db.query(Viagem).filter(Viagem.coleta_id == coleta.id).all()
-            for viagem in viagens:
-                if viagem.km_rodado:
-                    km_total += viagem.km_rodado
-                    
-                    if viagem.saida_horario:
-                        # CORRIGIDO: Converter data de saída de UTC para Brasil
-                        data_viagem = get_data_br(viagem.saida_horario)
-                        
-                        if data_viagem == hoje:
-                            km_hoje += viagem.km_rodado
-                        if data_viagem >= uma_semana_atras:
-                            km_semana += viagem.km_rodado
-                        if data_viagem >= um_mes_atras:
-                            km_mes += viagem.km_rodado
-        
+        km = km_veiculos.get(veiculo.id, {})
         relatorio_veiculos.append({
             "veiculo_id": veiculo.id,
             "placa": veiculo.placa,
             "marca": veiculo.marca,
             "modelo": veiculo.modelo,
-            "km_hoje": round(km_hoje, 2),
-            "km_semana": round(km_semana, 2),
-            "km_mes": round(km_mes, 2),
-            "km_total": round(km_total, 2)
+            "km_hoje": round(km.get("km_hoje", 0), 2),
+            "km_semana": round(km.get("km_semana", 0), 2),
+            "km_mes": round(km.get("km_mes", 0), 2),
+            "km_total": round(km.get("km_total", 0), 2)
         })
     
     return {
@@ -265,16 +259,11 @@ def listar_fotos_usuario(usuario_id: str, current_admin: Usuario = Depends(get_c
     resultados = db.query(Foto, Coleta).join(Coleta, Foto.coleta_id == Coleta.id).join(Usuario, Coleta.usuario_id == Usuario.id)
     resultados = resultados.filter(Usuario.usuario_id == usuario_id).order_by(Foto.criado_em.desc()).all()
 
-    # Timezone do Brasil
-    tz = pytz.timezone('America/Sao_Paulo')
-    
     agrupado = {}
     for foto, coleta in resultados:
         # Converter UTC para Brasil antes de extrair a data
         if foto.criado_em:
-            # Converter de UTC para São Paulo
-            criado_em_utc = foto.criado_em.replace(tzinfo=pytz.utc)
-            criado_em_br = criado_em_utc.astimezone(tz)
+            criado_em_br = utc_para_br(foto.criado_em)
             data = criado_em_br.date().isoformat()
             criado_em_str = criado_em_br.isoformat()
             logger.info(f"[FOTO DEBUG] ID={foto.id} UTC={foto.criado_em} BR={criado_em_br} DATA={data}")
@@ -289,7 +278,11 @@ def listar_fotos_usuario(usuario_id: str, current_admin: Usuario = Depends(get_c
             "coleta_id": coleta.id,
             "etapa": foto.etapa,
             "caminho": foto.caminho,
-            "criado_em": criado_em_str
+            "criado_em": criado_em_str,
+            # "processando": arquivo final ainda não gerado; "falhou": sem arquivo (app/pipeline_fotos.py)
+            "status": foto.status or PRONTA,
+            # Foto completa e derivadas (miniatura para a grade, media para a visualização)
+            **urls_foto(foto.caminho)
         })
 
     fotos_por_dia = [
@@ -303,18 +296,80 @@ def listar_fotos_usuario(usuario_id: str, current_admin: Usuario = Depends(get_c
         "fotos_por_dia": fotos_por_dia
     }
 
+def _por_id(db: Session, modelo, ids):
+    """Carrega as linhas de `modelo` com os ids indicados numa única query: {id: linha}"""
+    if not ids:
+        return {}
+    return {linha.id: linha for linha in db.query(modelo).filter(modelo.id.in_(ids))}
+
+def _pagina_coletas_periodo(db: Session, coluna, valor, inicio, fim, cursor: Optional[str], limite: int):
+    """
+    Página (keyset por data_devolucao, id decrescentes) das coletas com os dois KMs devolvidas
+    em [inicio, fim] (Brasil) de um motorista/veículo, juntando o arquivo frio quando o alcança.
+    Retorna (coletas, proximo_cursor).
+    """
+    posicao = decodificar_cursor(cursor) if cursor else None
+    consulta = db.query(Coleta).filter(
+        coluna == valor,
+        Coleta.data_devolucao >= inicio_do_dia_utc(inicio),
+        Coleta.data_devolucao < inicio_do_dia_utc(fim + timedelta(days=1)),
+        Coleta.km_retirada != 0,
+        Coleta.km_devolucao != 0
+    )
+    if posicao:
+        consulta = consulta.filter(depois_do_cursor(Coleta.data_devolucao, Coleta.id, posicao))
+    coletas = consulta.order_by(Coleta.data_devolucao.desc(), Coleta.id.desc()).limit(limite + 1).all()
+    
+    # Arquivo frio: só os dias entre o cursor e a última coleta viva que ainda pode entrar na página
+    inicio_arquivo = max(inicio, coletas[-1].data_devolucao_local) if len(coletas) > limite else inicio
+    fim_arquivo = min(fim, data_br(posicao[0])) if posicao else fim
+    if inicio_arquivo <= fim_arquivo:
+        arquivadas = [
+            c for c in coletas_arquivadas(db, inicio_arquivo, fim_arquivo, **{coluna.key: valor})
+            if c.km_retirada and c.km_devolucao and (not posicao or (c.data_devolucao, c.id) < posicao)
+        ]
+        if arquivadas:
+            coletas = sorted(coletas + arquivadas, key=lambda c: (c.data_devolucao, c.id), reverse=True)[:limite + 1]
+    return fechar_pagina(coletas, limite, "data_devolucao")
+
+def _totais_km_diario(db: Session, coluna, valor, inicio, fim):
+    """(KM, usos) das coletas devolvidas em [inicio, fim] de um motorista/veículo, via km_diario"""
+    km, usos = db.query(
+        func.coalesce(func.sum(KmDiario.km_coletas), 0), func.coalesce(func.sum(KmDiario.total_usos), 0)
+    ).filter(coluna == valor, KmDiario.dia >= inicio, KmDiario.dia <= fim).one()
+    return km or 0, int(usos or 0)
+
+def _totais_km_diario_por_dia(db: Session, coluna, valor, dias):
+    """{dia ISO: (KM, usos)} das coletas devolvidas nos dias indicados, via km_diario"""
+    if not dias:
+        return {}
+    linhas = db.query(
+        KmDiario.dia, func.sum(KmDiario.km_coletas), func.sum(KmDiario.total_usos)
+    ).filter(coluna == valor, KmDiario.dia.in_(dias)).group_by(KmDiario.dia)
+    return {dia.isoformat(): (km or 0, int(usos or 0)) for dia, km, usos in linhas}
+
 @router.get("/relatorios/usuario/{usuario_id}")
 def relatorio_usuario_detalhado(
     usuario_id: str, 
-    periodo: Optional[str] = Query("mes", description="hoje, semana, mes, personalizado"),
+    periodo: Optional[str] = Query("mes", description="hoje, semana, mes, trimestre, semestre, ano, personalizado"),
     data_inicio: Optional[str] = Query(None, description="Data início YYYY-MM-DD"),
     data_fim: Optional[str] = Query(None, description="Data fim YYYY-MM-DD"),
+    cursor: Optional[str] = Query(None, description="paginacao.proximo_cursor da página anterior"),
+    limite: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO, description="Coletas por página"),
     current_admin: Usuario = Depends(get_current_admin), 
     db: Session = Depends(get_db)
 ):
-    """Relatório detalhado de um usuário: KM por veículo com datas e filtro de período"""
+    """Relatório detalhado de um usuário: KM por veículo com datas e filtro de período, paginado por cursor"""
+    parametros = {"usuario_id": usuario_id, "periodo": periodo, "data_inicio": data_inicio, "data_fim": data_fim,
+                  "cursor": cursor, "limite": limite}
+    return relatorio_em_cache(
+        db, "relatorios/usuario", parametros, get_hoje_br(),
+        lambda: _calcular_relatorio_usuario(db, **parametros)
+    )
+
+def _calcular_relatorio_usuario(db: Session, usuario_id: str, periodo: Optional[str], data_inicio: Optional[str], data_fim: Optional[str],
+                                cursor: Optional[str] = None, limite: int = LIMITE_PADRAO):
     from app.modelos import Viagem
-    from datetime import datetime, timedelta
     
     # Buscar usuário
     usuario = db.query(Usuario).filter(Usuario.usuario_id == usuario_id).first()
@@ -322,55 +377,26 @@ def relatorio_usuario_detalhado(
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     # Calcular período
-    hoje = get_hoje_br()
-    if periodo == "personalizado" and data_inicio and data_fim:
-        try:
-            inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
-            fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Formato de data inválido. Use YYYY-MM-DD")
-    elif periodo == "hoje":
-        inicio = fim = hoje
-    elif periodo == "semana":
-        inicio = hoje - timedelta(days=7)
-        fim = hoje
-    elif periodo == "mes":
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
-    else:
-        # Padrão: último mês
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
-    
-    # Buscar coletas do usuário (depois vamos filtrar por data em BR)
-    coletas_todas = db.query(Coleta).filter(
-        Coleta.usuario_id == usuario.id,
-        Coleta.data_devolucao != None
-    ).order_by(Coleta.data_devolucao.desc()).all()
-    
-    # CORRIGIDO: Filtrar por data convertendo UTC para Brasil
-    coletas = []
-    for coleta in coletas_todas:
-        data_devolucao_br = get_data_br(coleta.data_devolucao)
-        if inicio <= data_devolucao_br <= fim:
-            coletas.append(coleta)
+    inicio, fim = _periodo_relatorio(periodo, data_inicio, data_fim)
+    
+    # Página de coletas do usuário devolvidas no período (mais recentes primeiro)
+    coletas, proximo_cursor = _pagina_coletas_periodo(db, Coleta.usuario_id, usuario.id, inicio, fim, cursor, limite)
+    veiculos = _por_id(db, Veiculo, {c.veiculo_id for c in coletas})
+    
+    # Totais do período e de cada dia da página vêm de km_diario: não dependem da página
+    km_total_periodo, total_coletas_periodo = _totais_km_diario(db, KmDiario.usuario_id, usuario.id, inicio, fim)
+    totais_dia = _totais_km_diario_por_dia(db, KmDiario.usuario_id, usuario.id, {c.data_devolucao_local for c in coletas})
     
     # Organizar por dia
     uso_por_dia = {}
-    km_total_periodo = 0
-    total_coletas_periodo = 0
-    
-    # Timezone do Brasil (São Paulo)
-    from datetime import timezone, timedelta as td
-    tz_brasil = timezone(td(hours=-3))
     
     for coleta in coletas:
-        veiculo = db.query(Veiculo).filter(Veiculo.id == coleta.veiculo_id).first()
+        veiculo = veiculos.get(coleta.veiculo_id)
         if not veiculo:
             continue
         
         # CORRIGIDO: Data da devolução em timezone Brasil como chave
-        dia = get_data_br(coleta.data_devolucao).isoformat()
+        dia = coleta.data_devolucao_local.isoformat()
         
         if dia not in uso_por_dia:
             uso_por_dia[dia] = {
@@ -378,53 +404,36 @@ def relatorio_usuario_detalhado(
                 "usos": []
             }
         
-        # Contar a devolução (km_devolucao - km_retirada)
-        if coleta.km_devolucao and coleta.km_retirada:
-            km_rodado = coleta.km_devolucao - coleta.km_retirada
-            km_total_periodo += km_rodado
-            total_coletas_periodo += 1
-            
-            # Convertendo horários para timezone local
-            hora_saida = "N/A"
-            hora_chegada = "N/A"
-            
-            if coleta.data_retirada:
-                # Se for timezone-aware, converte; senão assume UTC
-                dt_saida = coleta.data_retirada
-                if dt_saida.tzinfo is None:
-                    dt_saida = dt_saida.replace(tzinfo=timezone.utc)
-                dt_saida_local = dt_saida.astimezone(tz_brasil)
-                hora_saida = dt_saida_local.strftime("%H:%M")
-            
-            if coleta.data_devolucao:
-                dt_chegada = coleta.data_devolucao
-                if dt_chegada.tzinfo is None:
-                    dt_chegada = dt_chegada.replace(tzinfo=timezone.utc)
-                dt_chegada_local = dt_chegada.astimezone(tz_brasil)
-                hora_chegada = dt_chegada_local.strftime("%H:%M")
-            
-            uso_por_dia[dia]["usos"].append({
-                "coleta_id": coleta.id,
-                "veiculo_placa": veiculo.placa,
-                "veiculo_marca": veiculo.marca,
-                "veiculo_modelo": veiculo.modelo,
-                "hora_saida": hora_saida,
-                "hora_chegada": hora_chegada,
-                "km_retirada": coleta.km_retirada,
-                "km_devolucao": coleta.km_devolucao,
-                "km_rodado": round(km_rodado, 2),
-                "observacoes_retirada": coleta.observacoes_retirada,
-                "observacoes_devolucao": coleta.observacoes_devolucao
-            })
+        # A página só tem coletas com os dois KMs (km_devolucao - km_retirada)
+        km_rodado = coleta.km_devolucao - coleta.km_retirada
+        
+        # Horários no fuso de São Paulo (mesma conversão das respostas da API)
+        hora_saida = utc_para_br(coleta.data_retirada).strftime("%H:%M") if coleta.data_retirada else "N/A"
+        hora_chegada = utc_para_br(coleta.data_devolucao).strftime("%H:%M") if coleta.data_devolucao else "N/A"
+        
+        uso_por_dia[dia]["usos"].append({
+            "coleta_id": coleta.id,
+            "veiculo_placa": veiculo.placa,
+            "veiculo_marca": veiculo.marca,
+            "veiculo_modelo": veiculo.modelo,
+            "hora_saida": hora_saida,
+            "hora_chegada": hora_chegada,
+            "km_retirada": coleta.km_retirada,
+            "km_devolucao": coleta.km_devolucao,
+            "km_rodado": round(km_rodado, 2),
+            "observacoes_retirada": coleta.observacoes_retirada,
+            "observacoes_devolucao": coleta.observacoes_devolucao
+        })
     
-    # Preparar resposta organizada por dia
+    # Preparar resposta organizada por dia (um dia pode continuar na próxima página;
+    # km_total_dia e total_usos são sempre do dia inteiro)
     dias_list = []
     for dia, dados in sorted(uso_por_dia.items(), reverse=True):
-        km_dia = sum(uso["km_rodado"] for uso in dados["usos"])
+        km_dia, usos_dia = totais_dia.get(dia, (0, 0))
         dias_list.append({
             "data": dia,
             "km_total_dia": round(km_dia, 2),
-            "total_usos": len(dados["usos"]),
+            "total_usos": usos_dia,
             "usos": dados["usos"]
         })
     
@@ -443,73 +452,88 @@ def relatorio_usuario_detalhado(
             "media_km_por_coleta": round(km_total_periodo / total_coletas_periodo, 2) if total_coletas_periodo > 0 else 0,
             "media_km_por_dia": round(km_total_periodo / ((fim - inicio).days + 1), 2)
         },
-        "uso_por_dia": dias_list
+        "uso_por_dia": dias_list,
+        "paginacao": paginacao_resposta(limite, proximo_cursor)
     }
 
 @router.get("/relatorios/detalhado")
-def gerar_relatorio_detalhado(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
-    """Gera relatório detalhado com km por veículo e por usuário"""
-    from datetime import datetime, timedelta
-    from app.modelos import Viagem
+def gerar_relatorio_detalhado(
+    data_inicio: Optional[str] = Query(None, description="Data início YYYY-MM-DD (com data_fim; padrão: último ano)"),
+    data_fim: Optional[str] = Query(None, description="Data fim YYYY-MM-DD"),
+    current_admin: Usuario = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Gera relatório detalhado com km por veículo e por usuário (coletas devolvidas no período e em andamento)"""
+    parametros = {"data_inicio": data_inicio, "data_fim": data_fim}
+    return relatorio_em_cache(
+        db, "relatorios/detalhado", parametros, get_hoje_br(),
+        lambda: _calcular_relatorio_detalhado(db, **parametros)
+    )
+
+def _calcular_relatorio_detalhado(db: Session, data_inicio: Optional[str], data_fim: Optional[str]):
+    hoje = get_hoje_br()
+    # Datas informadas ou, por padrão, o último ano
+    inicio, fim = _periodo_relatorio("personalizado" if data_inicio and data_fim else "ano", data_inicio, data_fim)
     
-    # Relatório de KM por veículo
-    relatorio_veiculos = []
+    # Relatório de KM por veículo (apenas viagens), agregado no banco
     veiculos = db.query(Veiculo).filter(Veiculo.ativo == True).all()
+    km_veiculos = km_por_veiculo(db, hoje, incluir_coletas=False)
     
-    hoje = get_hoje_br()
-    uma_semana_atras = hoje - timedelta(days=7)
-    um_mes_atras = hoje - timedelta(days=30)
-    
+    relatorio_veiculos = []
     for veiculo in veiculos:
-        coletas = db.query(Coleta).filter(Coleta.veiculo_id == veiculo.id).all()
-        
-        km_total = 0
-        km_hoje = 0
-        km_semana = 0
-        km_mes = 0
-        
-        for coleta in coletas:
-            viagens = db.query(Viagem).filter(Viagem.coleta_id == coleta.id).all()
-            
-            for viagem in viagens:
-                if viagem.km_rodado:
-                    km_total += viagem.km_rodado
-                    
-                    if viagem.saida_horario:
-                        # CORRIGIDO: Converter data de saída de UTC para Brasil
-                        data_viagem = get_data_br(viagem.saida_horario)
-                        
-                        if data_viagem == hoje:
-                            km_hoje += viagem.km_rodado
-                        if data_viagem >= uma_semana_atras:
-                            km_semana += viagem.km_rodado
-                        if data_viagem >= um_mes_atras:
-                            km_mes += viagem.km_rodado
-        
+        km = km_veiculos.get(veiculo.id, {})
         relatorio_veiculos.append({
             "veiculo_id": veiculo.id,
             "placa": veiculo.placa,
             "marca": veiculo.marca,
             "modelo": veiculo.modelo,
-            "km_hoje": round(km_hoje, 2),
-            "km_semana": round(km_semana, 2),
-            "km_mes": round(km_mes, 2),
-            "km_total": round(km_total, 2)
+            "km_hoje": round(km.get("km_hoje", 0), 2),
+            "km_semana": round(km.get("km_semana", 0), 2),
+            "km_mes": round(km.get("km_mes", 0), 2),
+            "km_total": round(km.get("km_total", 0), 2)
         })
     
+    # Coletas do arquivo frio devolvidas no período, agrupadas por motorista
+    coletas_por_usuario = {}
+    for coleta in coletas_arquivadas(db, inicio, fim):
+        coletas_por_usuario.setdefault(coleta.usuario_id, []).append(coleta)
+    viagens_por_coleta = {}
+    if coletas_por_usuario:
+        ids_arquivados = [c.id for lista in coletas_por_usuario.values() for c in lista]
+        for viagem in viagens_arquivadas(db, ids_arquivados, inicio, fim):
+            viagens_por_coleta.setdefault(viagem.coleta_id, []).append(viagem)
+    for lista in viagens_por_coleta.values():
+        lista.sort(key=lambda v: v.numero_viagem or 0)
+    
+    # Coletas vivas devolvidas no período ou em andamento, e suas viagens, numa query cada
+    filtro_coletas = or_(
+        Coleta.data_devolucao == None,
+        and_(
+            Coleta.data_devolucao >= inicio_do_dia_utc(inicio),
+            Coleta.data_devolucao < inicio_do_dia_utc(fim + timedelta(days=1))
+        )
+    )
+    for coleta in db.query(Coleta).filter(filtro_coletas).order_by(Coleta.id):
+        coletas_por_usuario.setdefault(coleta.usuario_id, []).append(coleta)
+    ids_vivos = db.query(Coleta.id).filter(filtro_coletas)
+    for viagem in db.query(Viagem).filter(Viagem.coleta_id.in_(ids_vivos)).order_by(Viagem.coleta_id, Viagem.id):
+        viagens_por_coleta.setdefault(viagem.coleta_id, []).append(viagem)
+    
+    veiculos_por_id = _por_id(db, Veiculo, {c.veiculo_id for lista in coletas_por_usuario.values() for c in lista})
+    
     # Relatório de usuários e suas coletas
     relatorio_usuarios = []
     usuarios = db.query(Usuario).filter(Usuario.is_admin == False).all()
     
     for usuario in usuarios:
-        coletas = db.query(Coleta).filter(Coleta.usuario_id == usuario.id).all()
+        coletas = coletas_por_usuario.get(usuario.id, [])
         
         coletas_detalhes = []
         km_usuario = 0
         
         for coleta in coletas:
-            veiculo = db.query(Veiculo).filter(Veiculo.id == coleta.veiculo_id).first()
-            viagens = db.query(Viagem).filter(Viagem.coleta_id == coleta.id).all()
+            veiculo = veiculos_por_id.get(coleta.veiculo_id)
+            viagens = viagens_por_coleta.get(coleta.id, [])
             
             km_coleta = sum(v.km_rodado for v in viagens if v.km_rodado)
             km_usuario += km_coleta
@@ -545,6 +569,10 @@ def gerar_relatorio_detalhado(current_admin: Usuario = Depends(get_current_admin
         })
     
     return {
+        "periodo": {
+            "data_inicio": inicio.isoformat(),
+            "data_fim": fim.isoformat()
+        },
         "relatorio_veiculos": relatorio_veiculos,
         "relatorio_usuarios": relatorio_usuarios
     }
@@ -570,63 +598,26 @@ def relatorio_por_periodo(
     - ano: últimos 365 dias
     - personalizado: usar data_inicio e data_fim
     """
-    hoje = get_hoje_br()
-    
+    parametros = {"periodo": periodo, "data_inicio": data_inicio, "data_fim": data_fim}
+    return relatorio_em_cache(
+        db, "relatorios/periodo", parametros, get_hoje_br(),
+        lambda: _calcular_relatorio_periodo(db, **parametros)
+    )
+
+def _calcular_relatorio_periodo(db: Session, periodo: Optional[str], data_inicio: Optional[str], data_fim: Optional[str]):
     # Definir período
-    if periodo == "personalizado" and data_inicio and data_fim:
-        try:
-            inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
-            fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Formato de data inválido. Use YYYY-MM-DD")
-    elif periodo == "hoje":
-        inicio = fim = hoje
-    elif periodo == "semana":
-        inicio = hoje - timedelta(days=7)
-        fim = hoje
-    elif periodo == "mes":
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
-    elif periodo == "trimestre":
-        inicio = hoje - timedelta(days=90)
-        fim = hoje
-    elif periodo == "semestre":
-        inicio = hoje - timedelta(days=180)
-        fim = hoje
-    elif periodo == "ano":
-        inicio = hoje - timedelta(days=365)
-        fim = hoje
-    else:
-        # Padrão: último mês
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
+    inicio, fim = _periodo_relatorio(periodo, data_inicio, data_fim)
+    
+    # KM e usos no período, lidos da consolidação diária (km_diario)
+    usos_veiculos = usos_no_periodo(db, KmDiario.veiculo_id, inicio, fim)
+    usos_motoristas = usos_no_periodo(db, KmDiario.usuario_id, inicio, fim)
     
     # Relatório por veículo
     relatorio_veiculos = []
     veiculos = db.query(Veiculo).filter(Veiculo.ativo == True).all()
     
     for veiculo in veiculos:
-        # CORRIGIDO: Buscar coletas e depois filtrar por data em Brasil
-        coletas_todas = db.query(Coleta).filter(
-            Coleta.veiculo_id == veiculo.id,
-            Coleta.data_devolucao != None
-        ).all()
-        
-        # Filtrar por data convertendo UTC para Brasil
-        coletas = []
-        for coleta in coletas_todas:
-            data_devolucao_br = get_data_br(coleta.data_devolucao)
-            if inicio <= data_devolucao_br <= fim:
-                coletas.append(coleta)
-        
-        km_total = 0
-        total_usos = 0
-        
-        for coleta in coletas:
-            if coleta.km_devolucao and coleta.km_retirada:
-                km_coleta = coleta.km_devolucao - coleta.km_retirada
-                km_total += km_coleta
-                total_usos += 1
+        km_total, total_usos = usos_veiculos.get(veiculo.id, (0, 0))
         
         if km_total > 0 or total_usos > 0:
             relatorio_veiculos.append({
@@ -644,27 +635,7 @@ def relatorio_por_periodo(
     usuarios = db.query(Usuario).filter(Usuario.is_admin == False, Usuario.ativo == True).all()
     
     for usuario in usuarios:
-        # CORRIGIDO: Buscar coletas e depois filtrar por data em Brasil
-        coletas_todas = db.query(Coleta).filter(
-            Coleta.usuario_id == usuario.id,
-            Coleta.data_devolucao != None
-        ).all()
-        
-        # Filtrar por data convertendo UTC para Brasil
-        coletas = []
-        for coleta in coletas_todas:
-            data_devolucao_br = get_data_br(coleta.data_devolucao)
-            if inicio <= data_devolucao_br <= fim:
-                coletas.append(coleta)
-        
-        km_total = 0
-        total_coletas = 0
-        
-        for coleta in coletas:
-            if coleta.km_devolucao and coleta.km_retirada:
-                km_coleta = coleta.km_devolucao - coleta.km_retirada
-                km_total += km_coleta
-                total_coletas += 1
+        km_total, total_coletas = usos_motoristas.get(usuario.id, (0, 0))
         
         if km_total > 0 or total_coletas > 0:
             relatorio_motoristas.append({
@@ -704,71 +675,50 @@ def relatorio_veiculo_detalhado(
     data_inicio: Optional[str] = Query(None),
     data_fim: Optional[str] = Query(None),
     periodo: Optional[str] = Query("mes"),
+    cursor: Optional[str] = Query(None, description="paginacao.proximo_cursor da página anterior"),
+    limite: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO, description="Usos por página"),
     current_admin: Usuario = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
-    """Relatório detalhado de um veículo com histórico de usos"""
+    """Relatório detalhado de um veículo com histórico de usos, paginado por cursor"""
+    parametros = {"veiculo_id": veiculo_id, "periodo": periodo, "data_inicio": data_inicio, "data_fim": data_fim,
+                  "cursor": cursor, "limite": limite}
+    return relatorio_em_cache(
+        db, "relatorios/veiculo", parametros, get_hoje_br(),
+        lambda: _calcular_relatorio_veiculo(db, **parametros)
+    )
+
+def _calcular_relatorio_veiculo(db: Session, veiculo_id: int, periodo: Optional[str], data_inicio: Optional[str], data_fim: Optional[str],
+                                cursor: Optional[str] = None, limite: int = LIMITE_PADRAO):
     veiculo = db.query(Veiculo).filter(Veiculo.id == veiculo_id).first()
     if not veiculo:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
     # Calcular período
-    hoje = get_hoje_br()
-    if periodo == "personalizado" and data_inicio and data_fim:
-        try:
-            inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
-            fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Formato de data inválido")
-    elif periodo == "semana":
-        inicio = hoje - timedelta(days=7)
-        fim = hoje
-    elif periodo == "mes":
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
-    elif periodo == "trimestre":
-        inicio = hoje - timedelta(days=90)
-        fim = hoje
-    elif periodo == "ano":
-        inicio = hoje - timedelta(days=365)
-        fim = hoje
-    else:
-        inicio = hoje - timedelta(days=30)
-        fim = hoje
-    
-    # CORRIGIDO: Buscar coletas e depois filtrar por data em Brasil
-    coletas_todas = db.query(Coleta).filter(
-        Coleta.veiculo_id == veiculo_id,
-        Coleta.data_devolucao != None
-    ).order_by(Coleta.data_retirada.desc()).all()
-    
-    # Filtrar por data convertendo UTC para Brasil
-    coletas = []
-    for coleta in coletas_todas:
-        data_devolucao_br = get_data_br(coleta.data_devolucao)
-        if inicio <= data_devolucao_br <= fim:
-            coletas.append(coleta)
+    inicio, fim = _periodo_relatorio(periodo, data_inicio, data_fim)
     
-    historico = []
-    km_total = 0
+    # Página de usos do veículo devolvidos no período. As coletas de um veículo não se
+    # sobrepõem, então a ordem por devolução é a mesma da retirada (mais recentes primeiro)
+    coletas, proximo_cursor = _pagina_coletas_periodo(db, Coleta.veiculo_id, veiculo_id, inicio, fim, cursor, limite)
+    usuarios = _por_id(db, Usuario, {c.usuario_id for c in coletas})
     
+    # Totais do período vêm de km_diario: não dependem da página
+    km_total, total_usos = _totais_km_diario(db, KmDiario.veiculo_id, veiculo_id, inicio, fim)
+    
+    historico = []
     for coleta in coletas:
-        usuario = db.query(Usuario).filter(Usuario.id == coleta.usuario_id).first()
-        
-        if coleta.km_devolucao and coleta.km_retirada:
-            km_rodado = coleta.km_devolucao - coleta.km_retirada
-            km_total += km_rodado
-            
-            historico.append({
-                "data_retirada": coleta.data_retirada.isoformat() if coleta.data_retirada else None,
-                "data_devolucao": coleta.data_devolucao.isoformat() if coleta.data_devolucao else None,
-                "motorista": usuario.nome if usuario else "N/A",
-                "km_inicial": coleta.km_retirada,
-                "km_final": coleta.km_devolucao,
-                "km_rodado": round(km_rodado, 2),
-                "observacoes_retirada": coleta.observacoes_retirada,
-                "observacoes_devolucao": coleta.observacoes_devolucao
-            })
+        usuario = usuarios.get(coleta.usuario_id)
+        km_rodado = coleta.km_devolucao - coleta.km_retirada
+        historico.append({
+            "data_retirada": coleta.data_retirada.isoformat() if coleta.data_retirada else None,
+            "data_devolucao": coleta.data_devolucao.isoformat() if coleta.data_devolucao else None,
+            "motorista": usuario.nome if usuario else "N/A",
+            "km_inicial": coleta.km_retirada,
+            "km_final": coleta.km_devolucao,
+            "km_rodado": round(km_rodado, 2),
+            "observacoes_retirada": coleta.observacoes_retirada,
+            "observacoes_devolucao": coleta.observacoes_devolucao
+        })
     
     return {
         "veiculo": {
@@ -785,11 +735,12 @@ def relatorio_veiculo_detalhado(
         },
         "estatisticas": {
             "km_total": round(km_total, 2),
-            "total_usos": len(historico),
-            "media_km_por_uso": round(km_total / len(historico), 2) if historico else 0,
+            "total_usos": total_usos,
+            "media_km_por_uso": round(km_total / total_usos, 2) if total_usos else 0,
             "media_km_por_dia": round(km_total / ((fim - inicio).days + 1), 2)
         },
-        "historico": historico
+        "historico": historico,
+        "paginacao": paginacao_resposta(limite, proximo_cursor)
     }
 
 
@@ -805,77 +756,18 @@ def relatorio_consolidado(
     Relatório consolidado com agrupamento por período
     Ideal para gráficos de evolução de uso da frota
     """
-    hoje = get_hoje_br()
-    
-    # Definir intervalo padrão (último ano)
-    if data_inicio and data_fim:
-        try:
-            inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
-            fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Formato de data inválido")
-    else:
-        inicio = hoje - timedelta(days=365)
-        fim = hoje
-    
-    # CORRIGIDO: Buscar coletas e depois filtrar por data em Brasil
-    coletas_todas = db.query(Coleta).filter(
-        Coleta.data_devolucao != None
-    ).all()
-    
-    # Filtrar por data convertendo UTC para Brasil
-    coletas = []
-    for coleta in coletas_todas:
-        data_devolucao_br = get_data_br(coleta.data_devolucao)
-        if inicio <= data_devolucao_br <= fim:
-            coletas.append(coleta)
+    parametros = {"agrupar_por": agrupar_por, "data_inicio": data_inicio, "data_fim": data_fim}
+    return relatorio_em_cache(
+        db, "relatorios/consolidado", parametros, get_hoje_br(),
+        lambda: _calcular_relatorio_consolidado(db, **parametros)
+    )
+
+def _calcular_relatorio_consolidado(db: Session, agrupar_por: str, data_inicio: Optional[str], data_fim: Optional[str]):
+    # Datas informadas ou, por padrão, o último ano
+    inicio, fim = _periodo_relatorio("personalizado" if data_inicio and data_fim else "ano", data_inicio, data_fim)
     
-    # Agrupar por período
-    consolidado = {}
-    
-    for coleta in coletas:
-        if not (coleta.km_devolucao and coleta.km_retirada and coleta.data_devolucao):
-            continue
-        
-        # CORRIGIDO: Usar data convertida para Brasil
-        data = get_data_br(coleta.data_devolucao)
-        
-        # Determinar chave de agrupamento
-        if agrupar_por == "dia":
-            chave = data.isoformat()
-        elif agrupar_por == "semana":
-            # ISO week (ano-semana)
-            chave = f"{data.isocalendar()[0]}-W{data.isocalendar()[1]:02d}"
-        else:  # mes
-            chave = f"{data.year}-{data.month:02d}"
-        
-        if chave not in consolidado:
-            consolidado[chave] = {
-                "periodo": chave,
-                "km_total": 0,
-                "total_usos": 0,
-                "veiculos_distintos": set(),
-                "motoristas_distintos": set()
-            }
-        
-        km_rodado = coleta.km_devolucao - coleta.km_retirada
-        consolidado[chave]["km_total"] += km_rodado
-        consolidado[chave]["total_usos"] += 1
-        consolidado[chave]["veiculos_distintos"].add(coleta.veiculo_id)
-        consolidado[chave]["motoristas_distintos"].add(coleta.usuario_id)
-    
-    # Converter sets para contagens
-    resultado = []
-    for chave in sorted(consolidado.keys()):
-        item = consolidado[chave]
-        resultado.append({
-            "periodo": item["periodo"],
-            "km_total": round(item["km_total"], 2),
-            "total_usos": item["total_usos"],
-            "veiculos_ativos": len(item["veiculos_distintos"]),
-            "motoristas_ativos": len(item["motoristas_distintos"]),
-            "media_km_por_uso": round(item["km_total"] / item["total_usos"], 2) if item["total_usos"] > 0 else 0
-        })
+    # Usos por dia/veículo/motorista no período (km_diario), agrupados em bloco com NumPy
+    resultado = consolidar_usos(usos_por_dia(db, inicio, fim), agrupar_por)
     
     return {
         "agrupamento": agrupar_por,
@@ -888,6 +780,153 @@ def relatorio_consolidado(
         "km_total_geral": round(sum(r["km_total"] for r in resultado), 2)
     }
 
+@router.get("/relatorios/cache")
+def estatisticas_cache_relatorios(current_admin: Usuario = Depends(get_current_admin)):
+    """Estatísticas do cache de relatórios deste worker (itens, hits, misses, removidos)"""
+    return cache_relatorios.estatisticas()
+
+@router.get("/processamento-fotos")
+def estatisticas_processamento_fotos(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Fila e tempos do pool de processamento de fotos deste worker; fotos pendentes de todos"""
+    return {
+        **processamento_fotos.estatisticas(),
+        "pipeline": pipeline_fotos.estatisticas(),
+        "pendentes": db.query(Foto).filter(Foto.status == PROCESSANDO).count()
+    }
+
+# ===== EXPORTAÇÃO (CSV / NDJSON EM STREAMING) =====
+@router.get("/relatorios/exportar/{tipo}")
+def exportar_relatorio(
+    tipo: str,
+    formato: str = Query("csv", description="csv, ndjson"),
+    periodo: Optional[str] = Query(None, description="hoje, semana, mes, trimestre, semestre, ano, personalizado"),
+    data_inicio: Optional[str] = Query(None, description="Data início YYYY-MM-DD"),
+    data_fim: Optional[str] = Query(None, description="Data fim YYYY-MM-DD"),
+    current_admin: Usuario = Depends(get_current_admin)
+):
+    """
+    Exporta os dados dos relatórios linha a linha, enviados enquanto são lidos do banco:
+    - detalhado: uma linha por viagem (ou coleta sem viagem) dos motoristas; período opcional (data de retirada)
+    - periodo: uma linha por coleta devolvida no período (padrão: último mês)
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use: csv, ndjson")
+    if tipo not in ("detalhado", "periodo"):
+        raise HTTPException(status_code=404, detail="Tipo de exportação inválido. Use: detalhado, periodo")
+    
+    inicio = fim = None
+    if periodo or tipo == "periodo":
+        inicio, fim = _periodo_relatorio(periodo or "mes", data_inicio, data_fim)
+    
+    if tipo == "detalhado":
+        colunas = COLUNAS_EXPORTACAO_DETALHADO
+        gerar_linhas = lambda db: linhas_exportacao_detalhado(db, inicio, fim)
+    else:
+        colunas = COLUNAS_EXPORTACAO_PERIODO
+        gerar_linhas = lambda db: linhas_exportacao_periodo(db, inicio, fim)
+    
+    nome_arquivo = f"relatorio_{tipo}_{get_hoje_br().isoformat()}.{formato}"
+    return StreamingResponse(
+        stream_exportacao(formato, colunas, gerar_linhas),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={
+            "Content-Disposition": f'attachment; filename="{nome_arquivo}"',
+            "X-Accel-Buffering": "no"  # nginx: repassar os blocos sem acumular a resposta
+        }
+    )
+
+# ===== JOBS DE RELATÓRIO (XLSX / CSV EM SEGUNDO PLANO) =====
+COLUNAS_JOB_CONSOLIDADO = [
+    "periodo", "km_total", "total_usos", "veiculos_ativos", "motoristas_ativos", "media_km_por_uso"
+]
+
+@router.post("/relatorios/jobs/{tipo}", status_code=status.HTTP_202_ACCEPTED)
+def criar_job_relatorio(
+    tipo: str,
+    formato: str = Query("xlsx", description="xlsx, csv"),
+    periodo: Optional[str] = Query(None, description="hoje, semana, mes, trimestre, semestre, ano, personalizado"),
+    agrupar_por: str = Query("mes", description="dia, semana, mes (apenas consolidado)"),
+    data_inicio: Optional[str] = Query(None, description="Data início YYYY-MM-DD"),
+    data_fim: Optional[str] = Query(None, description="Data fim YYYY-MM-DD"),
+    current_admin: Usuario = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Cria um job que gera o relatório em segundo plano e grava um arquivo para download:
+    - detalhado: uma linha por viagem (ou coleta sem viagem); período opcional
+    - periodo: uma linha por coleta devolvida no período (padrão: último mês)
+    - consolidado: uma linha por dia/semana/mês (padrão: último ano)
+    Consulte o status em GET /relatorios/jobs/{id}.
+    """
+    if formato not in FORMATOS_JOB:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use: xlsx, csv")
+    if tipo not in ("detalhado", "periodo", "consolidado"):
+        raise HTTPException(status_code=404, detail="Tipo de relatório inválido. Use: detalhado, periodo, consolidado")
+    if total_jobs_ativos(db) >= settings.REPORT_JOB_MAX_PENDENTES:
+        raise HTTPException(status_code=429, detail="Muitos relatórios em processamento. Tente novamente em instantes")
+    
+    parametros = {"periodo": periodo, "data_inicio": data_inicio, "data_fim": data_fim}
+    if tipo == "consolidado":
+        parametros = {"agrupar_por": agrupar_por, "data_inicio": data_inicio, "data_fim": data_fim}
+        try:
+            for valor in (data_inicio, data_fim):
+                if valor:
+                    datetime.strptime(valor, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato de data inválido. Use YYYY-MM-DD")
+        colunas = COLUNAS_JOB_CONSOLIDADO
+        gerar_linhas = lambda db: (
+            [item[c] for c in COLUNAS_JOB_CONSOLIDADO]
+            for item in _calcular_relatorio_consolidado(db, agrupar_por, data_inicio, data_fim)["dados"]
+        )
+    else:
+        inicio = fim = None
+        if periodo or tipo == "periodo":
+            inicio, fim = _periodo_relatorio(periodo or "mes", data_inicio, data_fim)
+        if tipo == "detalhado":
+            colunas = COLUNAS_EXPORTACAO_DETALHADO
+            gerar_linhas = lambda db: linhas_exportacao_detalhado(db, inicio, fim)
+        else:
+            colunas = COLUNAS_EXPORTACAO_PERIODO
+            gerar_linhas = lambda db: linhas_exportacao_periodo(db, inicio, fim)
+    
+    job = criar_job(db, tipo, formato, parametros, current_admin.id, colunas, gerar_linhas)
+    return job_para_dict(job)
+
+@router.get("/relatorios/jobs")
+def listar_jobs_relatorio(current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Últimos jobs de relatório (mais recentes primeiro)"""
+    jobs = db.query(JobRelatorio).order_by(JobRelatorio.criado_em.desc()).limit(50).all()
+    return [job_para_dict(job) for job in jobs]
+
+@router.get("/relatorios/jobs/{job_id}")
+def status_job_relatorio(job_id: str, current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Status do job: pendente, executando, concluido (com download_url) ou erro"""
+    job = db.query(JobRelatorio).filter(JobRelatorio.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job_para_dict(job)
+
+@router.get("/relatorios/jobs/{job_id}/download")
+def download_job_relatorio(job_id: str, current_admin: Usuario = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Baixa o arquivo de um job concluído"""
+    job = db.query(JobRelatorio).filter(JobRelatorio.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.status != "concluido":
+        raise HTTPException(status_code=409, detail=f"Relatório ainda não disponível (status: {job.status})")
+    
+    caminho = caminho_arquivo_job(job)
+    if not os.path.exists(caminho):
+        raise HTTPException(status_code=410, detail="Arquivo do relatório não está mais disponível")
+    
+    data_criacao = data_br(job.criado_em).isoformat()
+    return FileResponse(
+        caminho,
+        media_type=FORMATOS_JOB[job.formato],
+        filename=f"relatorio_{job.tipo}_{data_criacao}.{job.formato}"
+    )
+
 # ===== EDIÇÃO DE KM (APENAS ADMIN, MESMO DIA) =====
 @router.put("/coleta/{coleta_id}/editar-km")
 def editar_km_coleta(
@@ -908,9 +947,8 @@ def editar_km_coleta(
         raise HTTPException(status_code=400, detail="Coleta ainda não foi devolvida")
     
     # Validar se é o mesmo dia (timezone Brasil)
-    tz_brasil = pytz_timezone('America/Sao_Paulo')
-    data_devolucao_local = coleta.data_devolucao.replace(tzinfo=pytz_timezone('UTC')).astimezone(tz_brasil).date()
-    hoje_local = datetime.now(tz_brasil).date()
+    data_devolucao_local = coleta.data_devolucao_local or data_br(coleta.data_devolucao)
+    hoje_local = get_hoje_br()
     
     if data_devolucao_local != hoje_local:
         raise HTTPException(
@@ -918,6 +956,9 @@ def editar_km_coleta(
             detail=f"Edição permitida apenas no mesmo dia. Devolução foi em {data_devolucao_local.strftime('%d/%m/%Y')}"
         )
     
+    # Retirar a contribuição atual da coleta da consolidação diária (re-somada abaixo)
+    registrar_km_coleta(db, coleta, sinal=-1)
+    
     # Validar KMs
     km_retirada = dados.get("km_retirada")
     km_devolucao = dados.get("km_devolucao")
@@ -936,6 +977,8 @@ def editar_km_coleta(
             raise HTTPException(status_code=400, detail="KM de devolução não pode ser menor que KM de retirada")
         coleta.km_devolucao = km_devolucao
     
+    registrar_km_coleta(db, coleta)
+    incrementar_versao_dados(db)
     db.commit()
     db.refresh(coleta)
     
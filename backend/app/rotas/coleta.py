@@ -1,33 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, insert_com_upsert
 from app.modelos import Usuario, Coleta, Viagem, Foto, Veiculo
 from app.utils import verify_token
 from app.config import settings
+from app.relatorios import registrar_km_coleta, registrar_km_viagem
+from app.cache import incrementar_versao_dados, versao_dados, etag_dados, resposta_condicional
+from app.disponibilidade import disponibilidade_veiculos
+from app.eventos import registrar_evento
+from app.idempotencia import reservar_chave, guardar_resposta, resposta_repetida
+from app.serializacao import iso_br
+from app.upload import receber_foto
+from app.fotos import tipo_pelos_magic_bytes
+from app.pipeline_fotos import pipeline_fotos, fila_cheia, caminho_recebido, PROCESSANDO, PRONTA
+from app.processamento_fotos import processamento_fotos
+from app.armazenamento_fotos import caminho_existente, adicionar_referencia
+from app.paginacao import LIMITE_PADRAO, LIMITE_MAXIMO, pagina_keyset, paginacao_resposta
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
 import os
+import shutil
+import logging
 import pytz
-from PIL import Image
-import io
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/coleta", tags=["coleta"])
 security = HTTPBearer()
 
-# Timezone do Brasil (São Paulo)
-TZ_BRASIL = pytz.timezone('America/Sao_Paulo')
-
-
-def converter_utc_para_br(dt_utc):
-    """Converte datetime UTC para datetime Brasil (São Paulo)"""
-    if dt_utc is None:
-        return None
-    if dt_utc.tzinfo is None:
-        # Se não tem timezone info, assume UTC
-        dt_utc = dt_utc.replace(tzinfo=pytz.utc)
-    return dt_utc.astimezone(TZ_BRASIL)
 
 class ViagemData(BaseModel):
     km: float
@@ -36,6 +39,18 @@ class ViagemData(BaseModel):
 class RetiradaData(BaseModel):
     observacoes: Optional[str] = None
 
+class OperacaoSync(BaseModel):
+    tipo: Literal["retirar", "sair", "retornar", "devolver"]
+    veiculo_id: Optional[int] = None  # retirar
+    coleta_id: Optional[int] = None  # sair/retornar/devolver; padrão: coleta ativa do motorista
+    km: Optional[float] = None
+    observacoes: Optional[str] = None
+    horario: Optional[datetime] = None  # quando a ação aconteceu no aparelho (ISO 8601)
+    chave: Optional[str] = None  # Idempotency-Key da operação (a mesma da tentativa direta, se houve)
+
+class SyncData(BaseModel):
+    operacoes: List[OperacaoSync]
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
     usuario_id = verify_token(credentials.credentials)
     if not usuario_id:
@@ -49,65 +64,67 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
 # ===== VEÍCULOS DISPONÍVEIS =====
 @router.get("/veiculos")
-def listar_veiculos_disponiveis(current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Lista veículos disponíveis para o usuário"""
-    veiculos = db.query(Veiculo).filter(Veiculo.ativo == True).all()
-    
-    resultado = []
-    for veiculo in veiculos:
-        # Verificar se tem coleta ATIVA com este veículo de QUALQUER usuário
-        # O veículo não pode estar disponível enquanto houver coleta ativa
-        coleta_ativa_qualquer_usuario = db.query(Coleta).filter(
-            Coleta.veiculo_id == veiculo.id,
-            Coleta.ativo == True  # Coleta ainda ativa - bloqueado para todos
-        ).first()
-        
-        # Mostrar veículo APENAS se não há coleta ativa de ninguém
-        if not coleta_ativa_qualquer_usuario:
-            resultado.append({
-                "id": veiculo.id,
-                "placa": veiculo.placa,
-                "modelo": veiculo.modelo,
-                "marca": veiculo.marca,
-                "ano": veiculo.ano,
-                "km_atual": veiculo.km_atual or 0
-            })
-    
-    return resultado
+def listar_veiculos_disponiveis(request: Request, response: Response, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Lista veículos disponíveis para o usuário (sem coleta ativa de nenhum usuário)"""
+    versao = versao_dados(db)
+    nao_modificada = resposta_condicional(request, response, etag_dados(versao, "veiculos-disponiveis"))
+    if nao_modificada:
+        return nao_modificada
+    return disponibilidade_veiculos.listar(db, versao)
 
 # ===== RETIRAR VEÍCULO (INICIA COLETA) =====
-@router.post("/retirar/{veiculo_id}")
-def retirar_veiculo(veiculo_id: int, dados: RetiradaData, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Inicia uma coleta (retirada de veículo) - KM é preenchido automaticamente do km_atual do veículo"""
+def inserir_coleta_ativa(db: Session, valores: dict):
+    """
+    Insere a coleta ativa numa única instrução (INSERT ... ON CONFLICT DO NOTHING).
+    Retorna o id da coleta, ou None se o motorista ou o veículo já tiver coleta ativa.
+    """
+    insert = insert_com_upsert(db.get_bind())
+    if insert is None:
+        # Banco sem ON CONFLICT: o índice único rejeita o INSERT
+        try:
+            with db.begin_nested():
+                coleta = Coleta(**valores)
+                db.add(coleta)
+            return coleta.id
+        except IntegrityError:
+            return None
+    
+    return db.execute(
+        insert(Coleta).values(**valores).on_conflict_do_nothing().returning(Coleta.id)
+    ).scalar()
+
+def motivo_conflito_retirada(db: Session, usuario_id: int):
+    """Mensagem do 409 da retirada (consultado só depois que o INSERT foi rejeitado)"""
+    coleta_ativa = db.query(Coleta.id).filter(Coleta.usuario_id == usuario_id, Coleta.ativo == True).first()
+    if coleta_ativa:
+        return "Você já tem uma coleta ativa. Devolva o veículo anterior primeiro."
+    return "Veículo já foi retirado por outro motorista"
+
+def aplicar_retirada(db: Session, usuario: Usuario, veiculo_id: int, observacoes: Optional[str], horario: datetime):
+    """Cria a coleta ativa (sem commit). Retorna o dicionário de resposta da retirada"""
     veiculo = db.query(Veiculo).filter(Veiculo.id == veiculo_id).first()
     if not veiculo:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
-    # Verificar se usuário já tem coleta ativa
-    coleta_ativa = db.query(Coleta).filter(
-        Coleta.usuario_id == current_user.id,
-        Coleta.ativo == True
-    ).first()
-    
-    if coleta_ativa:
-        raise HTTPException(status_code=400, detail="Você já tem uma coleta ativa. Devolva o veículo anterior primeiro.")
-    
+    # A reserva é um único INSERT: os índices únicos parciais de coleta ativa (por motorista e por
+    # veículo) rejeitam a segunda retirada mesmo com requisições simultâneas, sem consulta prévia
     # CORRIGIDO: KM de retirada é automaticamente o km_atual do veículo
-    nova_coleta = Coleta(
-        usuario_id=current_user.id,
-        veiculo_id=veiculo_id,
-        data_retirada=datetime.utcnow(),
-        km_retirada=veiculo.km_atual,  # Preenche automaticamente
-        observacoes_retirada=dados.observacoes,
-        ativo=True
-    )
-    db.add(nova_coleta)
-    db.commit()
-    db.refresh(nova_coleta)
+    valores = {
+        "usuario_id": usuario.id,
+        "veiculo_id": veiculo_id,
+        "data_retirada": horario,
+        "km_retirada": veiculo.km_atual,  # Preenche automaticamente
+        "observacoes_retirada": observacoes,
+        "ativo": True
+    }
+    coleta_id = inserir_coleta_ativa(db, valores)
+    if coleta_id is None:
+        raise HTTPException(status_code=409, detail=motivo_conflito_retirada(db, usuario.id))
     
+    registrar_evento(db, "retirada", veiculo_id=veiculo_id, coleta_id=coleta_id)
     return {
-        "id": nova_coleta.id,
-        "veiculo_id": nova_coleta.veiculo_id,
+        "id": coleta_id,
+        "veiculo_id": veiculo_id,
         "veiculo": {
             "id": veiculo.id,
             "placa": veiculo.placa,
@@ -116,134 +133,171 @@ def retirar_veiculo(veiculo_id: int, dados: RetiradaData, current_user: Usuario
             "ano": veiculo.ano,
             "km_atual": veiculo.km_atual
         },
-        "data_retirada": converter_utc_para_br(nova_coleta.data_retirada).isoformat() if nova_coleta.data_retirada else None,
-        "km_retirada": nova_coleta.km_retirada,
-        "observacoes_retirada": nova_coleta.observacoes_retirada,
-        "ativo": nova_coleta.ativo,
+        "data_retirada": iso_br(horario),
+        "km_retirada": veiculo.km_atual,
+        "observacoes_retirada": observacoes,
+        "ativo": True,
         "viagens": [],
-        "mensagem": f"Veículo retirado. KM inicial: {nova_coleta.km_retirada}"
+        "mensagem": f"Veículo retirado. KM inicial: {veiculo.km_atual}"
     }
 
-# ===== SAIR COM VEÍCULO =====
-@router.post("/{coleta_id}/sair")
-def registrar_saida(coleta_id: int, dados: ViagemData, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Registra uma saída (inicia uma viagem)"""
+@router.post("/retirar/{veiculo_id}")
+def retirar_veiculo(veiculo_id: int, dados: RetiradaData, idempotency_key: Optional[str] = Header(None), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Inicia uma coleta (retirada de veículo) - KM é preenchido automaticamente do km_atual do veículo"""
+    repetida = reservar_chave(db, current_user.id, idempotency_key, f"retirar:{veiculo_id}")
+    if repetida is not None:
+        return resposta_repetida(repetida)
+    resultado = aplicar_retirada(db, current_user, veiculo_id, dados.observacoes, datetime.utcnow())
+    guardar_resposta(db, current_user.id, idempotency_key, resultado)
+    incrementar_versao_dados(db)
+    db.commit()
+    disponibilidade_veiculos.invalidar()
+    return resultado
+
+def buscar_coleta_do_motorista(db: Session, usuario: Usuario, coleta_id: int, detalhe: str):
+    """Coleta ativa do motorista (ou 404 com `detalhe`)"""
     coleta = db.query(Coleta).filter(
         Coleta.id == coleta_id,
-        Coleta.usuario_id == current_user.id,
+        Coleta.usuario_id == usuario.id,
         Coleta.ativo == True
     ).first()
     
     if not coleta:
-        raise HTTPException(status_code=404, detail="Coleta não encontrada ou já finalizada")
+        raise HTTPException(status_code=404, detail=detalhe)
+    return coleta
+
+def atualizar_totais_coleta(db: Session, coleta: Coleta, viagem_aberta_id: Optional[int], valores: dict):
+    """
+    UPDATE condicional dos totais de viagens: só altera a coleta se a viagem aberta ainda for
+    `viagem_aberta_id`. Em saídas/retornos simultâneos da mesma coleta apenas um passa
+    """
+    viagem_aberta = Coleta.viagem_aberta_id == None if viagem_aberta_id is None else Coleta.viagem_aberta_id == viagem_aberta_id
+    atualizadas = db.query(Coleta).filter(Coleta.id == coleta.id, viagem_aberta).update(
+        valores, synchronize_session="fetch"
+    )
+    return atualizadas == 1
+
+# ===== SAIR COM VEÍCULO =====
+def aplicar_saida(db: Session, usuario: Usuario, coleta_id: int, km: float, observacoes: Optional[str], horario: datetime):
+    """Inicia uma viagem (sem commit). Retorna o dicionário de resposta da saída"""
+    coleta = buscar_coleta_do_motorista(db, usuario, coleta_id, "Coleta não encontrada ou já finalizada")
     
     # Verificar se há uma viagem com saída mas sem retorno
-    viagem_aberta = db.query(Viagem).filter(
-        Viagem.coleta_id == coleta_id,
-        Viagem.retorno_horario == None
-    ).first()
-    
-    if viagem_aberta:
-        raise HTTPException(status_code=400, detail="Você precisa retornar do trajeto anterior antes de fazer uma nova saída")
+    erro_viagem_aberta = "Você precisa retornar do trajeto anterior antes de fazer uma nova saída"
+    if coleta.viagem_aberta_id is not None:
+        raise HTTPException(status_code=400, detail=erro_viagem_aberta)
     
     # Calcular número da viagem
-    numero_viagem = db.query(Viagem).filter(Viagem.coleta_id == coleta_id).count() + 1
+    numero_viagem = (coleta.total_viagens or 0) + 1
     
     nova_viagem = Viagem(
         coleta_id=coleta_id,
-        saida_horario=datetime.utcnow(),
-        saida_km=dados.km,
-        saida_observacoes=dados.observacoes,
+        saida_horario=max(horario, coleta.data_retirada),  # relógio do aparelho (sync) atrasado
+        saida_km=km,
+        saida_observacoes=observacoes,
         numero_viagem=numero_viagem
     )
     db.add(nova_viagem)
-    db.commit()
-    db.refresh(nova_viagem)
+    db.flush()
+    if not atualizar_totais_coleta(db, coleta, None, {
+        "total_viagens": Coleta.total_viagens + 1,
+        "viagem_aberta_id": nova_viagem.id
+    }):
+        raise HTTPException(status_code=400, detail=erro_viagem_aberta)
+    registrar_evento(db, "saida", veiculo_id=coleta.veiculo_id, coleta_id=coleta_id, viagem_id=nova_viagem.id)
     
     return {
         "id": nova_viagem.id,
         "numero_viagem": nova_viagem.numero_viagem,
-        "saida_horario": converter_utc_para_br(nova_viagem.saida_horario).isoformat() if nova_viagem.saida_horario else None,
+        "saida_horario": iso_br(nova_viagem.saida_horario),
         "saida_km": nova_viagem.saida_km
     }
 
+@router.post("/{coleta_id}/sair")
+def registrar_saida(coleta_id: int, dados: ViagemData, idempotency_key: Optional[str] = Header(None), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Registra uma saída (inicia uma viagem)"""
+    repetida = reservar_chave(db, current_user.id, idempotency_key, f"sair:{coleta_id}")
+    if repetida is not None:
+        return resposta_repetida(repetida)
+    resultado = aplicar_saida(db, current_user, coleta_id, dados.km, dados.observacoes, datetime.utcnow())
+    guardar_resposta(db, current_user.id, idempotency_key, resultado)
+    incrementar_versao_dados(db)
+    db.commit()
+    return resultado
+
 # ===== RETORNAR COM VEÍCULO =====
-@router.post("/{coleta_id}/retornar")
-def registrar_retorno(coleta_id: int, dados: ViagemData, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Registra um retorno (finaliza uma viagem)"""
-    coleta = db.query(Coleta).filter(
-        Coleta.id == coleta_id,
-        Coleta.usuario_id == current_user.id,
-        Coleta.ativo == True
-    ).first()
-    
-    if not coleta:
-        raise HTTPException(status_code=404, detail="Coleta não encontrada")
+def aplicar_retorno(db: Session, usuario: Usuario, coleta_id: int, km: float, observacoes: Optional[str], horario: datetime):
+    """Finaliza a viagem aberta (sem commit). Retorna o dicionário de resposta do retorno"""
+    coleta = buscar_coleta_do_motorista(db, usuario, coleta_id, "Coleta não encontrada")
     
     # Buscar viagem aberta (com saída mas sem retorno)
-    viagem_aberta = db.query(Viagem).filter(
-        Viagem.coleta_id == coleta_id,
-        Viagem.retorno_horario == None
-    ).first()
-    
+    erro_sem_saida = "Nenhuma saída registrada para retornar"
+    viagem_aberta = db.get(Viagem, coleta.viagem_aberta_id) if coleta.viagem_aberta_id is not None else None
     if not viagem_aberta:
-        raise HTTPException(status_code=400, detail="Nenhuma saída registrada para retornar")
+        raise HTTPException(status_code=400, detail=erro_sem_saida)
     
-    # Atualizar viagem com retorno
-    viagem_aberta.retorno_horario = datetime.utcnow()
-    viagem_aberta.retorno_km = dados.km
-    viagem_aberta.retorno_observacoes = dados.observacoes
-    viagem_aberta.km_rodado = dados.km - viagem_aberta.saida_km
+    km_rodado = km - viagem_aberta.saida_km
+    if not atualizar_totais_coleta(db, coleta, viagem_aberta.id, {
+        "total_km_viagens": Coleta.total_km_viagens + km_rodado,
+        "viagem_aberta_id": None
+    }):
+        raise HTTPException(status_code=400, detail=erro_sem_saida)
     
-    db.commit()
-    db.refresh(viagem_aberta)
+    # Atualizar viagem com retorno
+    viagem_aberta.retorno_horario = max(horario, viagem_aberta.saida_horario)
+    viagem_aberta.retorno_km = km
+    viagem_aberta.retorno_observacoes = observacoes
+    viagem_aberta.km_rodado = km_rodado
+    registrar_km_viagem(db, coleta, viagem_aberta)
+    registrar_evento(db, "retorno", veiculo_id=coleta.veiculo_id, coleta_id=coleta_id, viagem_id=viagem_aberta.id)
     
     return {
         "id": viagem_aberta.id,
         "numero_viagem": viagem_aberta.numero_viagem,
-        "retorno_horario": converter_utc_para_br(viagem_aberta.retorno_horario).isoformat() if viagem_aberta.retorno_horario else None,
+        "retorno_horario": iso_br(viagem_aberta.retorno_horario),
         "retorno_km": viagem_aberta.retorno_km,
         "km_rodado": viagem_aberta.km_rodado
     }
 
+@router.post("/{coleta_id}/retornar")
+def registrar_retorno(coleta_id: int, dados: ViagemData, idempotency_key: Optional[str] = Header(None), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Registra um retorno (finaliza uma viagem)"""
+    repetida = reservar_chave(db, current_user.id, idempotency_key, f"retornar:{coleta_id}")
+    if repetida is not None:
+        return resposta_repetida(repetida)
+    resultado = aplicar_retorno(db, current_user, coleta_id, dados.km, dados.observacoes, datetime.utcnow())
+    guardar_resposta(db, current_user.id, idempotency_key, resultado)
+    incrementar_versao_dados(db)
+    db.commit()
+    return resultado
+
 # ===== DEVOLVER VEÍCULO (FINALIZA COLETA) =====
-@router.post("/{coleta_id}/devolver")
-def devolver_veiculo(coleta_id: int, dados: ViagemData, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Finaliza coleta (devolve veículo) com KM e observações - atualiza km_atual do veículo"""
-    coleta = db.query(Coleta).filter(
-        Coleta.id == coleta_id,
-        Coleta.usuario_id == current_user.id,
-        Coleta.ativo == True
-    ).first()
-    
-    if not coleta:
-        raise HTTPException(status_code=404, detail="Coleta não encontrada")
+def aplicar_devolucao(db: Session, usuario: Usuario, coleta_id: int, km: float, observacoes: Optional[str], horario: datetime):
+    """Finaliza a coleta (sem commit) e atualiza o km_atual do veículo. Retorna o dicionário de resposta"""
+    coleta = buscar_coleta_do_motorista(db, usuario, coleta_id, "Coleta não encontrada")
     
     # Verificar se há viagem com saída mas sem retorno
-    viagem_aberta = db.query(Viagem).filter(
-        Viagem.coleta_id == coleta_id,
-        Viagem.retorno_horario == None
-    ).first()
-    
-    if viagem_aberta:
+    if coleta.viagem_aberta_id is not None:
         raise HTTPException(status_code=400, detail="Finalize o trajeto aberto (retorne) antes de devolver o veículo")
     
     # Finalizar coleta com dados da devolução
     coleta.ativo = False
-    coleta.data_devolucao = datetime.utcnow()
-    coleta.km_devolucao = dados.km
-    coleta.observacoes_devolucao = dados.observacoes
+    coleta.data_devolucao = max(horario, coleta.data_retirada)
+    coleta.km_devolucao = km
+    coleta.observacoes_devolucao = observacoes
     
     # CORRIGIDO: Atualizar km_atual do veículo para o KM da devolução
     veiculo = db.query(Veiculo).filter(Veiculo.id == coleta.veiculo_id).first()
     if veiculo:
-        veiculo.km_atual = dados.km  # Próximo usuário terá este KM inicial
+        veiculo.km_atual = km  # Próximo usuário terá este KM inicial
     
-    db.commit()
+    # Consolidação diária de KM (mesma transação da devolução)
+    registrar_km_coleta(db, coleta)
+    registrar_evento(db, "devolucao", veiculo_id=coleta.veiculo_id, coleta_id=coleta.id)
     
     return {
         "id": coleta.id,
-        "data_devolucao": converter_utc_para_br(coleta.data_devolucao).isoformat() if coleta.data_devolucao else None,
+        "data_devolucao": iso_br(coleta.data_devolucao),
         "km_retirada": coleta.km_retirada,
         "km_devolucao": coleta.km_devolucao,
         "km_rodado": round(coleta.km_devolucao - coleta.km_retirada, 2) if (coleta.km_devolucao and coleta.km_retirada) else 0,
@@ -252,10 +306,117 @@ def devolver_veiculo(coleta_id: int, dados: ViagemData, current_user: Usuario =
         "mensagem": f"Veículo devolvido com sucesso. KM rodado: {round(coleta.km_devolucao - coleta.km_retirada, 2)} km"
     }
 
+@router.post("/{coleta_id}/devolver")
+def devolver_veiculo(coleta_id: int, dados: ViagemData, idempotency_key: Optional[str] = Header(None), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Finaliza coleta (devolve veículo) com KM e observações - atualiza km_atual do veículo"""
+    repetida = reservar_chave(db, current_user.id, idempotency_key, f"devolver:{coleta_id}")
+    if repetida is not None:
+        return resposta_repetida(repetida)
+    resultado = aplicar_devolucao(db, current_user, coleta_id, dados.km, dados.observacoes, datetime.utcnow())
+    guardar_resposta(db, current_user.id, idempotency_key, resultado)
+    incrementar_versao_dados(db)
+    db.commit()
+    disponibilidade_veiculos.invalidar()
+    return resultado
+
+# ===== SINCRONIZAÇÃO OFFLINE (LOTE DE OPERAÇÕES) =====
+OPERACOES_SYNC = {
+    "retirar": aplicar_retirada,
+    "sair": aplicar_saida,
+    "retornar": aplicar_retorno,
+    "devolver": aplicar_devolucao,
+}
+
+def horario_da_operacao(horario: Optional[datetime], agora: datetime):
+    """Horário do aparelho em UTC sem tzinfo (como gravado no banco); sem horário ou no futuro, agora"""
+    if horario is None:
+        return agora
+    if horario.tzinfo is not None:
+        horario = horario.astimezone(pytz.utc).replace(tzinfo=None)
+    return min(horario, agora)
+
+def aplicar_operacao_sync(db: Session, usuario: Usuario, operacao: "OperacaoSync", agora: datetime):
+    horario = horario_da_operacao(operacao.horario, agora)
+    if operacao.tipo == "retirar":
+        if operacao.veiculo_id is None:
+            raise HTTPException(status_code=400, detail="veiculo_id é obrigatório para retirar")
+        return aplicar_retirada(db, usuario, operacao.veiculo_id, operacao.observacoes, horario)
+    
+    if operacao.km is None:
+        raise HTTPException(status_code=400, detail="KM é obrigatório")
+    coleta_id = operacao.coleta_id
+    if coleta_id is None:
+        # Retirada feita offline no mesmo lote: o aparelho ainda não conhece o id da coleta
+        coleta_id = db.query(Coleta.id).filter(Coleta.usuario_id == usuario.id, Coleta.ativo == True).scalar()
+        if coleta_id is None:
+            raise HTTPException(status_code=404, detail="Nenhuma coleta ativa")
+    return OPERACOES_SYNC[operacao.tipo](db, usuario, coleta_id, operacao.km, operacao.observacoes, horario)
+
+def operacao_idempotencia(db: Session, usuario: Usuario, operacao: OperacaoSync):
+    """Operação da Idempotency-Key, igual à da rota individual (a chave de uma tentativa direta vale no lote)"""
+    if operacao.tipo == "retirar":
+        return f"retirar:{operacao.veiculo_id}"
+    coleta_id = operacao.coleta_id
+    if coleta_id is None:
+        # A coleta ativa é a última do motorista; numa repetição depois da devolução ela já
+        # não está ativa, mas continua sendo a última
+        coleta_id = db.query(Coleta.id).filter(Coleta.usuario_id == usuario.id).order_by(Coleta.id.desc()).limit(1).scalar()
+    return f"{operacao.tipo}:{coleta_id}"
+
+@router.post("/sync")
+def sincronizar_operacoes(dados: SyncData, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Aplica, em ordem e numa única transação, as operações feitas sem conexão.
+    Cada operação roda num savepoint: uma operação recusada não desfaz as outras.
+    Retorna o resultado de cada operação (status e resposta ou erro, como nas rotas individuais).
+    Operações com `chave` já aplicada devolvem a resposta guardada ("repetida": true).
+    """
+    if len(dados.operacoes) > settings.SYNC_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {settings.SYNC_MAX_OPERATIONS} operações por lote")
+    
+    agora = datetime.utcnow()
+    resultados = []
+    aplicadas = set()
+    for indice, operacao in enumerate(dados.operacoes):
+        try:
+            with db.begin_nested():
+                resposta = reservar_chave(
+                    db, current_user.id, operacao.chave, operacao_idempotencia(db, current_user, operacao)
+                ) if operacao.chave else None
+                if resposta is not None:
+                    resultados.append({"indice": indice, "tipo": operacao.tipo, "status": 200, "resposta": resposta, "repetida": True})
+                    continue
+                resposta = aplicar_operacao_sync(db, current_user, operacao, agora)
+                guardar_resposta(db, current_user.id, operacao.chave, resposta)
+            resultados.append({"indice": indice, "tipo": operacao.tipo, "status": 200, "resposta": resposta})
+            aplicadas.add(operacao.tipo)
+        except HTTPException as e:
+            resultados.append({"indice": indice, "tipo": operacao.tipo, "status": e.status_code, "erro": e.detail})
+        except IntegrityError as e:
+            # Conflito com uma requisição simultânea: o savepoint desfez só esta operação
+            logger.warning(f"[SYNC] Operação {indice} ({operacao.tipo}) recusada por conflito: {e.orig}")
+            resultados.append({"indice": indice, "tipo": operacao.tipo, "status": 409, "erro": "Conflito com outra operação simultânea"})
+    
+    if aplicadas:
+        incrementar_versao_dados(db)
+        db.commit()
+        if aplicadas & {"retirar", "devolver"}:
+            disponibilidade_veiculos.invalidar()
+    
+    return {
+        "aplicadas": sum(1 for r in resultados if r["status"] == 200),
+        "recusadas": sum(1 for r in resultados if r["status"] != 200),
+        "resultados": resultados
+    }
+
 # ===== OBTER COLETA ATIVA =====
 @router.get("/ativa")
-def obter_coleta_ativa(current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+def obter_coleta_ativa(request: Request, response: Response, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obtém coleta ativa do usuário"""
+    nao_modificada = resposta_condicional(request, response, etag_dados(versao_dados(db), "ativa", current_user.id))
+    if nao_modificada:
+        return nao_modificada
+    
     coleta = db.query(Coleta).filter(
         Coleta.usuario_id == current_user.id,
         Coleta.ativo == True
@@ -280,7 +441,7 @@ def obter_coleta_ativa(current_user: Usuario = Depends(get_current_user), db: Se
             "modelo": veiculo.modelo,
             "ano": veiculo.ano
         } if veiculo else None,
-        "data_retirada": converter_utc_para_br(coleta.data_retirada).isoformat() if coleta.data_retirada else None,
+        "data_retirada": iso_br(coleta.data_retirada),
         "km_retirada": coleta.km_retirada,
         "observacoes_retirada": coleta.observacoes_retirada,
         "ativo": coleta.ativo,
@@ -288,9 +449,9 @@ def obter_coleta_ativa(current_user: Usuario = Depends(get_current_user), db: Se
             {
                 "id": v.id,
                 "numero": v.numero_viagem,
-                "saida_horario": converter_utc_para_br(v.saida_horario).isoformat() if v.saida_horario else None,
+                "saida_horario": iso_br(v.saida_horario),
                 "saida_km": v.saida_km,
-                "retorno_horario": converter_utc_para_br(v.retorno_horario).isoformat() if v.retorno_horario else None,
+                "retorno_horario": iso_br(v.retorno_horario),
                 "retorno_km": v.retorno_km,
                 "km_rodado": v.km_rodado
             } for v in viagens
@@ -314,17 +475,17 @@ def listar_viagens(coleta_id: int, current_user: Usuario = Depends(get_current_u
     return {
         "coleta_id": coleta.id,
         "veiculo_id": coleta.veiculo_id,
-        "data_retirada": converter_utc_para_br(coleta.data_retirada).isoformat() if coleta.data_retirada else None,
-        "data_devolucao": converter_utc_para_br(coleta.data_devolucao).isoformat() if coleta.data_devolucao else None,
-        "total_viagens": len(viagens),
-        "total_km": sum(v.km_rodado for v in viagens if v.km_rodado),
+        "data_retirada": iso_br(coleta.data_retirada),
+        "data_devolucao": iso_br(coleta.data_devolucao),
+        "total_viagens": coleta.total_viagens or 0,
+        "total_km": coleta.total_km_viagens or 0,
         "viagens": [
             {
                 "id": v.id,
                 "numero": v.numero_viagem,
-                "saida_horario": converter_utc_para_br(v.saida_horario).isoformat() if v.saida_horario else None,
+                "saida_horario": iso_br(v.saida_horario),
                 "saida_km": v.saida_km,
-                "retorno_horario": converter_utc_para_br(v.retorno_horario).isoformat() if v.retorno_horario else None,
+                "retorno_horario": iso_br(v.retorno_horario),
                 "retorno_km": v.retorno_km,
                 "km_rodado": v.km_rodado
             } for v in viagens
@@ -332,166 +493,153 @@ def listar_viagens(coleta_id: int, current_user: Usuario = Depends(get_current_u
     }
 
 # ===== UPLOADS AINDA FUNCIONAM COM COLETAS =====
-@router.post("/{coleta_id}/upload-foto")
-async def upload_foto(coleta_id: int, file: UploadFile = File(...), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Faz upload de foto para uma coleta - organiza em pasta do usuário com data/hora"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    logger.info(f"[UPLOAD] Iniciando upload - Coleta: {coleta_id}, Arquivo: {file.filename}, Content-Type: {file.content_type}")
+@router.post("/{coleta_id}/upload-foto", openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {
+    "schema": {"type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}}
+}}}})
+async def upload_foto(coleta_id: int, request: Request, idempotency_key: Optional[str] = Header(None), current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Faz upload de foto para uma coleta (multipart, campo "file") - guardada pelo conteúdo (SHA-256).
+    O corpo é lido em streaming para um arquivo temporário (app/upload.py), não para a memória.
+    A foto é comprimida depois da resposta, em segundo plano (status "processando" até lá)
+    """
+    
+    logger.info(f"[UPLOAD] Iniciando upload - Coleta: {coleta_id}, Content-Length: {request.headers.get('content-length')}")
     
     coleta = db.query(Coleta).filter(Coleta.id == coleta_id, Coleta.usuario_id == current_user.id).first()
     if not coleta:
         logger.error(f"[UPLOAD] Coleta {coleta_id} não encontrada para usuário {current_user.usuario_id}")
         raise HTTPException(status_code=404, detail="Coleta não encontrada")
     
-    # ===== VALIDAÇÃO APRIMORADA DE ARQUIVO =====
-    # 1. Verificar se arquivo foi enviado
-    if not file or not file.filename:
-        logger.error("[UPLOAD] Nenhum arquivo foi enviado")
-        raise HTTPException(status_code=400, detail="Nenhum arquivo foi enviado")
-    
-    # 2. Validar extensão
-    extensoes_permitidas = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic"}
-    nome_arquivo = file.filename.lower()
-    extensao = os.path.splitext(nome_arquivo)[1]
-    
-    logger.info(f"[UPLOAD] Extensão detectada: {extensao}")
-    
-    if extensao not in extensoes_permitidas:
-        logger.error(f"[UPLOAD] Extensão não permitida: {extensao}")
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Tipo de arquivo não permitido. Use: {', '.join(extensoes_permitidas)}"
-        )
-    
-    # 3. Ler e validar tamanho
-    try:
-        contents = await file.read()
-        logger.info(f"[UPLOAD] Arquivo lido com sucesso - Tamanho: {len(contents)} bytes")
-    except Exception as e:
-        logger.error(f"[UPLOAD] Erro ao ler arquivo: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Erro ao ler arquivo: {str(e)}")
-    
-    tamanho_mb = len(contents) / (1024 * 1024)
-    max_size_mb = settings.MAX_UPLOAD_SIZE / (1024 * 1024)
-    
-    if len(contents) > settings.MAX_UPLOAD_SIZE:
-        logger.error(f"[UPLOAD] Arquivo muito grande: {tamanho_mb:.2f}MB (máx: {max_size_mb:.0f}MB)")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Arquivo muito grande ({tamanho_mb:.2f}MB). Máximo: {max_size_mb:.0f}MB"
-        )
-    
-    # 4. Validar se é imagem real (magic bytes) - mais permissivo
-    if len(contents) < 4:
-        logger.error("[UPLOAD] Arquivo muito pequeno ou corrompido")
-        raise HTTPException(status_code=400, detail="Arquivo inválido ou corrompido")
-    
-    # Verificar magic bytes para imagens comuns - versão mais permissiva
-    magic_bytes = contents[:12]
-    is_valid_image = (
-        magic_bytes[:3] == b'\xff\xd8\xff' or  # JPEG
-        magic_bytes[:8] == b'\x89PNG\r\n\x1a\n' or  # PNG
-        magic_bytes[:6] in (b'GIF87a', b'GIF89a') or  # GIF
-        magic_bytes[:4] == b'RIFF' and len(magic_bytes) >= 12 and magic_bytes[8:12] == b'WEBP'  # WEBP
-    )
-    
-    if not is_valid_image:
-        logger.warning(f"[UPLOAD] Magic bytes não reconhecidos. Primeiros bytes: {magic_bytes.hex()}")
-        # Ao invés de rejeitar, apenas registrar warning e continuar
-        logger.warning(f"[UPLOAD] Permitindo arquivo mesmo com magic bytes não reconhecidos (pode ser imagem móvel)")
-    
-    logger.info(f"[UPLOAD] Validação de imagem passou")
+    # Muitas fotos aguardando processamento: recusar antes de receber o corpo (o aparelho tenta de novo)
+    if fila_cheia():
+        logger.warning(f"[UPLOAD] {settings.PHOTO_PENDING_MAX} fotos aguardando processamento - upload recusado")
+        raise processamento_fotos.erro_saturado()
     
-    # 5. Verificar limite de fotos por coleta
-    fotos_coleta = db.query(Foto).filter(Foto.coleta_id == coleta_id).count()
-    if fotos_coleta >= 10:
-        logger.error(f"[UPLOAD] Limite de fotos atingido para coleta {coleta_id}")
-        raise HTTPException(status_code=400, detail="Máximo de 10 fotos por coleta")
-    
-    # ===== SALVAR ARQUIVO =====
-    # Criar estrutura de pasta: uploads/{usuario_id}/
-    pasta_usuario = os.path.join(settings.UPLOAD_DIR, current_user.usuario_id)
-    os.makedirs(pasta_usuario, exist_ok=True)
-    
-    # Salvar arquivo com nome: {data}_{hora}_{coleta_id}_{arquivo}
-    tz = pytz.timezone('America/Sao_Paulo')
-    agora_sp = datetime.now(tz)  # horário local SP para o nome do arquivo
-    data_hora = agora_sp.strftime("%Y%m%d_%H%M%S")
     etapa = "saida" if coleta.ativo else "retorno"
+    usuario_id = current_user.id
+    # Encerra a transação de leitura: nada fica aberto no banco enquanto o corpo chega (4G lento)
+    db.commit()
     
-    # Nome final: 20260118_232530_saida_1_1705614330123.jpg
-    timestamp = int(agora_sp.timestamp() * 1000)  # Millisegundos para garantir unicidade
-    filename = f"{data_hora}_{etapa}_{coleta_id}_{timestamp}{extensao}"
-    filepath = os.path.join(pasta_usuario, filename)
-    
-    logger.info(f"[UPLOAD] Salvando arquivo em: {filepath}")
+    # ===== RECEBER ARQUIVO (STREAMING) =====
+    # Extensão validada pelos cabeçalhos da parte; tamanho validado bloco a bloco (413 ao passar do limite)
+    arquivo = await receber_foto(request)
+    if arquivo is None:
+        logger.error("[UPLOAD] Nenhum arquivo foi enviado")
+        raise HTTPException(status_code=400, detail="Nenhum arquivo foi enviado")
     
-    # ===== COMPRESSÃO DE IMAGEM =====
-    # Comprimir imagem para economizar espaço em disco
     try:
-        # Abrir imagem
-        img = Image.open(io.BytesIO(contents))
+        logger.info(f"[UPLOAD] Arquivo recebido - {arquivo.nome} ({arquivo.content_type}), {arquivo.tamanho} bytes")
+        tamanho_mb = arquivo.tamanho / (1024 * 1024)
         
-        # Converter RGBA para RGB se necessário
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
+        # Validar se é imagem real (magic bytes) - mais permissivo
+        if arquivo.tamanho < 4:
+            logger.error("[UPLOAD] Arquivo muito pequeno ou corrompido")
+            raise HTTPException(status_code=400, detail="Arquivo inválido ou corrompido")
         
-        # Redimensionar se muito grande (máx 1920x1920)
-        max_size = 1920
-        if img.width > max_size or img.height > max_size:
-            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            logger.info(f"[UPLOAD] Imagem redimensionada para: {img.size}")
+        if tipo_pelos_magic_bytes(arquivo.inicio) is None:
+            logger.warning(f"[UPLOAD] Magic bytes não reconhecidos. Primeiros bytes: {arquivo.inicio.hex()}")
+            # Ao invés de rejeitar, apenas registrar warning e continuar
+            logger.warning(f"[UPLOAD] Permitindo arquivo mesmo com magic bytes não reconhecidos (pode ser imagem móvel)")
         
-        # Salvar com compressão
-        img.save(filepath, 'JPEG', quality=85, optimize=True)
+        # Repetição de um upload já gravado (resposta perdida): não salvar a foto de novo.
+        # A chave só é reservada com o arquivo já recebido: a transação de escrita fica curta
+        repetida = reservar_chave(db, usuario_id, idempotency_key, f"upload-foto:{coleta_id}")
+        if repetida is not None:
+            logger.info(f"[UPLOAD] Idempotency-Key repetida - devolvendo foto {repetida.get('id')}")
+            return resposta_repetida(repetida)
         
-        # Obter tamanho após compressão
-        tamanho_comprimido = os.path.getsize(filepath)
-        reducao = ((len(contents) - tamanho_comprimido) / len(contents)) * 100
-        logger.info(f"[UPLOAD] Imagem comprimida: {len(contents)/1024:.1f}KB -> {tamanho_comprimido/1024:.1f}KB (-{reducao:.1f}%)")
+        # ===== MESMO CONTEÚDO JÁ RECEBIDO =====
+        # Reenvio para esta coleta (ex.: conexão caiu antes da resposta): devolver a foto existente
+        caminho_relativo = caminho_existente(db, arquivo.hash)
+        existente = db.query(Foto).filter(
+            Foto.coleta_id == coleta_id, Foto.caminho == caminho_relativo
+        ).first() if caminho_relativo else None
+        if existente:
+            logger.info(f"[UPLOAD] Conteúdo já enviado para a coleta - devolvendo foto {existente.id}")
+            resultado = {
+                "id": existente.id, "caminho": existente.caminho, "tamanho_mb": round(tamanho_mb, 2),
+                "status": existente.status or PRONTA, "duplicada": True
+            }
+            guardar_resposta(db, usuario_id, idempotency_key, resultado)
+            db.commit()
+            return resultado
         
-    except Exception as e:
-        # Se falhar compressão, salvar arquivo original
-        logger.warning(f"[UPLOAD] Falha na compressão, salvando original: {str(e)}")
-        with open(filepath, "wb") as f:
-            f.write(contents)
-    
-    logger.info(f"[UPLOAD] Arquivo salvo com sucesso")
+        # Verificar limite de fotos por coleta (só conteúdo novo: o reenvio acima não conta)
+        fotos_coleta = db.query(Foto).filter(Foto.coleta_id == coleta_id).count()
+        if fotos_coleta >= 10:
+            logger.error(f"[UPLOAD] Limite de fotos atingido para coleta {coleta_id}")
+            raise HTTPException(status_code=400, detail="Máximo de 10 fotos por coleta")
+        
+        # ===== GUARDAR ARQUIVO RECEBIDO =====
+        # Arquivo pelo conteúdo (app/armazenamento_fotos.py): o mesmo conteúdo já guardado
+        # (outra coleta) é reaproveitado sem gravar nem comprimir de novo
+        caminho_relativo, novo = adicionar_referencia(db, arquivo.hash, arquivo.extensao, arquivo.tamanho)
+        arquivo_recebido = None
+        if novo:
+            # A compressão roda depois da resposta (app/pipeline_fotos.py): até lá o arquivo
+            # recebido fica em UPLOAD_PENDING_DIR e a foto fica com status "processando"
+            os.makedirs(settings.UPLOAD_PENDING_DIR, exist_ok=True)
+            arquivo_recebido = os.path.basename(arquivo.caminho)
+            shutil.move(arquivo.caminho, caminho_recebido(arquivo_recebido))
+            status_foto = PROCESSANDO
+        else:
+            # Arquivo ainda em processamento para a outra foto: esta fica pronta junto com ela
+            pronto = os.path.exists(os.path.join(settings.UPLOAD_DIR, caminho_relativo))
+            status_foto = PRONTA if pronto else PROCESSANDO
+            logger.info(f"[UPLOAD] Conteúdo já armazenado - reaproveitando {caminho_relativo}")
+    finally:
+        arquivo.descartar()
     
-    # Salvar no banco com caminho relativo (usuario_id/arquivo)
-    caminho_relativo = f"{current_user.usuario_id}/{filename}"
     # Salvar timestamp UTC REAL do servidor (não converter de SP!)
     agora_utc = datetime.utcnow()
-    nova_foto = Foto(coleta_id=coleta_id, etapa=etapa, caminho=caminho_relativo, criado_em=agora_utc)
+    nova_foto = Foto(
+        coleta_id=coleta_id, etapa=etapa, caminho=caminho_relativo, criado_em=agora_utc,
+        status=status_foto, arquivo_recebido=arquivo_recebido, tentativas=0
+    )
     
     try:
         db.add(nova_foto)
+        db.flush()
+        resultado = {"id": nova_foto.id, "caminho": nova_foto.caminho, "tamanho_mb": round(tamanho_mb, 2), "status": status_foto}
+        guardar_resposta(db, usuario_id, idempotency_key, resultado)
         db.commit()
-        db.refresh(nova_foto)
         logger.info(f"[UPLOAD] Foto registrada no banco de dados - ID: {nova_foto.id}")
     except Exception as e:
+        if arquivo_recebido:
+            os.remove(caminho_recebido(arquivo_recebido))
         logger.error(f"[UPLOAD] Erro ao salvar no banco: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro ao salvar no banco: {str(e)}")
     
+    # Fila cheia: a foto fica pendente no banco e entra pela recuperação do pipeline
+    if arquivo_recebido and not pipeline_fotos.enfileirar(nova_foto.id):
+        logger.warning(f"[UPLOAD] Fila de processamento cheia - foto {nova_foto.id} aguarda a recuperação")
+    
     logger.info(f"[UPLOAD] Upload concluído com sucesso")
-    return {"id": nova_foto.id, "caminho": nova_foto.caminho, "tamanho_mb": round(tamanho_mb, 2)}
+    return resultado
 
 # ===== LISTAR MINHAS COLETAS =====
 @router.get("/minhas-coletas")
-def listar_minhas_coletas(current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Lista todas as coletas do usuário"""
-    coletas = db.query(Coleta).filter(Coleta.usuario_id == current_user.id).all()
+def listar_minhas_coletas(
+    cursor: Optional[str] = Query(None, description="proximo_cursor da página anterior"),
+    limite: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO),
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Lista as coletas do usuário, mais recentes primeiro, paginadas por cursor"""
+    coletas, proximo_cursor = pagina_keyset(
+        db.query(Coleta).filter(Coleta.usuario_id == current_user.id),
+        Coleta.data_retirada, Coleta.id, cursor, limite
+    )
+    
+    # Veículos da página inteira em uma query (os totais de viagens estão na própria coleta)
+    veiculos = {
+        veiculo.id: veiculo
+        for veiculo in db.query(Veiculo).filter(Veiculo.id.in_({coleta.veiculo_id for coleta in coletas}))
+    } if coletas else {}
     
     resultado = []
     for coleta in coletas:
-        veiculo = db.query(Veiculo).filter(Veiculo.id == coleta.veiculo_id).first()
-        viagens = db.query(Viagem).filter(Viagem.coleta_id == coleta.id).all()
+        veiculo = veiculos[coleta.veiculo_id]
         
         resultado.append({
             "id": coleta.id,
@@ -501,11 +649,11 @@ def listar_minhas_coletas(current_user: Usuario = Depends(get_current_user), db:
                 "marca": veiculo.marca,
                 "modelo": veiculo.modelo
             },
-            "data_retirada": converter_utc_para_br(coleta.data_retirada).isoformat() if coleta.data_retirada else None,
-            "data_devolucao": converter_utc_para_br(coleta.data_devolucao).isoformat() if coleta.data_devolucao else None,
+            "data_retirada": iso_br(coleta.data_retirada),
+            "data_devolucao": iso_br(coleta.data_devolucao),
             "ativo": coleta.ativo,
-            "total_viagens": len(viagens),
-            "total_km": sum(v.km_rodado for v in viagens if v.km_rodado)
+            "total_viagens": coleta.total_viagens or 0,
+            "total_km": coleta.total_km_viagens or 0
         })
     
-    return resultado
+    return {"coletas": resultado, "paginacao": paginacao_resposta(limite, proximo_cursor)}
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, HTTPException, Request, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.database import SessionLocal
+from app.modelos import Usuario
+from app.utils import verify_token
+from app.config import settings
+from app.eventos import canal_eventos, eventos_desde, formatar_sse
+from typing import Optional
+import asyncio
+
+router = APIRouter(prefix="/api/eventos", tags=["eventos"])
+
+
+def autenticar_token(token: str):
+    """Usuário ativo do token (sessão aberta só durante a verificação, não durante o stream)"""
+    usuario_id = verify_token(token) if token else None
+    if not usuario_id:
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+    db = SessionLocal()
+    try:
+        usuario = db.query(Usuario).filter(Usuario.usuario_id == usuario_id).first()
+        if not usuario or not usuario.ativo:
+            raise HTTPException(status_code=403, detail="Usuário inativo")
+        return usuario.id
+    finally:
+        db.close()
+
+
+# ===== EVENTOS DA FROTA (SSE) =====
+@router.get("")
+async def fluxo_eventos(
+    request: Request,
+    token: Optional[str] = Query(None, description="Token JWT (o EventSource não envia o header Authorization)"),
+    desde: Optional[int] = Query(None, description="Último id de evento recebido"),
+    last_event_id: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Retiradas, devoluções, saídas/retornos de viagem e mudanças de veículos em tempo real.
+    Cada evento é um JSON {"id", "tipo", ...ids}; "recarregar" pede para buscar a lista completa.
+    """
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    await run_in_threadpool(autenticar_token, token)
+
+    # Reconexão automática do navegador: Last-Event-ID tem prioridade sobre ?desde=
+    if last_event_id and last_event_id.isdigit():
+        desde = int(last_event_id)
+
+    async def gerar():
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue()
+        pendentes = canal_eventos.assinar(loop, fila, desde)
+        try:
+            yield "retry: 3000\n\n"
+            if pendentes is None:
+                pendentes = await run_in_threadpool(eventos_desde, desde)
+            if pendentes is None:
+                yield formatar_sse({"tipo": "recarregar"})
+                pendentes = []
+
+            enviados = {evento["id"] for evento in pendentes}
+            for evento in pendentes:
+                yield formatar_sse(evento)
+
+            while True:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=settings.EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if evento["id"] in enviados:
+                    continue
+                yield formatar_sse(evento)
+        finally:
+            canal_eventos.cancelar(fila)
+
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # proxy (nginx) não deve acumular o stream
+    })
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from app.derivadas import (
+    TAMANHOS_DERIVADAS, FORMATO_DERIVADAS, MEDIA_TYPE_DERIVADAS,
+    caminho_original, caminho_derivada, marcar_uso
+)
+from app.fotos import gerar_derivada
+from app.processamento_fotos import processamento_fotos
+from app.config import settings
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/fotos", tags=["fotos"])
+
+# O arquivo de uma foto não muda depois de pronto: o navegador pode guardar a derivada
+CACHE_DERIVADAS = "public, max-age=604800, immutable"
+
+# Derivadas geradas ao mesmo tempo neste worker: uma página da galeria pede dezenas de uma
+# vez; as excedentes esperam a vez em vez de ocupar as vagas do processamento das fotos
+vagas_derivadas = asyncio.Semaphore(settings.PHOTO_DERIVATIVES_CONCURRENCY)
+
+
+# ===== MINIATURA / TAMANHO MÉDIO =====
+@router.get("/derivadas/{tamanho}/{caminho:path}")
+async def foto_derivada(tamanho: str, caminho: str):
+    """
+    Foto reduzida (miniatura ou media) para a galeria. Pública como /uploads (usada em <img>).
+    Gerada no primeiro acesso se ainda não estiver no cache em disco
+    """
+    if tamanho not in TAMANHOS_DERIVADAS:
+        raise HTTPException(status_code=404, detail="Tamanho inválido")
+    try:
+        arquivo = caminho_derivada(tamanho, caminho)
+        original = caminho_original(caminho)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Foto não encontrada")
+
+    if os.path.exists(arquivo):
+        marcar_uso(arquivo)
+    else:
+        # Foto ainda processando (arquivo final não existe) ou removida
+        if not os.path.exists(original):
+            raise HTTPException(status_code=404, detail="Foto não encontrada")
+        try:
+            await asyncio.wait_for(vagas_derivadas.acquire(), settings.PHOTO_DERIVATIVES_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            # Muitas derivadas na fila: servir a própria foto (sem cache, a derivada vem depois)
+            return FileResponse(original)
+        try:
+            # Outra requisição pode ter gerado a derivada enquanto esta esperava
+            if not os.path.exists(arquivo):
+                await processamento_fotos.executar(
+                    gerar_derivada, original, arquivo, TAMANHOS_DERIVADAS[tamanho], FORMATO_DERIVADAS,
+                    limitar=False
+                )
+        except Exception as e:
+            # Arquivo que o Pillow não lê (guardado sem compressão): servir a própria foto
+            logger.warning(f"Falha ao gerar derivada {tamanho} de {caminho}: {e}")
+            return FileResponse(original)
+        finally:
+            vagas_derivadas.release()
+
+    return FileResponse(arquivo, media_type=MEDIA_TYPE_DERIVADAS, headers={"Cache-Control": CACHE_DERIVADAS})
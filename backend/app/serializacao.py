@@ -0,0 +1,104 @@
+"""
+Serialização das respostas: horários UTC do banco no fuso do Brasil e JSON com orjson.
+
+A conversão UTC → São Paulo usa a tabela de transições do fuso, montada uma vez na
+importação: converter um horário é uma busca binária e uma soma, sem passar pelo
+astimezone do pytz a cada campo de cada linha.
+
+As respostas JSON são geradas com orjson. Os relatórios são guardados no cache já em bytes
+(app.cache.relatorio_em_cache): um acerto do cache não serializa nada.
+"""
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal
+import orjson
+import pytz
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from app.utils import TZ_BRASIL
+
+OPCOES_ORJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+# ===== HORÁRIOS (UTC → BRASIL) =====
+
+def _tabela_fusos():
+    """
+    Instantes UTC (sem tzinfo) em que o fuso de São Paulo muda, com o deslocamento, o tzinfo
+    do pytz e o sufixo ISO ("-03:00") valendo a partir de cada um. Lida uma vez do pytz
+    """
+    transicoes = list(TZ_BRASIL._utc_transition_times)
+    fusos = []
+    for transicao in transicoes:
+        local = pytz.utc.localize(max(transicao, datetime(1, 1, 2))).astimezone(TZ_BRASIL)
+        sufixo = local.isoformat()[-6:]
+        fusos.append((local.utcoffset(), local.tzinfo, sufixo))
+    return transicoes, fusos
+
+
+_TRANSICOES, _FUSOS = _tabela_fusos()
+
+
+def _fuso(dt_utc: datetime):
+    if dt_utc.tzinfo is not None:
+        dt_utc = dt_utc.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt_utc, _FUSOS[bisect_right(_TRANSICOES, dt_utc) - 1]
+
+
+def utc_para_br(dt_utc):
+    """Converte datetime UTC (sem tzinfo, como gravado no banco) para datetime Brasil (São Paulo)"""
+    if dt_utc is None:
+        return None
+    dt_utc, (deslocamento, fuso, _) = _fuso(dt_utc)
+    return (dt_utc + deslocamento).replace(tzinfo=fuso)
+
+
+def iso_br(dt_utc):
+    """Horário UTC do banco em ISO 8601 no fuso do Brasil (None se não houver)"""
+    if dt_utc is None:
+        return None
+    dt_utc, (deslocamento, _, sufixo) = _fuso(dt_utc)
+    return (dt_utc + deslocamento).isoformat() + sufixo
+
+
+def data_br(dt_utc):
+    """Extrai a data no horário do Brasil de um datetime UTC (sem tzinfo, como gravado no banco)"""
+    if dt_utc is None:
+        return None
+    return utc_para_br(dt_utc).date()
+
+
+# ===== JSON =====
+
+def _valor_padrao(valor):
+    """Tipos que o orjson não serializa sozinho"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    raise TypeError(f"Tipo não serializável em JSON: {type(valor).__name__}")
+
+
+def json_bytes(conteudo) -> bytes:
+    """JSON (UTF-8) do conteúdo. Datas e datetimes saem em ISO 8601, como no encoder do FastAPI"""
+    return orjson.dumps(conteudo, default=_valor_padrao, option=OPCOES_ORJSON)
+
+
+class RespostaJSON(JSONResponse):
+    """JSONResponse gerada com orjson (classe de resposta padrão do app)"""
+
+    def render(self, content) -> bytes:
+        return json_bytes(content)
+
+
+def resposta_json(corpo: bytes, response: Response = None) -> Response:
+    """
+    Resposta com o JSON já serializado. Uma rota que retorna a Response direto perde os
+    cabeçalhos colocados no parâmetro `response` (ex.: ETag): eles são copiados aqui
+    """
+    resposta = Response(content=corpo, media_type="application/json")
+    if response is not None:
+        for nome, valor in response.headers.items():
+            if nome not in ("content-length", "content-type"):
+                resposta.headers[nome] = valor
+    return resposta
@@ -0,0 +1,184 @@
+"""
+Recebimento de fotos em streaming.
+
+O corpo multipart é lido direto do request (sem o UploadFile do FastAPI, que lê o
+formulário inteiro antes da rota) e o arquivo vai para um temporário em disco em blocos
+de UPLOAD_CHUNK_SIZE. O upload é recusado assim que passa de MAX_UPLOAD_SIZE (ou antes de
+ler qualquer byte, se o Content-Length já passa) e a extensão é conferida pelos cabeçalhos
+da parte, antes dos dados. Em memória fica no máximo um bloco por upload.
+
+O SHA-256 do arquivo é calculado enquanto os blocos são gravados (ArquivoRecebido.hash),
+sem ler o arquivo de novo: é a chave do armazenamento por conteúdo (app.armazenamento_fotos).
+"""
+import hashlib
+import os
+import tempfile
+import multipart
+from multipart.exceptions import FormParserError
+from multipart.multipart import parse_options_header
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from app.config import settings
+
+EXTENSOES_PERMITIDAS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic"}
+
+# Cabeçalhos multipart e campos além do arquivo
+FOLGA_CONTENT_LENGTH = 64 * 1024
+
+
+def erro_tamanho(tamanho: int) -> HTTPException:
+    tamanho_mb = tamanho / (1024 * 1024)
+    max_size_mb = settings.MAX_UPLOAD_SIZE / (1024 * 1024)
+    return HTTPException(
+        status_code=413,
+        detail=f"Arquivo muito grande ({tamanho_mb:.2f}MB). Máximo: {max_size_mb:.0f}MB"
+    )
+
+
+def erro_extensao() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Tipo de arquivo não permitido. Use: {', '.join(EXTENSOES_PERMITIDAS)}"
+    )
+
+
+class ArquivoRecebido:
+    """Arquivo de um upload gravado em disco (temporário: mover ou apagar com descartar())"""
+
+    def __init__(self, nome: str, content_type: str, caminho: str):
+        self.nome = nome
+        self.content_type = content_type
+        self.caminho = caminho
+        self.extensao = os.path.splitext(nome.lower())[1]
+        self.tamanho = 0
+        self.inicio = b""  # primeiros bytes (magic bytes)
+        self.hash = None  # SHA-256 (hex) do conteúdo, preenchido ao fim do recebimento
+
+    def descartar(self):
+        try:
+            os.remove(self.caminho)
+        except FileNotFoundError:
+            pass
+
+
+class _ReceptorMultipart:
+    """Callbacks do parser multipart: grava a parte `campo` (arquivo) e ignora as outras"""
+
+    def __init__(self, campo: str):
+        self.campo = campo
+        self.arquivo = None
+        self._saida = None
+        self._hash = hashlib.sha256()
+        self._pendente = bytearray()
+        self._cabecalho = b""
+        self._valor = b""
+        self._cabecalhos = {}
+        self._na_parte_do_arquivo = False
+
+    def on_part_begin(self):
+        self._cabecalhos = {}
+        self._na_parte_do_arquivo = False
+
+    def on_header_field(self, data, start, end):
+        self._cabecalho += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._valor += data[start:end]
+
+    def on_header_end(self):
+        self._cabecalhos[self._cabecalho.lower()] = self._valor
+        self._cabecalho = self._valor = b""
+
+    def on_headers_finished(self):
+        _, opcoes = parse_options_header(self._cabecalhos.get(b"content-disposition", b""))
+        if opcoes.get(b"name", b"").decode("utf-8", "replace") != self.campo or b"filename" not in opcoes:
+            return
+        if self.arquivo is not None:
+            raise HTTPException(status_code=400, detail="Envie apenas um arquivo por upload")
+
+        nome = opcoes[b"filename"].decode("utf-8", "replace")
+        if not nome:
+            return
+        if os.path.splitext(nome.lower())[1] not in EXTENSOES_PERMITIDAS:
+            raise erro_extensao()
+
+        os.makedirs(settings.UPLOAD_TMP_DIR, exist_ok=True)
+        descritor, caminho = tempfile.mkstemp(dir=settings.UPLOAD_TMP_DIR, suffix=".upload")
+        self._saida = os.fdopen(descritor, "wb")
+        content_type = self._cabecalhos.get(b"content-type", b"").decode("latin-1")
+        self.arquivo = ArquivoRecebido(nome, content_type, caminho)
+        self._na_parte_do_arquivo = True
+
+    def on_part_data(self, data, start, end):
+        if not self._na_parte_do_arquivo:
+            return
+        self.arquivo.tamanho += end - start
+        if self.arquivo.tamanho > settings.MAX_UPLOAD_SIZE:
+            raise erro_tamanho(self.arquivo.tamanho)
+        if len(self.arquivo.inicio) < 16:
+            self.arquivo.inicio += data[start:min(end, start + 16 - len(self.arquivo.inicio))]
+        self._pendente += data[start:end]
+
+    def on_part_end(self):
+        self._na_parte_do_arquivo = False
+
+    def bloco_para_gravar(self, final: bool = False):
+        """Dados acumulados, se já formam um bloco (ou no fim do corpo)"""
+        if self._pendente and (final or len(self._pendente) >= settings.UPLOAD_CHUNK_SIZE):
+            bloco = bytes(self._pendente)
+            self._pendente.clear()
+            return bloco
+        return None
+
+    def gravar(self, bloco: bytes):
+        self._saida.write(bloco)
+        self._hash.update(bloco)
+
+    def fechar(self):
+        if self._saida is not None:
+            self._saida.close()
+            self.arquivo.hash = self._hash.hexdigest()
+
+
+async def receber_foto(request: Request, campo: str = "file") -> ArquivoRecebido:
+    """
+    Lê o corpo multipart do request e grava o arquivo do campo `campo` num temporário.
+    Retorna None se o campo não veio. Erros (extensão, tamanho, corpo inválido) viram HTTPException
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_UPLOAD_SIZE + FOLGA_CONTENT_LENGTH:
+        raise erro_tamanho(int(content_length))
+
+    _, parametros = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in parametros:
+        raise HTTPException(status_code=400, detail="Envie a foto como multipart/form-data")
+
+    receptor = _ReceptorMultipart(campo)
+    parser = multipart.MultipartParser(parametros[b"boundary"], {
+        "on_part_begin": receptor.on_part_begin,
+        "on_part_data": receptor.on_part_data,
+        "on_part_end": receptor.on_part_end,
+        "on_header_field": receptor.on_header_field,
+        "on_header_value": receptor.on_header_value,
+        "on_header_end": receptor.on_header_end,
+        "on_headers_finished": receptor.on_headers_finished,
+    })
+    try:
+        async for pedaco in request.stream():
+            parser.write(pedaco)
+            bloco = receptor.bloco_para_gravar()
+            if bloco:
+                await run_in_threadpool(receptor.gravar, bloco)
+        parser.finalize()
+        bloco = receptor.bloco_para_gravar(final=True)
+        if bloco:
+            await run_in_threadpool(receptor.gravar, bloco)
+        receptor.fechar()
+    except BaseException as e:
+        receptor.fechar()
+        if receptor.arquivo is not None:
+            receptor.arquivo.descartar()
+        if isinstance(e, FormParserError):
+            raise HTTPException(status_code=400, detail="Corpo multipart inválido")
+        raise
+    return receptor.arquivo
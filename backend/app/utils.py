@@ -2,6 +2,7 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from app.config import settings
+import pytz
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -31,3 +32,6 @@ def verify_token(token: str):
         return email
     except JWTError:
         return None
+
+# Timezone do Brasil (São Paulo)
+TZ_BRASIL = pytz.timezone('America/Sao_Paulo')
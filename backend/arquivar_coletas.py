@@ -0,0 +1,36 @@
+"""
+Script para mover coletas encerradas antigas para o arquivo frio (Parquet)
+Execute periodicamente via cron ou task scheduler (também agendado no main.py)
+
+Uso:
+    python arquivar_coletas.py            # coletas devolvidas há mais de ARCHIVE_AFTER_DAYS
+    python arquivar_coletas.py --dias 730
+"""
+
+import argparse
+from datetime import datetime
+from app.database import SessionLocal, Base, engine
+from app.arquivo import arquivar_coletas
+from app.config import settings
+
+def executar_arquivamento(dias: int = None):
+    """Arquiva as coletas encerradas antigas, um lote por mês"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print(f"[{datetime.utcnow()}] 📦 Arquivando coletas devolvidas há mais de {dias or settings.ARCHIVE_AFTER_DAYS} dias...")
+        lotes = arquivar_coletas(db, dias)
+        if not lotes:
+            print(f"[{datetime.utcnow()}] ✓ Nenhuma coleta para arquivar")
+            return
+        for lote in lotes:
+            print(f"  ✓ {lote.mes}: {lote.total_coletas} coletas, {lote.total_viagens} viagens, {lote.total_fotos} fotos")
+        print(f"[{datetime.utcnow()}] ✓ {sum(l.total_coletas for l in lotes)} coletas arquivadas em {len(lotes)} lotes")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move coletas encerradas antigas para o arquivo Parquet")
+    parser.add_argument("--dias", type=int, help=f"Idade mínima da devolução (padrão: {settings.ARCHIVE_AFTER_DAYS})")
+    args = parser.parse_args()
+    executar_arquivamento(args.dias)
@@ -0,0 +1,420 @@
+"""
+Benchmark das rotas da API (admin, coleta e auth)
+
+Chama cada rota em processo (TestClient) várias vezes e grava, por rota:
+latência (p50/p95/p99/máx), número de queries SQL e pico de memória Python.
+Os resultados vão para um JSON que pode ser comparado com uma execução anterior.
+
+Uso:
+    python gerar_dados_sinteticos.py --perfil medio --recriar
+    python benchmark.py --repeticoes 20 --saida data/benchmark/antes.json
+    python gerar_dados_sinteticos.py --perfil medio --recriar   # mesmo volume para a comparação
+    python benchmark.py --repeticoes 20 --comparar data/benchmark/antes.json
+
+ATENÇÃO: as rotas de escrita são exercitadas de verdade (retirada, viagens,
+devolução, cadastro de usuários/veículos). Use apenas em bancos de teste, e gere
+o banco de novo antes de cada execução que será comparada (a execução acrescenta coletas).
+As latências incluem o custo do tracemalloc: compare apenas execuções deste script.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import event, func
+from app.cache import cache_relatorios
+from app.database import SessionLocal, Base, engine
+from app.disponibilidade import disponibilidade_veiculos
+from app.modelos import Usuario, Veiculo, Coleta, Viagem, Foto
+from app.relatorios import registrar_km_coleta
+from app.rotas import auth_router, admin_router, coleta_router
+from app.utils import create_access_token, hash_password
+
+logging.basicConfig(level=logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+SENHA_BENCHMARK = "benchmark"
+
+
+# ===== CONTADOR DE QUERIES =====
+class ContadorQueries:
+    """Conta as queries; com `capturas` definida (lista), guarda também (rota, SQL, parâmetros)"""
+
+    def __init__(self):
+        self.total = 0
+        self.rota_atual = None
+        self.capturas = None
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.total += 1
+            if self.capturas is not None:
+                self.capturas.append((self.rota_atual, statement, parameters[0] if executemany else parameters))
+
+
+contador_queries = ContadorQueries()
+event.listen(engine, "before_cursor_execute", contador_queries)
+
+
+def percentil(valores, p):
+    """Percentil por posição (nearest-rank) de uma lista ordenada"""
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+class Medidor:
+    """Executa as chamadas e acumula as medições por rota"""
+
+    def __init__(self, client: TestClient, com_cache: bool):
+        self.client = client
+        self.com_cache = com_cache
+        self.medicoes = {}
+
+    def chamar(self, nome, metodo, rota, url, **kwargs):
+        if not self.com_cache:
+            cache_relatorios.limpar()
+            disponibilidade_veiculos.invalidar()
+
+        contador_queries.rota_atual = nome
+        queries_antes = contador_queries.total
+        tracemalloc.reset_peak()
+        memoria_antes = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+
+        resposta = self.client.request(metodo, url, **kwargs)
+        _ = resposta.content  # inclui o envio de respostas em streaming
+
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        pico_kb = (tracemalloc.get_traced_memory()[1] - memoria_antes) / 1024
+        queries = contador_queries.total - queries_antes
+        contador_queries.rota_atual = None
+
+        medicao = self.medicoes.setdefault(nome, {
+            "metodo": metodo, "rota": rota, "tempos": [], "queries": [], "memoria": [], "status": Counter()
+        })
+        medicao["tempos"].append(duracao_ms)
+        medicao["queries"].append(queries)
+        medicao["memoria"].append(pico_kb)
+        medicao["status"][resposta.status_code] += 1
+        return resposta
+
+    def resultados(self):
+        resultado = {}
+        for nome, m in self.medicoes.items():
+            tempos = sorted(m["tempos"])
+            resultado[nome] = {
+                "metodo": m["metodo"],
+                "rota": m["rota"],
+                "n": len(tempos),
+                "status": {str(k): v for k, v in m["status"].items()},
+                "p50_ms": round(percentil(tempos, 50), 2),
+                "p95_ms": round(percentil(tempos, 95), 2),
+                "p99_ms": round(percentil(tempos, 99), 2),
+                "max_ms": round(tempos[-1], 2),
+                "media_ms": round(sum(tempos) / len(tempos), 2),
+                "queries_media": round(sum(m["queries"]) / len(m["queries"]), 1),
+                "queries_max": max(m["queries"]),
+                "memoria_pico_kb": round(max(m["memoria"]), 1),
+            }
+        return resultado
+
+
+# ===== PREPARAÇÃO =====
+def preparar_entidades(db):
+    """Admin, motorista e veículo dedicados ao benchmark, mais amostras do histórico para os relatórios"""
+    admin = db.query(Usuario).filter(Usuario.is_admin == True, Usuario.ativo == True).first()
+    if not admin:
+        admin = Usuario(usuario_id="admin", nome="Administrador", senha_hash=hash_password("admin"), is_admin=True, ativo=True)
+        db.add(admin)
+
+    motorista = db.query(Usuario).filter(Usuario.usuario_id == "BENCH-MOTORISTA").first()
+    if not motorista:
+        motorista = Usuario(usuario_id="BENCH-MOTORISTA", nome="Motorista Benchmark", is_admin=False, ativo=True)
+        db.add(motorista)
+    motorista.senha_hash = hash_password(SENHA_BENCHMARK)
+
+    veiculo = db.query(Veiculo).filter(Veiculo.placa == "BENCH-0001").first()
+    if not veiculo:
+        veiculo = Veiculo(placa="BENCH-0001", modelo="Benchmark", marca="Benchmark", ano=2024, km_atual=0, ativo=True)
+        db.add(veiculo)
+    db.commit()
+
+    # Encerrar coleta ativa deixada por uma execução interrompida
+    for coleta in db.query(Coleta).filter(Coleta.usuario_id == motorista.id, Coleta.ativo == True).all():
+        coleta.ativo = False
+        coleta.data_devolucao = datetime.utcnow()
+        coleta.km_devolucao = coleta.km_retirada
+        registrar_km_coleta(db, coleta)
+    db.commit()
+
+    # Motorista e veículo com mais coletas: os relatórios individuais mais pesados
+    usuario_amostra = db.query(Usuario.usuario_id).join(Coleta, Coleta.usuario_id == Usuario.id).group_by(
+        Usuario.usuario_id
+    ).order_by(func.count(Coleta.id).desc()).first()
+    veiculo_amostra = db.query(Coleta.veiculo_id).group_by(Coleta.veiculo_id).order_by(func.count(Coleta.id).desc()).first()
+
+    return {
+        "admin": admin.usuario_id,
+        "motorista": motorista.usuario_id,
+        "veiculo_id": veiculo.id,
+        "usuario_amostra": usuario_amostra[0] if usuario_amostra else motorista.usuario_id,
+        "veiculo_amostra": veiculo_amostra[0] if veiculo_amostra else veiculo.id,
+    }
+
+
+def imagem_teste() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (2400, 1800), (90, 140, 200)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def aguardar_job(client, headers, job_id, limite_s=120):
+    inicio = time.time()
+    while time.time() - inicio < limite_s:
+        job = client.get(f"/api/admin/relatorios/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("concluido", "erro"):
+            return job
+        time.sleep(0.1)
+    return None
+
+
+# ===== CENÁRIOS =====
+def executar(repeticoes: int, com_cache: bool, filtro: str = None, pular=()):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        entidades = preparar_entidades(db)
+    finally:
+        db.close()
+
+    app = FastAPI()
+    app.include_router(auth_router)
+    app.include_router(admin_router)
+    app.include_router(coleta_router)
+    client = TestClient(app)
+    medidor = Medidor(client, com_cache)
+
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': entidades['admin']})}"}
+    motorista = {"Authorization": f"Bearer {create_access_token({'sub': entidades['motorista']})}"}
+    usuario_amostra = entidades["usuario_amostra"]
+    veiculo_amostra = entidades["veiculo_amostra"]
+    foto = imagem_teste()
+
+    def medir(nome, metodo, rota, url, **kwargs):
+        if (filtro and filtro not in nome) or any(p in nome for p in pular):
+            return None
+        return medidor.chamar(nome, metodo, rota, url, **kwargs)
+
+    leituras_admin = [
+        ("admin.usuarios", "/api/admin/usuarios", "/api/admin/usuarios"),
+        ("admin.veiculos", "/api/admin/veiculos", "/api/admin/veiculos"),
+        ("admin.relatorios", "/api/admin/relatorios", "/api/admin/relatorios"),
+        ("admin.relatorios.detalhado", "/api/admin/relatorios/detalhado", "/api/admin/relatorios/detalhado"),
+        *[
+            (f"admin.relatorios.periodo[{p}]", "/api/admin/relatorios/periodo", f"/api/admin/relatorios/periodo?periodo={p}")
+            for p in ("hoje", "semana", "mes", "ano")
+        ],
+        *[
+            (f"admin.relatorios.consolidado[{g}]", "/api/admin/relatorios/consolidado", f"/api/admin/relatorios/consolidado?agrupar_por={g}")
+            for g in ("dia", "semana", "mes")
+        ],
+        ("admin.relatorios.usuario", "/api/admin/relatorios/usuario/{usuario_id}",
+         f"/api/admin/relatorios/usuario/{usuario_amostra}?periodo=ano"),
+        ("admin.relatorios.veiculo", "/api/admin/relatorios/veiculo/{veiculo_id}",
+         f"/api/admin/relatorios/veiculo/{veiculo_amostra}?periodo=ano"),
+        ("admin.fotos", "/api/admin/fotos/{usuario_id}", f"/api/admin/fotos/{usuario_amostra}"),
+        ("admin.relatorios.cache", "/api/admin/relatorios/cache", "/api/admin/relatorios/cache"),
+        ("admin.exportar[periodo]", "/api/admin/relatorios/exportar/{tipo}", "/api/admin/relatorios/exportar/periodo?periodo=mes"),
+        ("admin.exportar[detalhado]", "/api/admin/relatorios/exportar/{tipo}", "/api/admin/relatorios/exportar/detalhado?periodo=mes"),
+        ("admin.jobs", "/api/admin/relatorios/jobs", "/api/admin/relatorios/jobs"),
+        ("admin.processamento-fotos", "/api/admin/processamento-fotos", "/api/admin/processamento-fotos"),
+    ]
+
+    for i in range(repeticoes):
+        print(f"  rodada {i + 1}/{repeticoes}")
+
+        # Leituras do admin (relatórios)
+        for nome, rota, url in leituras_admin:
+            medir(nome, "GET", rota, url, headers=admin)
+
+        # Jobs de relatório: criação, consulta e download (a execução em si fica fora da medição)
+        resposta = medir("admin.jobs.criar", "POST", "/api/admin/relatorios/jobs/{tipo}",
+                         "/api/admin/relatorios/jobs/periodo?formato=csv&periodo=mes", headers=admin)
+        if resposta is not None and resposta.status_code == 202:
+            job = aguardar_job(client, admin, resposta.json()["id"])
+            if job:
+                medir("admin.jobs.status", "GET", "/api/admin/relatorios/jobs/{job_id}",
+                      f"/api/admin/relatorios/jobs/{job['id']}", headers=admin)
+                medir("admin.jobs.download", "GET", "/api/admin/relatorios/jobs/{job_id}/download",
+                      f"/api/admin/relatorios/jobs/{job['id']}/download", headers=admin)
+
+        # Fluxo do motorista: retirar, foto, sair, retornar, devolver
+        medir("auth.login", "POST", "/api/auth/login", "/api/auth/login",
+              json={"usuario_id": entidades["motorista"], "senha": SENHA_BENCHMARK})
+        medir("auth.verificar-token", "POST", "/api/auth/verificar-token",
+              f"/api/auth/verificar-token?token={motorista['Authorization'].split()[1]}")
+        medir("coleta.veiculos", "GET", "/api/coleta/veiculos", "/api/coleta/veiculos", headers=motorista)
+
+        resposta = medir("coleta.retirar", "POST", "/api/coleta/retirar/{veiculo_id}",
+                         f"/api/coleta/retirar/{entidades['veiculo_id']}", json={"observacoes": "benchmark"}, headers=motorista)
+        if resposta is None or resposta.status_code != 200:
+            continue
+        coleta_id = resposta.json()["id"]
+        km = resposta.json()["km_retirada"] or 0
+
+        medir("coleta.upload-foto", "POST", "/api/coleta/{coleta_id}/upload-foto", f"/api/coleta/{coleta_id}/upload-foto",
+              files={"file": ("benchmark.jpg", foto, "image/jpeg")}, headers=motorista)
+        medir("coleta.sair", "POST", "/api/coleta/{coleta_id}/sair", f"/api/coleta/{coleta_id}/sair",
+              json={"km": km}, headers=motorista)
+        medir("coleta.ativa", "GET", "/api/coleta/ativa", "/api/coleta/ativa", headers=motorista)
+        medir("coleta.retornar", "POST", "/api/coleta/{coleta_id}/retornar", f"/api/coleta/{coleta_id}/retornar",
+              json={"km": km + 10}, headers=motorista)
+        medir("coleta.viagens", "GET", "/api/coleta/{coleta_id}/viagens", f"/api/coleta/{coleta_id}/viagens", headers=motorista)
+        medir("coleta.devolver", "POST", "/api/coleta/{coleta_id}/devolver", f"/api/coleta/{coleta_id}/devolver",
+              json={"km": km + 12}, headers=motorista)
+        medir("coleta.minhas-coletas", "GET", "/api/coleta/minhas-coletas", "/api/coleta/minhas-coletas", headers=motorista)
+        medir("admin.editar-km", "PUT", "/api/admin/coleta/{coleta_id}/editar-km", f"/api/admin/coleta/{coleta_id}/editar-km",
+              json={"km_devolucao": km + 12}, headers=admin)
+
+        # O mesmo fluxo enviado de uma vez, como a fila offline do aparelho
+        medir("coleta.sync", "POST", "/api/coleta/sync", "/api/coleta/sync", json={"operacoes": [
+            {"tipo": "retirar", "veiculo_id": entidades["veiculo_id"], "observacoes": "benchmark"},
+            {"tipo": "sair", "km": km + 12},
+            {"tipo": "retornar", "km": km + 22},
+            {"tipo": "devolver", "km": km + 24}
+        ]}, headers=motorista)
+
+        # Cadastros do admin (criados e removidos na mesma rodada)
+        usuario_id = f"BENCH-U{os.getpid()}-{i}"
+        medir("admin.usuarios.criar", "POST", "/api/admin/usuarios", "/api/admin/usuarios",
+              json={"usuario_id": usuario_id, "nome": "Benchmark", "senha": "benchmark", "is_admin": False}, headers=admin)
+        medir("admin.usuarios.senha", "PUT", "/api/admin/usuarios/{usuario_id}/senha", f"/api/admin/usuarios/{usuario_id}/senha",
+              json={"nova_senha": "benchmark2"}, headers=admin)
+        medir("admin.usuarios.admin", "PUT", "/api/admin/usuarios/{usuario_id}/admin", f"/api/admin/usuarios/{usuario_id}/admin",
+              json={"is_admin": False}, headers=admin)
+        medir("admin.usuarios.deletar", "DELETE", "/api/admin/usuarios/{usuario_id}", f"/api/admin/usuarios/{usuario_id}", headers=admin)
+
+        resposta = medir("admin.veiculos.criar", "POST", "/api/admin/veiculos", "/api/admin/veiculos",
+                         json={"placa": f"BENCH-V{os.getpid()}-{i}", "modelo": "Benchmark", "marca": "Benchmark", "ano": 2024, "km_inicial": 0},
+                         headers=admin)
+        if resposta is not None and resposta.status_code == 200:
+            veiculo_id = resposta.json()["id"]
+            medir("admin.veiculos.km", "PUT", "/api/admin/veiculos/{veiculo_id}/km", f"/api/admin/veiculos/{veiculo_id}/km",
+                  json={"km_atual": 1000}, headers=admin)
+            medir("admin.veiculos.deletar", "DELETE", "/api/admin/veiculos/{veiculo_id}", f"/api/admin/veiculos/{veiculo_id}", headers=admin)
+
+    return medidor.resultados()
+
+
+def rotas_sem_medicao(resultados):
+    """Rotas registradas nos routers que não foram chamadas pelo benchmark"""
+    medidas = {(r["metodo"], r["rota"]) for r in resultados.values()}
+    registradas = set()
+    for router in (auth_router, admin_router, coleta_router):
+        for rota in router.routes:
+            for metodo in rota.methods:
+                registradas.add((metodo, rota.path))
+    return sorted(f"{metodo} {rota}" for metodo, rota in registradas - medidas)
+
+
+def contagens_tabelas():
+    db = SessionLocal()
+    try:
+        return {
+            modelo.__tablename__: db.query(func.count(modelo.id)).scalar()
+            for modelo in (Usuario, Veiculo, Coleta, Viagem, Foto)
+        }
+    finally:
+        db.close()
+
+
+def commit_atual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+# ===== COMPARAÇÃO =====
+def comparar(base, atual, limite: float, minimo_ms: float):
+    """Imprime a comparação por rota; retorna a lista de regressões"""
+    regressoes = []
+    print(f"\n{'rota':45} {'p50 base':>10} {'p50 atual':>10} {'razão':>7} {'queries':>13}")
+    for nome in sorted(atual["rotas"]):
+        if nome not in base["rotas"]:
+            continue
+        b, a = base["rotas"][nome], atual["rotas"][nome]
+        razao = a["p50_ms"] / b["p50_ms"] if b["p50_ms"] else 1
+        queries = f"{b['queries_media']:g} → {a['queries_media']:g}"
+        marca = ""
+        mais_queries = a["queries_media"] > b["queries_media"] + 0.5
+        if (razao > limite and a["p50_ms"] - b["p50_ms"] > minimo_ms) or mais_queries:
+            regressoes.append(nome)
+            marca = "  ⚠️"
+        print(f"{nome:45} {b['p50_ms']:>10.2f} {a['p50_ms']:>10.2f} {razao:>7.2f} {queries:>13}{marca}")
+    return regressoes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das rotas da API")
+    parser.add_argument("--repeticoes", type=int, default=10)
+    parser.add_argument("--saida", help="Arquivo JSON de resultados (padrão: data/benchmark/benchmark_<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--limite", type=float, default=1.25, help="Razão de p50 considerada regressão (padrão: 1.25)")
+    parser.add_argument("--minimo-ms", type=float, default=5, help="Diferença mínima de p50 (ms) para contar como regressão")
+    parser.add_argument("--com-cache", action="store_true", help="Não limpar os caches (relatórios, veículos disponíveis) entre as chamadas")
+    parser.add_argument("--apenas", help="Mede apenas rotas cujo nome contém este texto")
+    parser.add_argument("--pular", default="", help="Nomes (ou trechos) de rotas a ignorar, separados por vírgula")
+    args = parser.parse_args()
+
+    print(f"🏁 Benchmark: {args.repeticoes} rodadas em {engine.url.render_as_string(hide_password=True)}")
+    tracemalloc.start()
+    pular = [p for p in args.pular.split(",") if p]
+    resultados = executar(args.repeticoes, args.com_cache, args.apenas, pular)
+    tracemalloc.stop()
+
+    relatorio = {
+        "gerado_em": datetime.utcnow().isoformat(),
+        "commit": commit_atual(),
+        "banco": engine.dialect.name,
+        "contagens": contagens_tabelas(),
+        "repeticoes": args.repeticoes,
+        "com_cache": args.com_cache,
+        "rotas": resultados,
+        "rotas_sem_medicao": [] if args.apenas or pular else rotas_sem_medicao(resultados),
+    }
+
+    saida = args.saida or os.path.join("data", "benchmark", f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(saida) or ".", exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+    print(f"\n{'rota':45} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'mem KB':>9}")
+    for nome, r in sorted(resultados.items()):
+        print(f"{nome:45} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['queries_media']:>8g} {r['memoria_pico_kb']:>9.1f}")
+    if relatorio["rotas_sem_medicao"]:
+        print(f"\n⚠️ Rotas sem medição: {', '.join(relatorio['rotas_sem_medicao'])}")
+    print(f"\n✓ Resultados salvos em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            base = json.load(arquivo)
+        regressoes = comparar(base, relatorio, args.limite, args.minimo_ms)
+        if regressoes:
+            print(f"\n❌ {len(regressoes)} regressões: {', '.join(regressoes)}")
+            sys.exit(1)
+        print("\n✓ Sem regressões")
@@ -1,14 +1,56 @@
-"""
 """Script para limpar fotos com mais de 90 dias
 Execute periodicamente via cron ou task scheduler
 """
 
 import os
 import shutil
+from collections import Counter
 from datetime import datetime, timedelta
+from sqlalchemy import text
 from app.database import SessionLocal
 from app.modelos import Foto
 from app.config import settings
+from app.armazenamento_fotos import remover_referencias, apagar_arquivo
+from app.particoes import particoes_anteriores, remover_particao
+
+def remover_recebido(arquivo_recebido):
+    """Apaga o arquivo recebido de uma foto que não chegou a ser processada"""
+    if arquivo_recebido:
+        filepath = os.path.join(settings.UPLOAD_PENDING_DIR, arquivo_recebido)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+def apagar_arquivo_foto(caminho, pastas_vazias):
+    """Apaga o arquivo da foto e as derivadas. Retorna False se o arquivo não existia"""
+    if not apagar_arquivo(caminho):
+        return False
+    pastas_vazias.add(os.path.dirname(os.path.join(settings.UPLOAD_DIR, caminho)))
+    return True
+
+def remover_particoes_antigas(db, data_limite, pastas_vazias):
+    """
+    PostgreSQL com fotos particionada: partições mensais inteiramente anteriores ao limite
+    são removidas com DROP e os arquivos que ficaram sem nenhuma foto são apagados.
+    Retorna quantas fotos removeu.
+    """
+    conn = db.connection()
+    removidas = 0
+    for particao in particoes_anteriores(conn, "fotos", data_limite.date()):
+        linhas = conn.execute(text(f"SELECT caminho, arquivo_recebido FROM {particao}")).all()
+        # Arquivo compartilhado (mesmo conteúdo) só sai quando a última foto sai
+        sem_referencia = [
+            caminho for caminho, quantidade in Counter(caminho for caminho, _ in linhas).items()
+            if remover_referencias(db, caminho, quantidade)
+        ]
+        remover_particao(conn, "fotos", particao)
+        db.commit()
+        for caminho in sem_referencia:
+            apagar_arquivo_foto(caminho, pastas_vazias)
+        for _, arquivo_recebido in linhas:
+            remover_recebido(arquivo_recebido)
+        removidas += len(linhas)
+        print(f"  ✓ Partição {particao} removida ({len(linhas)} fotos, {len(sem_referencia)} arquivos)")
+    return removidas
 
 def cleanup_old_photos():
     """Remove fotos antigas (> 90 dias) do servidor"""
@@ -18,32 +60,28 @@ def cleanup_old_photos():
         # Data limite: 90 dias atrás
         data_limite = datetime.utcnow() - timedelta(days=90)
         
-        # Buscar fotos antigas
+        pastas_vazias = set()
+        
+        # Meses inteiros antigos: DROP da partição (somente PostgreSQL particionado)
+        deletadas = remover_particoes_antigas(db, data_limite, pastas_vazias)
+        erros = 0
+        
+        # Buscar fotos antigas (restantes: mês parcial, partição padrão ou tabela não particionada)
         fotos_antigas = db.query(Foto).filter(Foto.criado_em < data_limite).all()
         
-        if not fotos_antigas:
+        if not fotos_antigas and not deletadas:
             print(f"[{datetime.utcnow()}] ✓ Nenhuma foto para deletar")
             return
         
         print(f"[{datetime.utcnow()}] 🗑️ Encontradas {len(fotos_antigas)} fotos para deletar")
         
-        deletadas = 0
-        erros = 0
-        pastas_vazias = set()
-        
+        # Arquivos apagados só depois do commit (um arquivo compartilhado por outras fotos fica)
+        apagar = []
         for foto in fotos_antigas:
             try:
-                # Deletar arquivo
-                filepath = os.path.join(settings.UPLOAD_DIR, foto.caminho)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    print(f"  ✓ Deletado: {foto.caminho}")
-                    
-                    # Rastrear pasta para possível limpeza
-                    pasta = os.path.dirname(filepath)
-                    pastas_vazias.add(pasta)
-                else:
-                    print(f"  ⚠️ Arquivo não encontrado: {foto.caminho}")
+                if remover_referencias(db, foto.caminho):
+                    apagar.append(foto.caminho)
+                remover_recebido(foto.arquivo_recebido)
                 
                 # Deletar do banco
                 db.delete(foto)
@@ -53,6 +91,15 @@ def cleanup_old_photos():
                 print(f"  ❌ Erro ao deletar {foto.caminho}: {e}")
                 erros += 1
         
+        # Commit das deleções
+        db.commit()
+        
+        for caminho in apagar:
+            if apagar_arquivo_foto(caminho, pastas_vazias):
+                print(f"  ✓ Deletado: {caminho}")
+            else:
+                print(f"  ⚠️ Arquivo não encontrado: {caminho}")
+        
         # Remover pastas vazias
         for pasta in pastas_vazias:
             if os.path.exists(pasta):
@@ -63,9 +110,6 @@ def cleanup_old_photos():
                 except Exception as e:
                     pass  # Pasta não está vazia, ignorar
         
-        # Commit das deleções
-        db.commit()
-        
         print(f"[{datetime.utcnow()}] ✓ Limpeza concluída: {deletadas} fotos deletadas, {erros} erros")
         
     except Exception as e:
@@ -0,0 +1,301 @@
+"""
+Script para gerar uma frota sintética (motoristas, veículos, coletas, viagens e fotos)
+Usado para medir os relatórios com volume realista (ver benchmark.py)
+
+Uso:
+    python gerar_dados_sinteticos.py --perfil pequeno           # 50 veículos
+    python gerar_dados_sinteticos.py --perfil medio --anos 3     # 500 veículos
+    python gerar_dados_sinteticos.py --perfil grande --recriar   # 5000 veículos, banco zerado
+
+Usa o DATABASE_URL configurado (SQLite ou PostgreSQL). As linhas são inseridas em
+lotes com o Core do SQLAlchemy; as fotos são apenas registros (os arquivos não são criados).
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from sqlalchemy import func, select, text, bindparam
+from app.database import SessionLocal, Base, engine
+from app.modelos import Usuario, Veiculo, Coleta, Viagem, Foto
+from app.relatorios import reconstruir_km_diario
+from app.utils import TZ_BRASIL, hash_password
+
+PERFIS = {
+    "pequeno": {"veiculos": 50, "motoristas": 120},
+    "medio": {"veiculos": 500, "motoristas": 1500},
+    "grande": {"veiculos": 5000, "motoristas": 12000},
+}
+
+SENHA_MOTORISTAS = "123456"
+MARCAS_MODELOS = [
+    ("Mercedes", "Sprinter"), ("Iveco", "Daily"), ("Scania", "P320"),
+    ("Volkswagen", "Delivery"), ("Fiat", "Ducato"), ("Renault", "Master"),
+]
+
+
+def proximo_id(tabela) -> int:
+    with engine.connect() as conn:
+        return (conn.execute(select(func.max(tabela.c.id))).scalar() or 0) + 1
+
+
+def inserir_em_lotes(tabela, linhas, lote: int):
+    """Insere um iterador de dicts em lotes (executemany), com um commit por lote"""
+    total = 0
+    buffer = []
+    for linha in linhas:
+        buffer.append(linha)
+        if len(buffer) >= lote:
+            with engine.begin() as conn:
+                conn.execute(tabela.insert(), buffer)
+            total += len(buffer)
+            buffer = []
+    if buffer:
+        with engine.begin() as conn:
+            conn.execute(tabela.insert(), buffer)
+        total += len(buffer)
+    return total
+
+
+def ajustar_sequencias():
+    """No PostgreSQL, avança as sequências dos ids (os ids foram inseridos explicitamente)"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for tabela in ("usuarios", "veiculos", "coletas", "viagens", "fotos"):
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {tabela}), 1))"
+            ))
+
+
+class GeradorFrota:
+    """Gera coletas dia a dia: cada veículo é usado com probabilidade `uso_diario` em dias úteis"""
+
+    def __init__(self, rnd, veiculo_ids, motorista_ids, km_inicial, dias, uso_diario, fotos_por_viagem):
+        self.rnd = rnd
+        self.veiculo_ids = veiculo_ids
+        self.motorista_ids = motorista_ids
+        self.km_atual = dict(km_inicial)
+        self.dias = dias
+        self.uso_diario = uso_diario
+        self.fotos_por_viagem = fotos_por_viagem
+
+        self.proximo_coleta = proximo_id(Coleta.__table__)
+        self.proximo_viagem = proximo_id(Viagem.__table__)
+        self.proximo_foto = proximo_id(Foto.__table__)
+        self.viagens = []
+        self.fotos = []
+
+    def coletas(self):
+        """Gera as coletas; viagens e fotos de cada coleta ficam em self.viagens / self.fotos"""
+        hoje = self.dias[-1]
+        for dia in self.dias:
+            if dia.weekday() == 6 and dia != hoje:
+                continue  # domingo sem operação
+            # Deslocamento UTC do dia (horário de verão até 2019)
+            offset = TZ_BRASIL.utcoffset(datetime.combine(dia, dt_time(12)))
+            meia_noite_utc = datetime.combine(dia, dt_time.min) - offset
+
+            usados = [v for v in self.veiculo_ids if self.rnd.random() < self.uso_diario]
+            quantidade = min(len(usados), len(self.motorista_ids))
+            motoristas = self.rnd.sample(self.motorista_ids, quantidade)
+
+            for veiculo_id, usuario_id in zip(usados, motoristas):
+                yield self._coleta(dia == hoje, meia_noite_utc, offset, veiculo_id, usuario_id)
+
+    def _coleta(self, em_andamento, meia_noite_utc, offset, veiculo_id, usuario_id):
+        rnd = self.rnd
+        coleta_id = self.proximo_coleta
+        self.proximo_coleta += 1
+
+        retirada = meia_noite_utc + timedelta(minutes=rnd.randint(6 * 60, 9 * 60))
+        km_retirada = self.km_atual[veiculo_id]
+        km = km_retirada
+        horario = retirada
+        km_viagens = 0
+        viagem_aberta_id = None
+
+        total_viagens = rnd.choices([0, 1, 2, 3, 4], weights=[10, 30, 35, 18, 7])[0]
+        for numero in range(1, total_viagens + 1):
+            saida = horario + timedelta(minutes=rnd.randint(10, 60))
+            km_viagem = round(rnd.uniform(5, 80), 1)
+            retorno = saida + timedelta(minutes=int(km_viagem * rnd.uniform(1.5, 3)))
+            # Na coleta de hoje a última viagem pode estar em andamento
+            aberta = em_andamento and numero == total_viagens and rnd.random() < 0.5
+
+            viagem_id = self.proximo_viagem
+            self.proximo_viagem += 1
+            self.viagens.append({
+                "id": viagem_id,
+                "coleta_id": coleta_id,
+                "saida_horario": saida,
+                "saida_km": km,
+                "retorno_horario": None if aberta else retorno,
+                "retorno_km": None if aberta else km + km_viagem,
+                "numero_viagem": numero,
+                "km_rodado": None if aberta else km_viagem,
+                "criado_em": saida,
+                "atualizado_em": saida if aberta else retorno,
+            })
+            for indice in range(self.fotos_por_viagem):
+                etapa = "saida" if indice % 2 == 0 else "retorno"
+                instante = saida if etapa == "saida" else retorno
+                if aberta and etapa == "retorno":
+                    continue
+                self.fotos.append({
+                    "id": self.proximo_foto,
+                    "coleta_id": coleta_id,
+                    "etapa": etapa,
+                    "caminho": f"sintetico/{coleta_id}_{numero}_{indice}.jpg",
+                    "criado_em": instante,
+                })
+                self.proximo_foto += 1
+            if aberta:
+                viagem_aberta_id = viagem_id
+                break
+            km += km_viagem
+            km_viagens += km_viagem
+            horario = retorno
+
+        devolucao = None
+        km_devolucao = None
+        if not em_andamento:
+            devolucao = horario + timedelta(minutes=rnd.randint(15, 90))
+            km_devolucao = round(km + rnd.uniform(0, 3), 1)
+            self.km_atual[veiculo_id] = km_devolucao
+
+        return {
+            "id": coleta_id,
+            "usuario_id": usuario_id,
+            "veiculo_id": veiculo_id,
+            "data_retirada": retirada,
+            "km_retirada": km_retirada,
+            "observacoes_retirada": None,
+            "data_devolucao": devolucao,
+            # Inserção em lote não passa pelo @validates do modelo
+            "data_devolucao_local": (devolucao + offset).date() if devolucao else None,
+            "km_devolucao": km_devolucao,
+            "observacoes_devolucao": None,
+            "total_viagens": total_viagens,
+            "total_km_viagens": round(km_viagens, 1),
+            "viagem_aberta_id": viagem_aberta_id,
+            "ativo": em_andamento,
+            "criado_em": retirada,
+            "atualizado_em": devolucao or horario,
+        }
+
+
+def gerar_dados_sinteticos(veiculos: int, motoristas: int, anos: float, uso_diario: float,
+                           fotos_por_viagem: int, seed: int, recriar: bool, lote: int):
+    inicio = time.time()
+    rnd = random.Random(seed)
+
+    if recriar:
+        print("🗑️ Recriando tabelas...")
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        if recriar or not db.query(Usuario).filter(Usuario.is_admin == True).first():
+            db.add(Usuario(usuario_id="admin", nome="Administrador", senha_hash=hash_password("admin"), is_admin=True, ativo=True))
+            db.commit()
+
+        # ===== MOTORISTAS E VEÍCULOS =====
+        prefixo = f"S{seed}"
+        if db.query(Veiculo).filter(Veiculo.placa.like(f"{prefixo}-%")).first():
+            print(f"❌ Já existem dados sintéticos com seed {seed}. Use --recriar ou outra --seed")
+            return False
+
+        senha_hash = hash_password(SENHA_MOTORISTAS)
+        agora = datetime.utcnow()
+        id_usuario = proximo_id(Usuario.__table__)
+        id_veiculo = proximo_id(Veiculo.__table__)
+
+        motorista_ids = list(range(id_usuario, id_usuario + motoristas))
+        inserir_em_lotes(Usuario.__table__, (
+            {"id": uid, "usuario_id": f"{prefixo}M{i:05d}", "nome": f"Motorista Sintético {i}",
+             "senha_hash": senha_hash, "is_admin": False, "ativo": True, "criado_em": agora}
+            for i, uid in enumerate(motorista_ids)
+        ), lote)
+
+        veiculo_ids = list(range(id_veiculo, id_veiculo + veiculos))
+        km_inicial = {vid: round(rnd.uniform(0, 150000), 1) for vid in veiculo_ids}
+        linhas_veiculos = []
+        for i, vid in enumerate(veiculo_ids):
+            marca, modelo = rnd.choice(MARCAS_MODELOS)
+            linhas_veiculos.append({
+                "id": vid, "placa": f"{prefixo}-{i:05d}", "modelo": modelo, "marca": marca,
+                "ano": rnd.randint(2012, 2025), "km_atual": km_inicial[vid], "ativo": True, "criado_em": agora
+            })
+        inserir_em_lotes(Veiculo.__table__, linhas_veiculos, lote)
+        print(f"✓ {motoristas} motoristas e {veiculos} veículos")
+
+        # ===== COLETAS, VIAGENS E FOTOS =====
+        hoje = datetime.now(TZ_BRASIL).date()
+        total_dias = int(anos * 365)
+        dias = [hoje - timedelta(days=total_dias - i) for i in range(total_dias + 1)]
+        gerador = GeradorFrota(rnd, veiculo_ids, motorista_ids, km_inicial, dias, uso_diario, fotos_por_viagem)
+
+        total_coletas = total_viagens = total_fotos = 0
+        buffer = []
+        for coleta in gerador.coletas():
+            buffer.append(coleta)
+            if len(buffer) >= lote:
+                total_coletas += inserir_em_lotes(Coleta.__table__, buffer, lote)
+                total_viagens += inserir_em_lotes(Viagem.__table__, gerador.viagens, lote)
+                total_fotos += inserir_em_lotes(Foto.__table__, gerador.fotos, lote)
+                buffer, gerador.viagens, gerador.fotos = [], [], []
+                print(f"  ... {total_coletas} coletas, {total_viagens} viagens, {total_fotos} fotos")
+        total_coletas += inserir_em_lotes(Coleta.__table__, buffer, lote)
+        total_viagens += inserir_em_lotes(Viagem.__table__, gerador.viagens, lote)
+        total_fotos += inserir_em_lotes(Foto.__table__, gerador.fotos, lote)
+        print(f"✓ {total_coletas} coletas, {total_viagens} viagens, {total_fotos} fotos")
+
+        # KM final de cada veículo (odômetro após a última devolução)
+        with engine.begin() as conn:
+            conn.execute(
+                Veiculo.__table__.update().where(Veiculo.__table__.c.id == bindparam("vid")),
+                [{"vid": vid, "km_atual": km} for vid, km in gerador.km_atual.items()]
+            )
+        ajustar_sequencias()
+
+        print("🔄 Reconstruindo km_diario...")
+        linhas = reconstruir_km_diario(db)
+        print(f"✓ km_diario: {linhas} linhas")
+
+        # Estatísticas para o planejador (o SQLite não as coleta sozinho; sem elas as buscas
+        # podem usar um índice pior que os parciais de coleta/viagem ativa)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        print(f"✓ Concluído em {time.time() - inicio:.1f}s (senha dos motoristas: {SENHA_MOTORISTAS})")
+        return True
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera uma frota sintética para benchmarks")
+    parser.add_argument("--perfil", choices=PERFIS.keys(), default="pequeno")
+    parser.add_argument("--veiculos", type=int, help="Sobrescreve o número de veículos do perfil")
+    parser.add_argument("--motoristas", type=int, help="Sobrescreve o número de motoristas do perfil")
+    parser.add_argument("--anos", type=float, default=2, help="Anos de histórico (padrão: 2)")
+    parser.add_argument("--uso-diario", type=float, default=0.7, help="Probabilidade de um veículo sair num dia útil")
+    parser.add_argument("--fotos-por-viagem", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--lote", type=int, default=5000, help="Linhas por INSERT em lote")
+    parser.add_argument("--recriar", action="store_true", help="Apaga e recria todas as tabelas antes de gerar")
+    args = parser.parse_args()
+
+    perfil = PERFIS[args.perfil]
+    gerar_dados_sinteticos(
+        veiculos=args.veiculos or perfil["veiculos"],
+        motoristas=args.motoristas or perfil["motoristas"],
+        anos=args.anos,
+        uso_diario=args.uso_diario,
+        fotos_por_viagem=args.fotos_por_viagem,
+        seed=args.seed,
+        recriar=args.recriar,
+        lote=args.lote,
+    )
@@ -3,8 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from app.database import Base, engine
-from app.rotas import auth_router, admin_router, coleta_router
+from app.rotas import auth_router, admin_router, coleta_router, eventos_router, fotos_router
 from app.config import settings
+from app.jobs_relatorio import executor_jobs, limpar_jobs_relatorio
+from app.eventos import canal_eventos, limpar_eventos
+from app.idempotencia import limpar_chaves_idempotencia
+from app.serializacao import RespostaJSON
+from app.processamento_fotos import processamento_fotos
+from app.pipeline_fotos import pipeline_fotos
+from app.derivadas import limpar_derivadas
 import os
 import logging
 from datetime import datetime
@@ -36,7 +43,8 @@ limiter = Limiter(
 app = FastAPI(
     title="App Frota",
     description="Aplicação para controle de frota com offline-first",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=RespostaJSON  # JSON com orjson (app/serializacao.py)
 )
 
 # Adicionar rate limiter ao app
@@ -119,6 +127,8 @@ def get_wl_logo():
 app.include_router(auth_router)
 app.include_router(admin_router)
 app.include_router(coleta_router)
+app.include_router(eventos_router)
+app.include_router(fotos_router)
 logger.info("✓ Rotas registradas")
 
 # ===== SCHEDULER DE LIMPEZA DE FOTOS =====
@@ -132,9 +142,65 @@ def cleanup_job():
     except Exception as e:
         logger.error(f"❌ Erro no scheduler de limpeza: {e}", exc_info=True)
 
+# ===== LIMPEZA DE JOBS DE RELATÓRIO =====
+def limpeza_jobs_relatorio():
+    """Remove arquivos de relatório expirados e marca jobs interrompidos como erro"""
+    try:
+        limpar_jobs_relatorio()
+    except Exception as e:
+        logger.error(f"❌ Erro na limpeza de jobs de relatório: {e}", exc_info=True)
+
+# ===== ARQUIVO FRIO DE COLETAS =====
+def arquivamento_job():
+    """Move coletas encerradas antigas para o arquivo Parquet"""
+    from arquivar_coletas import executar_arquivamento
+    try:
+        executar_arquivamento()
+    except Exception as e:
+        logger.error(f"❌ Erro no arquivamento de coletas: {e}", exc_info=True)
+
+# ===== PARTIÇÕES MENSAIS (POSTGRESQL) =====
+def particoes_job():
+    """Cria as partições dos próximos meses de viagens e fotos (se particionadas)"""
+    from app.particoes import garantir_particoes
+    try:
+        garantir_particoes()
+    except Exception as e:
+        logger.error(f"❌ Erro ao criar partições: {e}", exc_info=True)
+
+# ===== LIMPEZA DOS EVENTOS DA FROTA (SSE) =====
+def limpeza_eventos_job():
+    """Remove eventos da frota mais antigos que o período de retenção"""
+    try:
+        limpar_eventos()
+    except Exception as e:
+        logger.error(f"❌ Erro na limpeza de eventos da frota: {e}", exc_info=True)
+
+# ===== LIMPEZA DAS CHAVES DE IDEMPOTÊNCIA =====
+def limpeza_idempotencia_job():
+    """Remove Idempotency-Keys expiradas"""
+    try:
+        limpar_chaves_idempotencia()
+    except Exception as e:
+        logger.error(f"❌ Erro na limpeza de chaves de idempotência: {e}", exc_info=True)
+
+# ===== CACHE DAS DERIVADAS DAS FOTOS =====
+def limpeza_derivadas_job():
+    """Apaga as miniaturas menos usadas quando o cache passa de PHOTO_DERIVATIVES_MAX_MB"""
+    try:
+        limpar_derivadas()
+    except Exception as e:
+        logger.error(f"❌ Erro na limpeza das derivadas de fotos: {e}", exc_info=True)
+
 # Inicializar scheduler
 scheduler = BackgroundScheduler()
 scheduler.add_job(cleanup_job, 'cron', hour=2, minute=0)
+scheduler.add_job(limpeza_jobs_relatorio, 'interval', minutes=30)
+scheduler.add_job(arquivamento_job, 'cron', day_of_week='sun', hour=3, minute=0)
+scheduler.add_job(particoes_job, 'cron', hour=1, minute=30)
+scheduler.add_job(limpeza_eventos_job, 'interval', hours=1)
+scheduler.add_job(limpeza_idempotencia_job, 'interval', hours=1)
+scheduler.add_job(limpeza_derivadas_job, 'interval', minutes=30)
 scheduler.start()
 logger.info("✓ Scheduler iniciado - Limpeza agendada para 02:00 todos os dias")
 
@@ -159,6 +225,8 @@ def health():
 # Log ao iniciar
 @app.on_event("startup")
 async def startup_event():
+    # Fotos recebidas e ainda não processadas (inclusive as que ficaram de antes de uma queda)
+    pipeline_fotos.iniciar()
     logger.info("="*60)
     logger.info("🚀 App Frota iniciado com sucesso!")
     logger.info(f"Ambiente: {settings.ENVIRONMENT}")
@@ -169,4 +237,8 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     scheduler.shutdown()
+    executor_jobs.shutdown(wait=False, cancel_futures=True)
+    await pipeline_fotos.parar()
+    processamento_fotos.encerrar()
+    canal_eventos.parar()
     logger.info("🛑 App Frota encerrado")
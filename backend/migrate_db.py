@@ -3,6 +3,7 @@ Script para aplicar migrações do banco de dados
 Execute antes do init_db_prod.py para garantir que todas as colunas existem
 """
 import time
+from datetime import datetime
 from app.database import SessionLocal, engine
 from sqlalchemy import text, inspect
 from sqlalchemy.exc import OperationalError
@@ -63,6 +64,213 @@ def add_column_if_not_exists(table_name, column_name, column_type):
     finally:
         db.close()
 
+def create_index_if_not_exists(index_name, table_name, columns, where=None, unique=False):
+    """Cria um índice se ele não existir (colunas e WHERE em SQL)"""
+    db = SessionLocal()
+    try:
+        sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})"
+        if where:
+            sql += f" WHERE {where}"
+        db.execute(text(sql))
+        db.commit()
+        logger.info(f"✓ Índice {index_name} verificado/criado")
+    except Exception as e:
+        logger.error(f"❌ Erro ao criar índice {index_name}: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def popular_data_devolucao_local(lote=1000):
+    """Preenche coletas.data_devolucao_local (data da devolução no Brasil) nas coletas antigas"""
+    from app.serializacao import data_br
+    
+    db = SessionLocal()
+    try:
+        if engine.dialect.name == "postgresql":
+            resultado = db.execute(text(
+                "UPDATE coletas SET data_devolucao_local = "
+                "((data_devolucao AT TIME ZONE 'UTC') AT TIME ZONE 'America/Sao_Paulo')::date "
+                "WHERE data_devolucao IS NOT NULL AND data_devolucao_local IS NULL"
+            ))
+            db.commit()
+            logger.info(f"✓ data_devolucao_local preenchida em {resultado.rowcount} coletas")
+            return
+        
+        total = 0
+        while True:
+            linhas = db.execute(text(
+                "SELECT id, data_devolucao FROM coletas "
+                "WHERE data_devolucao IS NOT NULL AND data_devolucao_local IS NULL LIMIT :lote"
+            ), {"lote": lote}).all()
+            if not linhas:
+                break
+            db.execute(
+                text("UPDATE coletas SET data_devolucao_local = :dia WHERE id = :id"),
+                [{"id": id_, "dia": data_br(_como_datetime(dt))} for id_, dt in linhas]
+            )
+            db.commit()
+            total += len(linhas)
+        logger.info(f"✓ data_devolucao_local preenchida em {total} coletas")
+    except Exception as e:
+        logger.error(f"❌ Erro ao preencher data_devolucao_local: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _como_datetime(valor):
+    """SQLite devolve DATETIME como texto em consultas SQL puras"""
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    return valor
+
+def popular_km_diario():
+    """Cria a tabela km_diario e a popula se estiver vazia e já houver coletas"""
+    from app.modelos import KmDiario, Coleta, LoteArquivo, VersaoDados
+    from app.relatorios import reconstruir_km_diario
+    
+    KmDiario.__table__.create(bind=engine, checkfirst=True)
+    # A reconstrução também lê o arquivo frio (lotes_arquivo) e incrementa versao_dados,
+    # tabelas que o create_all só cria depois das migrações
+    LoteArquivo.__table__.create(bind=engine, checkfirst=True)
+    VersaoDados.__table__.create(bind=engine, checkfirst=True)
+    
+    db = SessionLocal()
+    try:
+        if db.query(KmDiario.id).first() is not None:
+            logger.info("✓ Tabela km_diario já populada")
+            return
+        if not inspect(engine).has_table("coletas") or db.query(Coleta.id).first() is None:
+            logger.info("✓ Nenhuma coleta para consolidar em km_diario")
+            return
+        
+        logger.info("Populando km_diario com o histórico de coletas e viagens...")
+        total = reconstruir_km_diario(db)
+        logger.info(f"✓ km_diario populada com {total} linhas")
+    except Exception as e:
+        logger.error(f"❌ Erro ao popular km_diario: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def criar_indice_coleta_ativa_unica(index_name, coluna, indice_antigo):
+    """
+    Cria o índice único parcial de coletas ativas por `coluna` e remove o índice comum antigo.
+    Se já houver coletas ativas duplicadas, não cria: lista as duplicadas para o admin resolver
+    (devolvendo as coletas em aberto) e mantém o índice antigo até a próxima execução.
+    """
+    verdadeiro = "true" if engine.dialect.name == "postgresql" else "1"
+    db = SessionLocal()
+    try:
+        duplicadas = db.execute(text(
+            f"SELECT {coluna}, COUNT(*) FROM coletas WHERE ativo = {verdadeiro} "
+            f"GROUP BY {coluna} HAVING COUNT(*) > 1"
+        )).all()
+    finally:
+        db.close()
+    
+    if duplicadas:
+        lista = ", ".join(f"{valor} ({total} coletas)" for valor, total in duplicadas)
+        logger.warning(f"⚠️ Índice {index_name} não criado: coletas ativas duplicadas por {coluna}: {lista}")
+        create_index_if_not_exists(indice_antigo, "coletas", coluna, where=f"ativo = {verdadeiro}")
+        return False
+    
+    create_index_if_not_exists(index_name, "coletas", coluna, where=f"ativo = {verdadeiro}", unique=True)
+    db = SessionLocal()
+    try:
+        db.execute(text(f"DROP INDEX IF EXISTS {indice_antigo}"))
+        db.commit()
+    finally:
+        db.close()
+    return True
+
+def popular_totais_viagens():
+    """Preenche total_viagens, total_km_viagens e viagem_aberta_id das coletas existentes"""
+    from app.relatorios import verificar_totais_viagens
+    
+    db = SessionLocal()
+    try:
+        corrigidas = verificar_totais_viagens(db, corrigir=True)
+        logger.info(f"✓ Totais de viagens preenchidos em {len(corrigidas)} coletas")
+    except Exception as e:
+        logger.error(f"❌ Erro ao preencher totais de viagens: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def particionar_tabela(tabela, coluna, meses_futuros=3):
+    """
+    Converte uma tabela (PostgreSQL) em particionada por mês de `coluna`, copiando as linhas.
+    A chave primária passa a ser (id, coluna), exigência do PostgreSQL para tabelas particionadas.
+    Roda numa única transação, com a tabela bloqueada durante a cópia.
+    """
+    from app.particoes import esta_particionada, criar_particoes_mensais, proximo_mes, inicio_do_mes, nome_particao_padrao
+    
+    with engine.begin() as conn:
+        if esta_particionada(conn, tabela):
+            logger.info(f"✓ Tabela {tabela} já é particionada")
+            return
+        
+        logger.info(f"Particionando {tabela} por mês de {coluna}...")
+        colunas = [col["name"] for col in inspect(conn).get_columns(tabela)]
+        conn.execute(text(f"LOCK TABLE {tabela} IN ACCESS EXCLUSIVE MODE"))
+        
+        # Linhas sem a chave de partição recebem criado_em (a chave não pode ser nula)
+        chave = f"COALESCE({coluna}, criado_em, timezone('utc', now()))" if coluna != "criado_em" else "COALESCE(criado_em, timezone('utc', now()))"
+        limites = conn.execute(text(f"SELECT MIN({chave}), MAX({chave}) FROM {tabela}")).one()
+        
+        conn.execute(text(f"ALTER TABLE {tabela} RENAME TO {tabela}_antiga"))
+        sequencia = conn.execute(text(f"SELECT pg_get_serial_sequence('{tabela}_antiga', 'id')")).scalar()
+        if sequencia:
+            conn.execute(text(f"ALTER SEQUENCE {sequencia} OWNED BY NONE"))
+        
+        conn.execute(text(
+            f"CREATE TABLE {tabela} (LIKE {tabela}_antiga INCLUDING DEFAULTS) PARTITION BY RANGE ({coluna})"
+        ))
+        conn.execute(text(f"ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL"))
+        
+        hoje = datetime.utcnow().date()
+        ate = inicio_do_mes(hoje)
+        for _ in range(meses_futuros):
+            ate = proximo_mes(ate)
+        criadas = criar_particoes_mensais(conn, tabela, (limites[0] or datetime.utcnow()).date(), max(ate, (limites[1] or datetime.utcnow()).date()))
+        conn.execute(text(f"CREATE TABLE {nome_particao_padrao(tabela)} PARTITION OF {tabela} DEFAULT"))
+        
+        lista = ", ".join(colunas)
+        selecao = ", ".join(chave if c == coluna else c for c in colunas)
+        copiadas = conn.execute(text(f"INSERT INTO {tabela} ({lista}) SELECT {selecao} FROM {tabela}_antiga")).rowcount
+        conn.execute(text(f"DROP TABLE {tabela}_antiga"))
+        
+        if sequencia:
+            conn.execute(text(f"ALTER SEQUENCE {sequencia} OWNED BY {tabela}.id"))
+        conn.execute(text(f"ALTER TABLE {tabela} ADD CONSTRAINT {tabela}_pkey PRIMARY KEY (id, {coluna})"))
+        conn.execute(text(f"ALTER TABLE {tabela} ADD CONSTRAINT {tabela}_coleta_id_fkey FOREIGN KEY (coleta_id) REFERENCES coletas (id)"))
+        conn.execute(text(f"CREATE INDEX ix_{tabela}_id ON {tabela} (id)"))
+        conn.execute(text(f"CREATE INDEX ix_{tabela}_coleta_id ON {tabela} (coleta_id)"))
+        conn.execute(text(f"CREATE INDEX ix_{tabela}_{coluna} ON {tabela} ({coluna})"))
+        
+        logger.info(f"✓ {tabela}: {copiadas} linhas copiadas para {criadas} partições mensais")
+
+def particionar_tabelas():
+    """Converte viagens e fotos em tabelas particionadas por mês (somente PostgreSQL)"""
+    from app.particoes import TABELAS_PARTICIONADAS
+    
+    if engine.dialect.name != "postgresql":
+        logger.info("Particionamento disponível apenas no PostgreSQL")
+        return False
+    if not wait_for_db():
+        return False
+    try:
+        for tabela, coluna in TABELAS_PARTICIONADAS.items():
+            particionar_tabela(tabela, coluna)
+        return True
+    except Exception as e:
+        logger.error(f"❌ Erro ao particionar tabelas: {e}")
+        return False
+
 def migrate_db():
     """Aplica todas as migrações necessárias"""
     logger.info("Iniciando migrações do banco de dados...")
@@ -75,6 +283,55 @@ def migrate_db():
         # Migração 1: Adicionar coluna km_atual na tabela veiculos
         add_column_if_not_exists("veiculos", "km_atual", "FLOAT")
         
+        # Migração 2: Data da devolução no horário do Brasil (indexada para filtros de período)
+        add_column_if_not_exists("coletas", "data_devolucao_local", "DATE")
+        popular_data_devolucao_local()
+        create_index_if_not_exists("ix_coletas_data_devolucao_local", "coletas", "data_devolucao_local")
+        create_index_if_not_exists("ix_coletas_usuario_devolucao_local", "coletas", "usuario_id, data_devolucao_local")
+        create_index_if_not_exists("ix_coletas_veiculo_devolucao_local", "coletas", "veiculo_id, data_devolucao_local")
+        
+        # Migração 3: Consolidação diária de KM (km_diario) - popular com o histórico
+        popular_km_diario()
+        
+        # Migração 4: Partições mensais dos próximos meses (se viagens/fotos já foram particionadas
+        # com "python migrate_db.py --particionar")
+        from app.particoes import garantir_particoes
+        garantir_particoes()
+        
+        # Migração 5: Índices dos acessos das rotas do motorista (coleta/viagem ativa), das
+        # buscas de viagens/fotos por coleta e do filtro de retirada da exportação detalhada
+        create_index_if_not_exists("ix_coletas_data_retirada", "coletas", "data_retirada")
+        create_index_if_not_exists("ix_viagens_coleta_id", "viagens", "coleta_id")
+        create_index_if_not_exists("ix_viagens_coleta_aberta", "viagens", "coleta_id", where="retorno_horario IS NULL")
+        create_index_if_not_exists("ix_viagens_saida_horario", "viagens", "saida_horario")
+        create_index_if_not_exists("ix_fotos_coleta_id", "fotos", "coleta_id")
+        create_index_if_not_exists("ix_fotos_criado_em", "fotos", "criado_em")
+        
+        # Migração 6: Índices da paginação por cursor (histórico do motorista e relatórios por motorista/veículo)
+        create_index_if_not_exists("ix_coletas_usuario_retirada", "coletas", "usuario_id, data_retirada")
+        create_index_if_not_exists("ix_coletas_usuario_devolucao", "coletas", "usuario_id, data_devolucao")
+        create_index_if_not_exists("ix_coletas_veiculo_devolucao", "coletas", "veiculo_id, data_devolucao")
+        
+        # Migração 7: No máximo uma coleta ativa por motorista e por veículo (índices únicos parciais,
+        # substituem os índices ix_coletas_*_ativa da migração 5)
+        criar_indice_coleta_ativa_unica("uq_coletas_usuario_ativa", "usuario_id", "ix_coletas_usuario_ativa")
+        criar_indice_coleta_ativa_unica("uq_coletas_veiculo_ativa", "veiculo_id", "ix_coletas_veiculo_ativa")
+        
+        # Migração 8: Totais de viagens na coleta (mantidos por sair/retornar) - popular com o histórico
+        totais_novos = not column_exists("coletas", "total_viagens")
+        add_column_if_not_exists("coletas", "total_viagens", "INTEGER")
+        add_column_if_not_exists("coletas", "total_km_viagens", "FLOAT")
+        add_column_if_not_exists("coletas", "viagem_aberta_id", "INTEGER NULL")
+        if totais_novos:
+            popular_totais_viagens()
+        
+        # Migração 9: Processamento das fotos depois do upload (status "processando" -> "pronta")
+        add_column_if_not_exists("fotos", "status", "VARCHAR(20) DEFAULT 'pronta'")
+        add_column_if_not_exists("fotos", "arquivo_recebido", "VARCHAR")
+        add_column_if_not_exists("fotos", "reservada_em", "TIMESTAMP")
+        add_column_if_not_exists("fotos", "tentativas", "INTEGER")
+        create_index_if_not_exists("ix_fotos_processando", "fotos", "reservada_em", where="status = 'processando'")
+        
         logger.info("✓ Todas as migrações aplicadas com sucesso!")
         return True
         
@@ -83,4 +340,8 @@ def migrate_db():
         return False
 
 if __name__ == "__main__":
-    migrate_db()
+    import sys
+    if "--particionar" in sys.argv:
+        particionar_tabelas()
+    else:
+        migrate_db()
@@ -0,0 +1,30 @@
+"""
+Script para reconstruir a consolidação diária de KM (tabela km_diario)
+Execute após a migração para popular a tabela com o histórico existente,
+ou sempre que precisar corrigir divergências
+"""
+import logging
+from app.database import SessionLocal, engine
+from app.modelos import KmDiario
+from app.relatorios import reconstruir_km_diario
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    KmDiario.__table__.create(bind=engine, checkfirst=True)
+    
+    db = SessionLocal()
+    try:
+        logger.info("Reconstruindo km_diario a partir de coletas e viagens...")
+        total = reconstruir_km_diario(db)
+        logger.info(f"✓ km_diario reconstruída: {total} linhas")
+    except Exception as e:
+        logger.error(f"❌ Erro ao reconstruir km_diario: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Verificação dos planos de execução das queries da API
+
+Executa uma rodada do benchmark (todas as rotas, em processo) guardando as queries
+de cada rota e roda EXPLAIN em cada uma. Falha (código de saída 1) se alguma query
+fizer varredura completa (SCAN / Seq Scan) de uma tabela grande que não esteja na
+lista de varreduras esperadas abaixo (SCAN de um índice parcial não conta: só percorre
+as linhas do predicado). Serve como teste de regressão dos índices.
+
+Uso (banco de teste, já que as rotas de escrita são exercitadas):
+    python gerar_dados_sinteticos.py --perfil medio --recriar
+    python verificar_planos.py
+    python verificar_planos.py --saida data/benchmark/planos.json
+
+O gerador termina com ANALYZE; num banco populado de outra forma rode ANALYZE antes,
+pois sem estatísticas o planejador pode preferir Seq Scan mesmo com o índice disponível.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from sqlalchemy import func
+from app.database import SessionLocal, engine
+from app.modelos import Coleta, Viagem, Foto, KmDiario
+from benchmark import contador_queries, executar
+
+# Tabelas que crescem com o uso; varrer as outras (usuarios, veiculos...) é aceitável
+TABELAS_GRANDES = {
+    "coletas": Coleta,
+    "viagens": Viagem,
+    "fotos": Foto,
+    "km_diario": KmDiario,
+}
+
+# (rota, tabela): varreduras completas que fazem parte da rota. A rota vale também para
+# as variações com parâmetros ("admin.relatorios.consolidado" cobre "...consolidado[dia]")
+VARREDURAS_ESPERADAS = {
+    # KM total de cada veículo (km_por_veiculo): soma todo o histórico consolidado
+    ("admin.relatorios", "km_diario"): "KM total dos veículos (todo o histórico)",
+    ("admin.relatorios.detalhado", "km_diario"): "KM total dos veículos (todo o histórico)",
+}
+
+
+def _tabela_base(nome: str):
+    """Tabela grande a que um nome do plano se refere (alias coletas_1, partição viagens_p2024_01...)"""
+    nome = nome.strip('"').lower()
+    for tabela in TABELAS_GRANDES:
+        if re.fullmatch(rf"{tabela}(_\d+|_p\d{{4}}_\d{{2}}|_padrao)?", nome):
+            return tabela
+    return None
+
+
+def _indice_parcial(conn, tabela: str, indice: str) -> bool:
+    """Se o índice do SQLite tem WHERE (só as linhas do predicado, ex.: fotos "processando")"""
+    return bool(conn.exec_driver_sql(
+        "SELECT partial FROM pragma_index_list(?) WHERE name = ?", (tabela, indice)
+    ).scalar())
+
+
+def varreduras_sqlite(conn, statement, parametros):
+    linhas = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parametros).fetchall()
+    detalhes = [linha[-1] for linha in linhas]
+    tabelas = set()
+    for detalhe in detalhes:
+        # SCAN percorre a tabela inteira (também "SCAN coletas USING INDEX ...", que só evita a
+        # ordenação); SEARCH é uma busca limitada pelo índice. Exceção: SCAN de um índice
+        # parcial só percorre as linhas do predicado do índice
+        encontrado = re.match(r"SCAN (?:TABLE )?(\S+)(?: USING (?:COVERING )?INDEX (\S+))?", detalhe)
+        if not encontrado or not _tabela_base(encontrado.group(1)):
+            continue
+        tabela = _tabela_base(encontrado.group(1))
+        if encontrado.group(2) and _indice_parcial(conn, tabela, encontrado.group(2)):
+            continue
+        tabelas.add(tabela)
+    return tabelas, detalhes
+
+
+def _nos_plano(no):
+    yield no
+    for filho in no.get("Plans", []):
+        yield from _nos_plano(filho)
+
+
+def varreduras_postgresql(conn, statement, parametros):
+    plano = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parametros).scalar()
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    tabelas = set()
+    detalhes = []
+    for no in _nos_plano(plano[0]["Plan"]):
+        relacao = no.get("Relation Name")
+        detalhes.append(f"{no['Node Type']} {relacao}" if relacao else no["Node Type"])
+        if no["Node Type"] == "Seq Scan" and relacao and _tabela_base(relacao):
+            tabelas.add(_tabela_base(relacao))
+    return tabelas, detalhes
+
+
+def contagens():
+    db = SessionLocal()
+    try:
+        return {nome: db.query(func.count(modelo.id)).scalar() for nome, modelo in TABELAS_GRANDES.items()}
+    finally:
+        db.close()
+
+
+def esperada(rota: str, tabela: str):
+    return next((
+        motivo for (nome, t), motivo in VARREDURAS_ESPERADAS.items()
+        if t == tabela and (rota == nome or rota.startswith(nome + "["))
+    ), None)
+
+
+def verificar(capturas, minimo_linhas: int):
+    """EXPLAIN de cada query distinta por rota; retorna (resultados, falhas)"""
+    linhas_tabelas = contagens()
+    grandes = {tabela for tabela, total in linhas_tabelas.items() if total >= minimo_linhas}
+    explicar = varreduras_postgresql if engine.dialect.name == "postgresql" else varreduras_sqlite
+
+    vistas = set()
+    resultados = []
+    falhas = []
+    with engine.connect() as conn:
+        for rota, statement, parametros in capturas:
+            if rota is None or not re.match(r"\s*(SELECT|UPDATE|DELETE|WITH)\b", statement, re.IGNORECASE):
+                continue
+            if (rota, statement) in vistas:
+                continue
+            vistas.add((rota, statement))
+
+            tabelas, detalhes = explicar(conn, statement, parametros)
+            varridas = sorted(tabelas & grandes)
+            inesperadas = [t for t in varridas if not esperada(rota, t)]
+            resultado = {"rota": rota, "sql": " ".join(statement.split()), "plano": detalhes,
+                         "varreduras": varridas, "inesperadas": inesperadas}
+            resultados.append(resultado)
+            if inesperadas:
+                falhas.append(resultado)
+        conn.rollback()
+    return linhas_tabelas, resultados, falhas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica os planos de execução das queries da API")
+    parser.add_argument("--minimo-linhas", type=int, default=1000,
+                        help="Tabelas com menos linhas que isso não são consideradas grandes (padrão: 1000)")
+    parser.add_argument("--apenas", help="Verifica apenas rotas cujo nome contém este texto")
+    parser.add_argument("--saida", help="Arquivo JSON com o plano de cada query")
+    args = parser.parse_args()
+
+    print(f"🔍 Verificando planos em {engine.url.render_as_string(hide_password=True)}")
+    contador_queries.capturas = []
+    executar(1, com_cache=False, filtro=args.apenas)
+    capturas, contador_queries.capturas = contador_queries.capturas, None
+
+    linhas_tabelas, resultados, falhas = verificar(capturas, args.minimo_linhas)
+    print(f"  {len(resultados)} queries distintas; linhas: " + ", ".join(f"{t}={n}" for t, n in linhas_tabelas.items()))
+    pequenas = [t for t, n in linhas_tabelas.items() if n < args.minimo_linhas]
+    if pequenas:
+        print(f"⚠️ Tabelas com menos de {args.minimo_linhas} linhas (não verificadas): {', '.join(pequenas)}")
+
+    if args.saida:
+        os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump({"banco": engine.dialect.name, "linhas": linhas_tabelas, "queries": resultados},
+                      arquivo, indent=2, ensure_ascii=False)
+        print(f"✓ Planos salvos em {args.saida}")
+
+    for resultado in resultados:
+        for tabela in resultado["varreduras"]:
+            if tabela not in resultado["inesperadas"]:
+                print(f"  (esperado) {resultado['rota']}: varredura de {tabela} - {esperada(resultado['rota'], tabela)}")
+
+    if falhas:
+        print(f"\n❌ {len(falhas)} queries com varredura completa de tabela grande:")
+        for falha in falhas:
+            print(f"\n  {falha['rota']} → {', '.join(falha['inesperadas'])}")
+            print(f"    {falha['sql'][:300]}")
+            for detalhe in falha["plano"]:
+                print(f"      {detalhe}")
+        sys.exit(1)
+    print("\n✓ Nenhuma varredura completa inesperada")
@@ -0,0 +1,46 @@
+"""
+Confere os totais de viagens gravados em cada coleta (total_viagens, total_km_viagens,
+viagem_aberta_id) com os valores calculados a partir da tabela de viagens.
+
+Os totais são mantidos pelas rotas de saída/retorno; divergências só aparecem depois de
+alterações feitas direto no banco ou de falhas. Sem --corrigir apenas lista (código de
+saída 1 se houver divergência); com --corrigir grava os valores calculados.
+
+Uso:
+    python verificar_totais_viagens.py
+    python verificar_totais_viagens.py --corrigir
+"""
+
+import argparse
+import sys
+from app.database import SessionLocal
+from app.relatorios import verificar_totais_viagens
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confere (e corrige) os totais de viagens das coletas")
+    parser.add_argument("--corrigir", action="store_true", help="Grava os totais calculados nas coletas divergentes")
+    parser.add_argument("--mostrar", type=int, default=20, help="Quantas divergências listar (padrão: 20)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print("🔍 Conferindo totais de viagens das coletas...")
+        divergencias = verificar_totais_viagens(db, corrigir=args.corrigir)
+    finally:
+        db.close()
+
+    if not divergencias:
+        print("✓ Todos os totais conferem")
+        sys.exit(0)
+
+    print(f"⚠️ {len(divergencias)} coletas com totais divergentes (viagens, km, viagem aberta):")
+    for coleta_id, gravado, calculado in divergencias[:args.mostrar]:
+        print(f"  coleta {coleta_id}: gravado {gravado} → calculado {calculado}")
+    if len(divergencias) > args.mostrar:
+        print(f"  ... e mais {len(divergencias) - args.mostrar}")
+
+    if args.corrigir:
+        print(f"✓ {len(divergencias)} coletas corrigidas")
+        sys.exit(0)
+    print("Rode com --corrigir para gravar os valores calculados")
+    sys.exit(1)
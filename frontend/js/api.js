@@ -2,10 +2,21 @@ class API {
     constructor() {
         this.base = window.location.origin;
         this.token = localStorage.getItem('token');
+        this.respostas = new Map();  // path -> { etag, texto } das respostas GET com ETag
+        // Idempotency-Key de escritas sem resposta (rede caiu): a próxima tentativa reusa a chave
+        this.chavesPendentes = new Map();  // "METHOD path" -> chave
+        this.chavesUpload = new WeakMap();  // File -> chave
+    }
+
+    novaChave() {
+        // crypto.randomUUID só existe em contexto seguro (HTTPS/localhost)
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
     }
 
     setToken(token) {
         this.token = token;
+        this.respostas.clear();
         localStorage.setItem('token', token);
     }
 
@@ -20,15 +31,45 @@ class API {
         const opts = { method, headers: this.headers() };
         if (body) opts.body = JSON.stringify(body);
         
+        // GET com ETag já recebido: pedir só se mudou (304 reutiliza o corpo guardado)
+        const emCache = method === 'GET' ? this.respostas.get(path) : null;
+        if (emCache) {
+            opts.headers['If-None-Match'] = emCache.etag;
+            opts.cache = 'no-store';  // a validação é feita aqui, não no cache HTTP do navegador
+        }
+        
+        // Escrita: a mesma chave até haver resposta, para o servidor não aplicar duas vezes
+        const operacao = `${method} ${path}`;
+        let chave = null;
+        if (method !== 'GET') {
+            chave = this.chavesPendentes.get(operacao) || this.novaChave();
+            this.chavesPendentes.set(operacao, chave);
+            opts.headers['Idempotency-Key'] = chave;
+        }
+        
         console.log(`[API] ${method} ${path}`, body);
         
         const res = await fetch(this.base + path, opts);
+        if (chave) {
+            // Houve resposta: a chave não é mais reusada; depois de um sucesso, as chaves pendentes
+            // de outras operações também não (a próxima tentativa delas é uma ação nova)
+            if (res.ok) this.chavesPendentes.clear();
+            else this.chavesPendentes.delete(operacao);
+        }
+        if (res.status === 304 && emCache) {
+            return JSON.parse(emCache.texto);
+        }
         if (!res.ok) {
             const err = await res.json();
             console.error(`[API ERROR] ${res.status}`, err);
             throw new Error(err.detail || 'Erro');
         }
-        return res.json();
+        
+        const etag = method === 'GET' ? res.headers.get('ETag') : null;
+        if (!etag) return res.json();
+        const texto = await res.text();
+        this.respostas.set(path, { etag, texto });
+        return JSON.parse(texto);
     }
 
     // AUTH
@@ -39,6 +80,11 @@ class API {
     retirar(veiculo_id, obs) { return this.req('POST', `/api/coleta/retirar/${veiculo_id}`, { observacoes: obs }); }
     ativa() { return this.req('GET', '/api/coleta/ativa'); }
     devolver(coleta_id, km, obs) { return this.req('POST', `/api/coleta/${coleta_id}/devolver`, { km, observacoes: obs }); }
+    // Operações feitas sem conexão, em ordem: [{ tipo: 'retirar'|'sair'|'retornar'|'devolver', veiculo_id, coleta_id, km, observacoes, horario }]
+    sync(operacoes) { return this.req('POST', '/api/coleta/sync', { operacoes }); }
+
+    // EVENTOS (SSE) - o EventSource não envia headers, o token vai na URL
+    eventos() { return new EventSource(`${this.base}/api/eventos?token=${encodeURIComponent(this.token)}`); }
 
     // ADMIN
     usuarios() { return this.req('GET', '/api/admin/usuarios'); }
@@ -53,10 +99,11 @@ class API {
     ajustarKmVeiculo(id, km_atual) { return this.req('PUT', `/api/admin/veiculos/${id}/km`, { km_atual }); }
 
     relatorios() { return this.req('GET', '/api/admin/relatorios'); }
-    relatorioUsuario(usuarioId, periodo, dataInicio, dataFim) {
+    relatorioUsuario(usuarioId, periodo, dataInicio, dataFim, cursor) {
         let url = `/api/admin/relatorios/usuario/${usuarioId}?periodo=${periodo || 'mes'}`;
         if (dataInicio) url += `&data_inicio=${dataInicio}`;
         if (dataFim) url += `&data_fim=${dataFim}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
         return this.req('GET', url);
     }
     relatorioPeriodo(periodo, dataInicio, dataFim) {
@@ -65,10 +112,11 @@ class API {
         if (dataFim) url += `&data_fim=${dataFim}`;
         return this.req('GET', url);
     }
-    relatorioVeiculo(veiculoId, periodo, dataInicio, dataFim) {
+    relatorioVeiculo(veiculoId, periodo, dataInicio, dataFim, cursor) {
         let url = `/api/admin/relatorios/veiculo/${veiculoId}?periodo=${periodo}`;
         if (dataInicio) url += `&data_inicio=${dataInicio}`;
         if (dataFim) url += `&data_fim=${dataFim}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
         return this.req('GET', url);
     }
     getFotosUsuario(usuarioId) { return this.req('GET', `/api/admin/fotos/${usuarioId}`); }
@@ -81,10 +129,15 @@ class API {
             const formData = new FormData();
             formData.append('file', arquivo);
             
+            // Mesma chave em todas as tentativas deste arquivo nesta coleta
+            if (!this.chavesUpload.has(arquivo)) this.chavesUpload.set(arquivo, this.novaChave());
+            const chave = `${this.chavesUpload.get(arquivo)}-${coletaId}`;
+            
             const opts = { 
                 method: 'POST',
                 headers: {
-                    ...(this.token && { 'Authorization': `Bearer ${this.token}` })
+                    ...(this.token && { 'Authorization': `Bearer ${this.token}` }),
+                    'Idempotency-Key': chave
                 },
                 body: formData
             };
@@ -92,9 +145,16 @@ class API {
             console.log(`[API] POST ${this.base}/api/coleta/${coletaId}/upload-foto`);
             console.log(`[API] FormData enviado com arquivo: ${arquivo.name} (${arquivo.type})`);
             
-            const res = await fetch(this.base + `/api/coleta/${coletaId}/upload-foto`, opts);
-            
-            console.log(`[API] Resposta recebida: ${res.status} ${res.statusText}`);
+            // 503 = servidor ocupado processando fotos: esperar o Retry-After e reenviar (mesma chave)
+            let res;
+            for (let tentativa = 1; ; tentativa++) {
+                res = await fetch(this.base + `/api/coleta/${coletaId}/upload-foto`, opts);
+                console.log(`[API] Resposta recebida: ${res.status} ${res.statusText}`);
+                if (res.status !== 503 || tentativa >= 3) break;
+                const espera = Math.min(parseInt(res.headers.get('Retry-After') || '5', 10) || 5, 30);
+                console.warn(`[API] Servidor ocupado, nova tentativa em ${espera}s`);
+                await new Promise(resolve => setTimeout(resolve, espera * 1000));
+            }
             
             if (!res.ok) {
                 let err;
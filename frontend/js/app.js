@@ -205,6 +205,12 @@ async function mostrarTela() {
         }
         document.getElementById('motoristaScreen').classList.add('active');
         // Removido carregarVeiculos() daqui pois mostraRet() já faz isso
+        // Veículos retirados/devolvidos por outros motoristas aparecem sem recarregar a página
+        assinarEventosFrota(() => {
+            if (document.getElementById('painelRetirada').style.display !== 'none') {
+                carregarVeiculos();
+            }
+        });
     }
 }
 
@@ -631,33 +637,53 @@ async function carregarVeiculosAdmin() {
     } catch (e) { console.error(e); }
 }
 
-// Variável para controlar auto-refresh
-let veiculosRefreshInterval = null;
+// Eventos da frota em tempo real (SSE): as listas são recarregadas só quando algo muda
+let eventosFrota = null;
+let eventosFrotaRetry = null;
+let eventosFrotaDebounce = null;
+const EVENTOS_LISTA_VEICULOS = ['retirada', 'devolucao', 'veiculo', 'recarregar'];
 
-// Iniciar auto-refresh de veículos (a cada 30 segundos)
-function iniciarAutoRefreshVeiculos() {
-    // Limpar intervalo anterior se existir
-    if (veiculosRefreshInterval) {
-        clearInterval(veiculosRefreshInterval);
+// Assina os eventos e chama aoMudar (agrupando rajadas) quando a lista de veículos muda
+function assinarEventosFrota(aoMudar) {
+    pararEventosFrota();
+    eventosFrota = api.eventos();
+    eventosFrota.onmessage = (msg) => {
+        const evento = JSON.parse(msg.data);
+        if (!EVENTOS_LISTA_VEICULOS.includes(evento.tipo)) return;
+        clearTimeout(eventosFrotaDebounce);
+        eventosFrotaDebounce = setTimeout(aoMudar, 300);
+    };
+    eventosFrota.onerror = () => {
+        // O navegador reconecta sozinho (com Last-Event-ID); se desistiu (ex.: 401), tentar de novo depois
+        if (eventosFrota && eventosFrota.readyState === EventSource.CLOSED) {
+            pararEventosFrota();
+            eventosFrotaRetry = setTimeout(() => { aoMudar(); assinarEventosFrota(aoMudar); }, 30000);
+        }
+    };
+}
+
+function pararEventosFrota() {
+    if (eventosFrota) {
+        eventosFrota.close();
+        eventosFrota = null;
     }
-    
-    // Carregar agora
+    clearTimeout(eventosFrotaRetry);
+    clearTimeout(eventosFrotaDebounce);
+}
+
+// Lista de veículos do admin: carrega agora e depois a cada evento da frota
+function iniciarAutoRefreshVeiculos() {
     carregarVeiculosAdmin();
-    
-    // Auto-refresh a cada 30 segundos
-    veiculosRefreshInterval = setInterval(() => {
+    assinarEventosFrota(() => {
         if (user && user.admin) {
             carregarVeiculosAdmin();
         }
-    }, 30000); // 30 segundos
+    });
 }
 
-// Parar auto-refresh
+// Parar atualização automática
 function pararAutoRefreshVeiculos() {
-    if (veiculosRefreshInterval) {
-        clearInterval(veiculosRefreshInterval);
-        veiculosRefreshInterval = null;
-    }
+    pararEventosFrota();
 }
 
 async function criarVeiculo(e) {
@@ -706,6 +732,8 @@ let relatorioPeriodoAtivo = 'dia';
 let usuarioSelecionado = null;
 let usuariosDisponiveis = [];
 let fotosUsuarioSelecionado = null;
+let relatorioUsuarioAtual = null;  // Relatório do motorista exibido (páginas já carregadas)
+let relatorioUsuarioFiltro = null;  // Período usado para buscar as próximas páginas
 
 async function carregarUsuariosFotos() {
     try {
@@ -781,12 +809,20 @@ function renderizarFotosPorDia(dados) {
         });
 
         fotosOrdenadas.forEach(foto => {
-            const imgUrl = `${api.base}/uploads/${foto.caminho}`;
+            // Miniatura na grade e tamanho médio ao abrir (a foto completa tem 1920px)
+            const imgUrl = `${api.base}${foto.miniatura_url || `/uploads/${foto.caminho}`}`;
+            const mediaUrl = `${api.base}${foto.media_url || `/uploads/${foto.caminho}`}`;
             const horario = formatarHora(foto.criado_em || foto.data_upload);
             const etapa = etapaLabel(foto.etapa);
+            // Foto recebida e ainda não processada (ou sem arquivo): o arquivo final não existe
+            const imagem = foto.status === 'processando'
+                ? `<div class="foto-processando">Processando...</div>`
+                : foto.status === 'falhou'
+                ? `<div class="foto-processando">Foto indisponível</div>`
+                : `<img src="${imgUrl}" alt="Foto ${etapa}" loading="lazy" onerror="this.onerror=null; this.src='${api.base}/uploads/${foto.caminho}'" onclick="openFotoModal('${mediaUrl}')" />`;
             html += `
                 <div class="foto-card">
-                    <img src="${imgUrl}" alt="Foto ${etapa}" loading="lazy" onclick="openFotoModal('${imgUrl}')" />
+                    ${imagem}
                     <div class="foto-meta">
                         <span>${etapa}</span>
                         <span>${horario}</span>
@@ -1034,6 +1070,8 @@ async function carregarRelatorioPeriodo(periodo) {
             
             const relUsuario = await api.relatorioUsuario(usuarioSelecionado, periodo, dataInicio, dataFim);
             console.log('Dados do usuário:', relUsuario);
+            relatorioUsuarioAtual = relUsuario;
+            relatorioUsuarioFiltro = { usuario: usuarioSelecionado, periodo, dataInicio, dataFim };
             
             // Exibir relatório filtrado por usuário com veículos
             exibirRelatorioPeriodoUsuario(relUsuario);
@@ -1295,6 +1333,11 @@ function exibirRelatorioPeriodoUsuario(dados) {
                 </div>
             `;
         });
+        
+        // Próxima página (o relatório é paginado por cursor)
+        if (dados.paginacao && dados.paginacao.proximo_cursor) {
+            html += `<button id="btnCarregarMaisUsos" class="btn btn-secondary" onclick="carregarMaisUsosUsuario()">Carregar mais usos</button>`;
+        }
     } else {
         console.log('Nenhum uso encontrado no período');
         html += '<p>Nenhum uso de veículo registrado no período.</p>';
@@ -1312,6 +1355,35 @@ function exibirRelatorioPeriodoUsuario(dados) {
     div.innerHTML = html;
 }
 
+async function carregarMaisUsosUsuario() {
+    if (!relatorioUsuarioAtual || !relatorioUsuarioAtual.paginacao || !relatorioUsuarioAtual.paginacao.proximo_cursor) return;
+    
+    const botao = document.getElementById('btnCarregarMaisUsos');
+    if (botao) botao.disabled = true;
+    
+    try {
+        const f = relatorioUsuarioFiltro;
+        const pagina = await api.relatorioUsuario(f.usuario, f.periodo, f.dataInicio, f.dataFim, relatorioUsuarioAtual.paginacao.proximo_cursor);
+        
+        // O primeiro dia da nova página pode ser a continuação do último dia exibido
+        const dias = relatorioUsuarioAtual.uso_por_dia;
+        pagina.uso_por_dia.forEach(dia => {
+            const ultimo = dias[dias.length - 1];
+            if (ultimo && ultimo.data === dia.data) {
+                ultimo.usos = ultimo.usos.concat(dia.usos);
+            } else {
+                dias.push(dia);
+            }
+        });
+        relatorioUsuarioAtual.paginacao = pagina.paginacao;
+        exibirRelatorioPeriodoUsuario(relatorioUsuarioAtual);
+    } catch (e) {
+        console.error('Erro ao carregar mais usos:', e);
+        showNotification(`❌ Erro: ${e.message}`, 'error');
+        if (botao) botao.disabled = false;
+    }
+}
+
 function formatarData(dataStr) {
     if (!dataStr) return 'N/A';
     const [ano, mes, dia] = dataStr.split('-');